@@ -0,0 +1,293 @@
+"""
+响应缓存模块 - stale-while-revalidate
+缓存值即可直接发送的 JSON 响应体（bytes），前面带一行元数据，命中时无需反序列化。
+响应体按配置压缩存储（gzip，可选 zstd / brotli），元数据中记录编码；
+客户端 Accept-Encoding 匹配时直接发送压缩后的字节，不再由 GZipMiddleware 重新压缩。
+缓存条目携带软过期（soft TTL）与硬过期（hard TTL）：
+软过期前直接返回（FRESH）；软过期到硬过期之间先返回旧数据（STALE）并在后台刷新；
+硬过期后由存储自动删除，下一次请求回源（MISS）
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import dotenv
+from starlette.requests import Request
+from starlette.responses import Response
+
+from _guard import UpstreamUnavailable
+from _redis import get_key_bytes, get_many_bytes, set_key
+from _singleflight import upstream_flight
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 缓存值压缩编码: gzip / zstd / br / none（zstd、br 需要安装对应的包，不可用时回退 gzip）
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "gzip").lower()
+# 小于该大小（字节）的响应体不压缩
+CACHE_COMPRESSION_MIN_SIZE = int(os.getenv("CACHE_COMPRESSION_MIN_SIZE", 1000))
+
+FRESH = "FRESH"
+STALE = "STALE"
+MISS = "MISS"
+
+# 条目格式: b"@{meta}\n{body}"，旧格式（纯 JSON）按 FRESH 处理
+_META_PREFIX = b"@"
+
+# 持有后台刷新任务的引用，避免被垃圾回收
+_refresh_tasks: Set[asyncio.Task] = set()
+
+# 编码名（即 Content-Encoding 的值） -> (压缩函数, 解压函数)
+_CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "gzip": (lambda b: gzip.compress(b, compresslevel=6, mtime=0), gzip.decompress),
+}
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+
+    _CODECS["zstd"] = (_zstd.compress, _zstd.decompress)
+except ImportError:
+    try:
+        import zstandard as _zstd
+
+        _CODECS["zstd"] = (_zstd.ZstdCompressor().compress, _zstd.ZstdDecompressor().decompress)
+    except ImportError:
+        pass
+try:
+    import brotli as _brotli
+
+    _CODECS["br"] = (_brotli.compress, _brotli.decompress)
+except ImportError:
+    pass
+
+if CACHE_COMPRESSION not in _CODECS and CACHE_COMPRESSION != "none":
+    logger.warning(f"Cache codec {CACHE_COMPRESSION} is not available, falling back to gzip")
+    CACHE_COMPRESSION = "gzip"
+
+
+def compress(body: bytes) -> Tuple[bytes, Optional[str]]:
+    """
+    按配置压缩响应体
+    :return: (压缩后的字节, 编码名)，未压缩时编码名为 None
+    """
+    if CACHE_COMPRESSION == "none" or len(body) < CACHE_COMPRESSION_MIN_SIZE:
+        return body, None
+    return _CODECS[CACHE_COMPRESSION][0](body), CACHE_COMPRESSION
+
+
+def decompress(body: bytes, codec: Optional[str]) -> bytes:
+    """按编码名解压"""
+    if codec is None:
+        return body
+    return _CODECS[codec][1](body)
+
+
+def accepts_encoding(request: Request, codec: str) -> bool:
+    """
+    客户端 Accept-Encoding 是否接受该编码（忽略 q=0）
+    """
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() not in (codec, "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class CacheEntry:
+    """缓存条目，body 为按 codec 编码后的响应体"""
+    __slots__ = ('body', 'stored_at', 'soft_ttl', 'codec')
+
+    def __init__(self, body: bytes, stored_at: float, soft_ttl: Optional[float], codec: Optional[str] = None):
+        self.body = body
+        self.stored_at = stored_at
+        self.soft_ttl = soft_ttl
+        self.codec = codec
+
+    def decoded(self) -> bytes:
+        """解压后的 JSON 响应体"""
+        return decompress(self.body, self.codec)
+
+    def state(self, now: Optional[float] = None) -> str:
+        """FRESH 或 STALE"""
+        if self.soft_ttl is None:
+            return FRESH
+        now = time.time() if now is None else now
+        return FRESH if now - self.stored_at < self.soft_ttl else STALE
+
+
+def render(data: Any) -> bytes:
+    """按 JSONResponse 相同的方式序列化响应体"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def pack(entry: CacheEntry) -> bytes:
+    """将条目打包为缓存值"""
+    meta = {"t": round(entry.stored_at, 3), "s": entry.soft_ttl}
+    if entry.codec:
+        meta["c"] = entry.codec
+    meta = json.dumps(meta, separators=(',', ':')).encode()
+    return b"".join((_META_PREFIX, meta, b"\n", entry.body))
+
+
+def unpack(raw: bytes) -> CacheEntry:
+    """解析缓存值，只解析元数据行，响应体保持原样"""
+    if raw.startswith(_META_PREFIX):
+        meta, _, body = raw[1:].partition(b"\n")
+        meta = json.loads(meta)
+        return CacheEntry(body, meta["t"], meta["s"], meta.get("c"))
+    return CacheEntry(raw, time.time(), None)
+
+
+def cached_response(request: Request, entry: CacheEntry, state: str, status_code: int = 200) -> Response:
+    """
+    直接发送响应体，缓存状态放在 X-Cache 头中
+    客户端接受条目的编码时原样发送压缩字节，否则解压后发送
+    """
+    headers = {"X-Cache": state}
+    if entry.codec is None:
+        body = entry.body
+    elif accepts_encoding(request, entry.codec):
+        body = entry.body
+        headers["Content-Encoding"] = entry.codec
+        headers["Vary"] = "Accept-Encoding"
+    else:
+        body = entry.decoded()
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+async def cache_get(key: str) -> Optional[CacheEntry]:
+    """
+    读取缓存条目
+    :param key: 缓存键
+    :return: CacheEntry，不存在返回 None
+    """
+    raw = await get_key_bytes(key)
+    if raw is None:
+        return None
+    try:
+        return unpack(raw)
+    except Exception as e:
+        logger.warning(f"Corrupted cache entry {key}: {e}")
+        return None
+
+
+async def cache_get_many(keys: List[str]) -> List[Optional[CacheEntry]]:
+    """
+    一次往返读取多个缓存条目
+    :param keys: 缓存键列表
+    :return: 与 keys 对应的 CacheEntry 列表，不存在为 None
+    """
+    entries = []
+    for key, raw in zip(keys, await get_many_bytes(keys)):
+        entry = None
+        if raw is not None:
+            try:
+                entry = unpack(raw)
+            except Exception as e:
+                logger.warning(f"Corrupted cache entry {key}: {e}")
+        entries.append(entry)
+    return entries
+
+
+async def cache_set(key: str, body: bytes, soft_ttl: Optional[int], hard_ttl: int) -> CacheEntry:
+    """
+    压缩并写入缓存条目
+    :param key: 缓存键
+    :param body: 序列化后的响应体
+    :param soft_ttl: 软过期（秒），过后返回旧数据并后台刷新；None 表示不会变旧
+    :param hard_ttl: 硬过期（秒），存储层的真实过期时间
+    :return: 写入的条目
+    """
+    compressed, codec = compress(body)
+    entry = CacheEntry(compressed, time.time(), soft_ttl, codec)
+    await set_key(key, pack(entry), ex=hard_ttl)
+    return entry
+
+
+async def _fill(key: str, fetch: Callable[[], Awaitable[Any]], soft_ttl: Optional[int],
+                hard_ttl: int) -> CacheEntry:
+    return await cache_set(key, render(await fetch()), soft_ttl, hard_ttl)
+
+
+async def cache_fill(key: str, fetch: Callable[[], Awaitable[Any]], soft_ttl: Optional[int],
+                     hard_ttl: int) -> CacheEntry:
+    """
+    回源并写入缓存（用于预热），与同键的请求共享同一次上游调用
+    """
+    return await upstream_flight.do(key, lambda: _fill(key, fetch, soft_ttl, hard_ttl))
+
+
+async def _peek_fresh(key: str) -> Optional[CacheEntry]:
+    entry = await cache_get(key)
+    if entry is None or entry.state() != FRESH:
+        return None
+    return entry
+
+
+async def _refresh(key: str, fetch: Callable[[], Awaitable[Any]], soft_ttl: Optional[int], hard_ttl: int):
+    try:
+        await upstream_flight.do(key, lambda: _fill(key, fetch, soft_ttl, hard_ttl),
+                                 peek=lambda: _peek_fresh(key))
+    except UpstreamUnavailable as e:
+        # 上游熔断期间继续提供旧数据
+        logger.info(f"Background refresh skipped for {key}: {e}")
+    except Exception as e:
+        logger.warning(f"Background refresh failed for {key}: {e}")
+
+
+def schedule_refresh(key: str, fetch: Callable[[], Awaitable[Any]], soft_ttl: Optional[int], hard_ttl: int):
+    """
+    后台刷新缓存，同一个键同时只会有一个刷新在进行
+    """
+    if upstream_flight.in_flight(key):
+        return
+    task = asyncio.create_task(_refresh(key, fetch, soft_ttl, hard_ttl))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def swr_fetch(key: str, fetch: Callable[[], Awaitable[Any]], soft_ttl: Optional[int],
+                    hard_ttl: int) -> Tuple[CacheEntry, str]:
+    """
+    按 stale-while-revalidate 策略获取缓存条目
+    :param key: 缓存键
+    :param fetch: 上游获取函数，返回可 JSON 序列化的数据；抛出异常时不写缓存
+    :param soft_ttl: 软过期（秒），None 表示只有硬过期
+    :param hard_ttl: 硬过期（秒）
+    :return: (CacheEntry, FRESH / STALE / MISS)
+    """
+    try:
+        entry = await cache_get(key)
+    except Exception as e:
+        logger.info(f"Cache lookup failed for {key}: {e}")
+        entry = None
+    return await swr_resolve(key, entry, fetch, soft_ttl, hard_ttl)
+
+
+async def swr_resolve(key: str, entry: Optional[CacheEntry], fetch: Callable[[], Awaitable[Any]],
+                      soft_ttl: Optional[int], hard_ttl: int) -> Tuple[CacheEntry, str]:
+    """
+    基于已读取的缓存条目完成 swr_fetch（用于批量读取后逐个处理）
+    :param entry: 已读取的条目，None 表示未命中
+    :return: (CacheEntry, FRESH / STALE / MISS)
+    """
+    if entry is not None:
+        state = entry.state()
+        if state == STALE:
+            schedule_refresh(key, fetch, soft_ttl, hard_ttl)
+        return entry, state
+
+    entry = await upstream_flight.do(key, lambda: _fill(key, fetch, soft_ttl, hard_ttl),
+                                     peek=lambda: _peek_fresh(key))
+    return entry, MISS
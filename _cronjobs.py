@@ -1,13 +1,37 @@
+import datetime
 import json
 import logging
+import math
+import os
+from collections import Counter
+from typing import List
 
+import dotenv
 from fastapi_utils.tasks import repeat_every
-from httpx import AsyncClient
 
-from _redis import delete_key, get_key, get_keys_by_pattern, redis_client, set_key as redis_set_key
+from _cache import cache_fill
+from _keyring import KEYRING_REFRESH_INTERVAL, key_ring
+from _redis import StoragePipeline, acquire_lock, delete_key, get_keys_by_pattern, get_many, key_exists, \
+    release_lock, set_key as redis_set_key
+from _trend import ALLOWED_PERIODS, ALLOWED_TYPE_IDS, trending_spec, trending_v2_spec
+from _upstream import get_upstream_client
+
+dotenv.load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# 热榜预热：零点前 TRENDING_PREWARM_LEAD 秒内提前写入明天的缓存键，避免零点所有键同时失效后集中回源
+TRENDING_PREWARM_ENABLED = os.getenv("TRENDING_PREWARM_ENABLED", "true").lower() == "true"
+TRENDING_PREWARM_LEAD = int(os.getenv("TRENDING_PREWARM_LEAD", 10 * 60))
+# v2 热榜始终预热的 amount 取值（接口默认 10）；此外预热当天客户端实际请求过的 amount，
+# 按请求过的类型数从多到少取，每个类型合计最多 TRENDING_PREWARM_MAX_AMOUNTS 个，且不超过 TRENDING_PREWARM_AMOUNT_LIMIT
+TRENDING_PREWARM_AMOUNTS = [a.strip() for a in os.getenv("TRENDING_PREWARM_AMOUNTS", "10").split(",") if a.strip()]
+TRENDING_PREWARM_MAX_AMOUNTS = int(os.getenv("TRENDING_PREWARM_MAX_AMOUNTS", 8))
+TRENDING_PREWARM_AMOUNT_LIMIT = int(os.getenv("TRENDING_PREWARM_AMOUNT_LIMIT", 100))
+
+# 本实例已确认预热完成的日期，避免重复查询标记
+_prewarmed_day = None
+
 
 async def logPushTask(taskId: str, data: dict):
     """
@@ -31,37 +55,37 @@ async def pushTaskExecQueue() -> bool:
             return False
         logger.info(f"Found {len(all_keys)} push tasks in the queue.")
 
-        async with AsyncClient() as client:
-            for key in all_keys:
-                value = await get_key(key)
-                if not value:
-                    continue
-
-                data = json.loads(value)
-                logger.info(f"Processing push task: {data}")
-                url = (
-                    f"{data['baseURL']}{data['msg']}?"
-                    f"icon={data['icon']}&"
-                    f"url={data['click_url']}&"
-                    f"passive={data['is_passive']}"
-                )
-                url.replace("//", "/").replace("https:/", "https://")
-                response = await client.post(url)
-                if response.status_code == 200:
-                    await delete_key(key)
-                    data['result'] = 'success'
-                    logger.info(f"Push task successful: {data}")
-                else:
-                    data['result'] = 'failed'
-                    logger.error(f"Failed to push task: {data}")
-
-                try:
-                    # taskID 取 pushTask: 后面的字符串
-                    taskID = key.split(":")[1]
-                    print(taskID)
-                    await logPushTask(taskID, data)
-                except Exception as e:
-                    logger.error(f"Failed to log push task: {e}", exc_info=True)
+        client = get_upstream_client()
+        values = await get_many(all_keys)
+        for key, value in zip(all_keys, values):
+            if not value:
+                continue
+
+            data = json.loads(value)
+            logger.info(f"Processing push task: {data}")
+            url = (
+                f"{data['baseURL']}{data['msg']}?"
+                f"icon={data['icon']}&"
+                f"url={data['click_url']}&"
+                f"passive={data['is_passive']}"
+            )
+            url.replace("//", "/").replace("https:/", "https://")
+            response = await client.post(url)
+            if response.status_code == 200:
+                await delete_key(key)
+                data['result'] = 'success'
+                logger.info(f"Push task successful: {data}")
+            else:
+                data['result'] = 'failed'
+                logger.error(f"Failed to push task: {data}")
+
+            try:
+                # taskID 取 pushTask: 后面的字符串
+                taskID = key.split(":")[1]
+                print(taskID)
+                await logPushTask(taskID, data)
+            except Exception as e:
+                logger.error(f"Failed to log push task: {e}", exc_info=True)
 
         return True
 
@@ -70,6 +94,117 @@ async def pushTaskExecQueue() -> bool:
         return False
 
 
+async def prewarmAmounts(day: datetime.date) -> List[str]:
+    """
+    v2 热榜需要预热的 amount：配置的取值加上指定日期缓存键中出现过的取值（即客户端实际请求过的）
+    :param day: 参考的日期（通常为今天）
+    :return: amount 列表
+    """
+    amounts = list(TRENDING_PREWARM_AMOUNTS)
+    try:
+        keys = await get_keys_by_pattern(f"trending_v2_cache_{day.strftime('%Y-%m-%d')}_*")
+    except Exception as e:
+        logger.warning(f"Failed to list requested trending amounts: {e}")
+        keys = []
+    observed = Counter(key.rsplit("_", 1)[-1] for key in keys)
+    for amount, _ in sorted(observed.items(), key=lambda item: (-item[1], item[0])):
+        if len(amounts) >= TRENDING_PREWARM_MAX_AMOUNTS:
+            break
+        if amount.isdigit() and 0 < int(amount) <= TRENDING_PREWARM_AMOUNT_LIMIT and amount not in amounts:
+            amounts.append(amount)
+    return amounts
+
+
+async def prewarmTrending(day: datetime.date, extra_ttl: int) -> int:
+    """
+    写入指定日期的热榜缓存，已存在的键跳过：
+    按周期的热榜为 ALLOWED_TYPE_IDS × ALLOWED_PERIODS（接口固定 amount=10），
+    v2 热榜为 ALLOWED_TYPE_IDS × prewarmAmounts
+    :param day: 缓存键中的日期
+    :param extra_ttl: 硬过期额外延长的秒数（距离该日期开始的时间）
+    :return: 失败的数量
+    """
+    failed = 0
+    amounts = await prewarmAmounts(day - datetime.timedelta(days=1))
+    specs = [trending_spec(typeID, period, 10, day)
+             for typeID in sorted(ALLOWED_TYPE_IDS) for period in sorted(ALLOWED_PERIODS)]
+    specs += [trending_v2_spec(typeID, amount, day)
+              for typeID in sorted(ALLOWED_TYPE_IDS) for amount in amounts]
+    # 一次往返检查所有键是否已存在
+    try:
+        async with StoragePipeline(transaction=False) as pipe:
+            for key, *_ in specs:
+                pipe.exists(key)
+            existing = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to check prewarmed keys: {e}")
+        existing = [0] * len(specs)
+    for (key, fetch, soft_ttl, hard_ttl), exists in zip(specs, existing):
+        if exists:
+            continue
+        try:
+            await cache_fill(key, fetch, soft_ttl, hard_ttl + extra_ttl)
+        except Exception as e:
+            failed += 1
+            logger.warning(f"Failed to prewarm {key}: {e}")
+    return failed
+
+
+@repeat_every(seconds=60, wait_first=True)
+async def prewarmTrendingCache() -> bool:
+    """
+    零点前预热明天的热榜缓存
+    多个实例通过锁选出一个执行，全部成功后写入完成标记，其它实例不再重复
+    :return: Boolean indicating whether this instance ran the prewarm.
+    """
+    global _prewarmed_day
+    if not TRENDING_PREWARM_ENABLED:
+        return False
+    now = datetime.datetime.now()
+    tomorrow = now.date() + datetime.timedelta(days=1)
+    until_rollover = (datetime.datetime.combine(tomorrow, datetime.time()) - now).total_seconds()
+    if until_rollover > TRENDING_PREWARM_LEAD or _prewarmed_day == tomorrow:
+        return False
+
+    done_key = f"prewarm:trending:{tomorrow}"
+    lock_name = f"{done_key}:lock"
+    try:
+        if await key_exists(done_key):
+            _prewarmed_day = tomorrow
+            return False
+        token = await acquire_lock(lock_name, TRENDING_PREWARM_LEAD * 1000)
+        if not token:
+            return False
+        try:
+            failed = await prewarmTrending(tomorrow, math.ceil(until_rollover))
+            if failed:
+                # 下一轮（仍在预热窗口内）重试失败的键
+                logger.warning(f"Trending prewarm for {tomorrow}: {failed} keys failed")
+            else:
+                await redis_set_key(done_key, "done", ex=2 * 60 * 60 * 24)
+                _prewarmed_day = tomorrow
+                logger.info(f"Trending cache prewarmed for {tomorrow}")
+        finally:
+            await release_lock(lock_name, token)
+        return True
+    except Exception as e:
+        logger.error(f"Error in prewarmTrendingCache: {e}", exc_info=True)
+        return False
+
+
+@repeat_every(seconds=KEYRING_REFRESH_INTERVAL, wait_first=True)
+async def maintainKeyRing() -> bool:
+    """
+    同步 Redis 中的 RSA 密钥环，并按配置轮换密钥
+    """
+    try:
+        await key_ring.maintain()
+        return True
+    except Exception as e:
+        logger.error(f"Error in maintainKeyRing: {e}", exc_info=True)
+        return False
+
+
 @repeat_every(seconds=3 * 60, wait_first=True)
 async def keerRedisAlive():
     """
@@ -77,7 +212,7 @@ async def keerRedisAlive():
     """
     await redis_set_key("alive", "yes", ex=60 * 60 * 24)
     # print("Redis is alive")
-    await redis_client.delete("alive")
+    await delete_key("alive")
     return True
 
 
@@ -1,55 +1,33 @@
 import base64
+import os
 from logging import getLogger
+from typing import List, Optional
 
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
+import dotenv
 from fastapi import Depends, Request, Response
 from fastapi.routing import APIRouter
-from fastapi_limiter.depends import RateLimiter
 
-from _redis import delete_key as redis_delete_key, get_key as redis_get_key, set_key as redis_set_key
+from _keyring import key_ring
+from _ratelimit import RateLimiter
+
+dotenv.load_dotenv()
 
 logger = getLogger(__name__)
 
+# 分块加密的请求最多包含的 RSA 块数（每块最多 190 字节明文，默认足够容纳 BATCH_MAX_OPS 个完整子操作）
+CRYPTO_MAX_CHUNKS = int(os.getenv("CRYPTO_MAX_CHUNKS", 32))
+
 cryptoRouter = APIRouter(prefix='/api/crypto', tags=['Crypto', 'Crypto Api'])
 
 
 async def init_crypto():
     """
-    初始化加密模块
+    初始化加密模块：加载密钥环，不存在时迁移旧密钥或生成新密钥
     :return:
     """
     try:
-        a = await redis_get_key("private_key")
-        b = await redis_get_key("public_key")
-        if a and b:
-            return True
-        else:
-            try:
-                await redis_delete_key("private_key")
-                await redis_delete_key("public_key")
-            except Exception as e:
-                pass
-            # 生成一对rsa密钥 并且保存到redis
-            private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048
-            )
-            public_key = private_key.public_key()
-            # 保存到redis
-            private_pem = private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            public_pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-            await redis_set_key("private_key", private_pem.decode())
-            await redis_set_key("public_key", public_pem.decode())
-
-            return True
+        await key_ring.load_or_create()
+        return True
     except Exception as e:
         raise Exception(f"Failed to init crypto: {e}")
 
@@ -58,53 +36,54 @@ async def init_crypto():
                         methods=['OPTIONS'], summary='Get Public Key', description='Get Public Key')
 async def get_public_key(request: Request):
     """
-    获取公钥
+    获取当前公钥，X-Key-Id 头为密钥 id，客户端可在请求信封中以 kid 字段带回
     :param request:
     :return:
     """
-    public_key = await redis_get_key("public_key")
-    return Response(content=public_key, media_type="text/plain")
+    if key_ring.current is None:
+        await key_ring.load_or_create()
+    return Response(content=key_ring.current.public_pem, media_type="text/plain",
+                    headers={"X-Key-Id": key_ring.current.kid})
 
 
-async def decryptData(data: str):
+async def decryptData(data: str, kid: Optional[str] = None):
     """
     解密数据
     :param data: str
+    :param kid: 密钥 id，为空时依次尝试当前密钥和重叠窗口内的旧密钥
     :return:
     """
     try:
-        private_key = await redis_get_key("private_key")
-    except Exception as e:
-        raise Exception(f"redis error")
-    try:
-        private_key_data = await redis_get_key("private_key")
-
-        # 检查是否正确获取了私钥
-        if not private_key_data:
-            raise Exception("Internal Server Error")
-
-        private_key = serialization.load_pem_private_key(
-            private_key_data.encode(),
-            password=None
-        )
-
         # 使用 Base64 解码
         encrypted_data = base64.b64decode(data)
 
         # 解密数据
-        decrypted_data = private_key.decrypt(
-            encrypted_data,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA1()),
-                algorithm=hashes.SHA1(),
-                label=None
-            )
-        )
-
-        # print("decrypted_data", decrypted_data.decode('utf-8'))
+        decrypted_data = await key_ring.decrypt(encrypted_data, kid)
 
         return decrypted_data.decode('utf-8')
 
     except Exception as e:
-        print(f"Decryption error: {e}")
+        logger.warning(f"Decryption error: {e}")
+        raise Exception("Unexpected error")
+
+
+async def decryptDataBatch(items: List[str], kid: Optional[str] = None) -> str:
+    """
+    解密分块加密的数据，所有密文在工作池中一次性解密
+    客户端按字节切分明文，多字节字符可能跨块，因此先按顺序拼接字节再整体解码
+    :param items: Base64 密文列表，最多 CRYPTO_MAX_CHUNKS 个
+    :param kid: 密钥 id
+    :return: 拼接后的明文，任意一块失败时抛出异常
+    """
+    if len(items) > CRYPTO_MAX_CHUNKS:
+        raise ValueError(f"Too many chunks: {len(items)} > {CRYPTO_MAX_CHUNKS}")
+    try:
+        results = await key_ring.decrypt_many([base64.b64decode(item) for item in items], kid)
+    except Exception as e:
+        logger.warning(f"Decryption error: {e}")
         raise Exception("Unexpected error")
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Decryption error: {result}")
+            raise Exception("Unexpected error")
+    return b"".join(results).decode('utf-8')
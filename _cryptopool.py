@@ -0,0 +1,153 @@
+"""
+RSA 解密工作池 - 将 RSA-OAEP 解密移出事件循环
+thread 模式使用线程池；process 模式使用进程池，私钥以 PEM 传入并在工作进程内按 kid 缓存解析结果；
+inline 模式在事件循环内直接解密（旧行为）。批量解密按工作数分片并行执行
+"""
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import dotenv
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+dotenv.load_dotenv()
+
+# 解密池模式: thread / process / inline
+CRYPTO_POOL_MODE = os.getenv("CRYPTO_POOL_MODE", "thread").lower()
+# 工作线程 / 进程数
+CRYPTO_POOL_WORKERS = int(os.getenv("CRYPTO_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA1()), algorithm=hashes.SHA1(), label=None)
+
+# 工作进程内已解析的私钥，按 kid 缓存
+_worker_keys: Dict[str, Any] = {}
+_WORKER_KEYS_MAX = 16
+
+
+def _decrypt_with(keys: List[Any], ciphertexts: List[bytes]) -> List[Union[bytes, Exception]]:
+    """依次尝试每个私钥解密，失败的位置返回异常对象"""
+    results = []
+    for ciphertext in ciphertexts:
+        error = ValueError("No key available")
+        for key in keys:
+            try:
+                results.append(key.decrypt(ciphertext, OAEP))
+                break
+            except ValueError as e:
+                error = e
+        else:
+            results.append(error)
+    return results
+
+
+def _thread_job(keys: List[Any], ciphertexts: List[bytes]):
+    start = time.perf_counter()
+    return _decrypt_with(keys, ciphertexts), time.perf_counter() - start
+
+
+def _process_job(pems: List[Tuple[str, bytes]], ciphertexts: List[bytes]):
+    start = time.perf_counter()
+    keys = []
+    for kid, pem in pems:
+        key = _worker_keys.get(kid)
+        if key is None:
+            if len(_worker_keys) >= _WORKER_KEYS_MAX:
+                _worker_keys.clear()
+            key = _worker_keys[kid] = serialization.load_pem_private_key(pem, password=None)
+        keys.append(key)
+    return _decrypt_with(keys, ciphertexts), time.perf_counter() - start
+
+
+class DecryptPool:
+    """RSA 解密工作池，记录排队深度与耗时"""
+
+    def __init__(self, mode: str, workers: int):
+        self.mode = mode if mode in ('thread', 'process', 'inline') else 'thread'
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+        self.jobs = 0
+        self.ciphertexts = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.broken = 0
+        self._wait_total = 0.0
+        self._exec_total = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rsa-decrypt")
+        return self._executor
+
+    async def _submit(self, keys, ciphertexts: List[bytes]) -> List[Union[bytes, Exception]]:
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        start = time.perf_counter()
+        self.jobs += 1
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            if self.mode == 'process':
+                job = loop.run_in_executor(executor, _process_job, [(key.kid, key.pem) for key in keys], ciphertexts)
+            else:
+                job = loop.run_in_executor(executor, _thread_job, [key.private_key for key in keys], ciphertexts)
+            results, elapsed = await job
+        except BrokenExecutor:
+            # 工作进程异常退出，下次调用时重建
+            self.broken += 1
+            self._executor = None
+            raise
+        finally:
+            self.inflight -= 1
+        self._exec_total += elapsed
+        self._wait_total += max(0.0, time.perf_counter() - start - elapsed)
+        return results
+
+    async def decrypt_many(self, keys, ciphertexts: List[bytes]) -> List[Union[bytes, Exception]]:
+        """
+        批量解密
+        :param keys: 候选密钥（RingKey），依次尝试
+        :param ciphertexts: 密文列表
+        :return: 与 ciphertexts 对应的明文列表，失败的位置为异常对象
+        """
+        self.ciphertexts += len(ciphertexts)
+        if not ciphertexts:
+            return []
+        if self.mode == 'inline':
+            return _decrypt_with([key.private_key for key in keys], ciphertexts)
+        size = math.ceil(len(ciphertexts) / self.workers)
+        parts = await asyncio.gather(*[
+            self._submit(keys, ciphertexts[i:i + size]) for i in range(0, len(ciphertexts), size)
+        ])
+        return [result for part in parts for result in part]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取解密池统计信息"""
+        finished = self.jobs - self.inflight
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'inflight': self.inflight,
+            'queued': max(0, self.inflight - self.workers),
+            'max_inflight': self.max_inflight,
+            'jobs': self.jobs,
+            'ciphertexts': self.ciphertexts,
+            'broken': self.broken,
+            'avg_wait_ms': round(self._wait_total / finished * 1000, 2) if finished else 0,
+            'avg_exec_ms': round(self._exec_total / finished * 1000, 2) if finished else 0,
+        }
+
+
+# 全局实例
+decrypt_pool = DecryptPool(CRYPTO_POOL_MODE, CRYPTO_POOL_WORKERS)
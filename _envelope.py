@@ -0,0 +1,153 @@
+"""
+混合加密信封模块 - RSA 包装 AES-GCM 会话密钥，后续请求只需对称解密
+信封格式（v=2）:
+    握手: {"v": 2, "timestamp": ts, "kid": 可选, "key": b64(RSA-OAEP(会话密钥)), "iv": b64(12 字节), "data": b64(密文+tag)}
+    复用: {"v": 2, "timestamp": ts, "sid": 会话 id, "iv": ..., "data": ...}
+会话 id 为 sha256(会话密钥) 的前 32 位十六进制，客户端可自行计算；timestamp 作为 AAD 参与认证，
+无法在不知道会话密钥的情况下修改。会话密钥缓存在进程内（有界、带 TTL），可选同时写入 Redis 供其它实例使用；
+会话过期或未知时，客户端重新携带 key 字段即可
+"""
+import base64
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import dotenv
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from _keyring import key_ring
+from _redis import get_key_bytes, set_key
+
+dotenv.load_dotenv()
+
+# 会话密钥有效期（秒）与进程内最多缓存的会话数
+SESSION_KEY_TTL = int(os.getenv("SESSION_KEY_TTL", 30 * 60))
+SESSION_KEY_MAX = int(os.getenv("SESSION_KEY_MAX", 10000))
+# 是否通过 Redis 在实例间共享会话密钥
+SESSION_KEY_SHARED = os.getenv("SESSION_KEY_SHARED", "true").lower() == "true"
+
+_SESSION_PREFIX = "session_key:"
+
+
+class EnvelopeError(Exception):
+    """信封格式错误或无法解密"""
+
+
+class SessionExpired(EnvelopeError):
+    """会话不存在或已过期，客户端需要重新携带 key 字段"""
+
+
+def session_id(session_key: bytes) -> str:
+    return hashlib.sha256(session_key).hexdigest()[:32]
+
+
+class SessionKeyCache:
+    """有界 LRU 会话密钥缓存，条目在写入 SESSION_KEY_TTL 秒后过期"""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._store: "OrderedDict[str, Tuple[AESGCM, float]]" = OrderedDict()
+        self.handshakes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _put(self, sid: str, session_key: bytes, expires_at: float):
+        self._store.pop(sid, None)
+        self._store[sid] = (AESGCM(session_key), expires_at)
+        while len(self._store) > self.max_size:
+            self._store.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, sid: str) -> Optional[AESGCM]:
+        """按会话 id 取出 AESGCM 实例，依次查找进程内缓存和 Redis"""
+        item = self._store.get(sid)
+        if item is not None:
+            if item[1] > time.time():
+                self._store.move_to_end(sid)
+                self.hits += 1
+                return item[0]
+            self._store.pop(sid, None)
+        if SESSION_KEY_SHARED:
+            raw = await get_key_bytes(_SESSION_PREFIX + sid)
+            if raw:
+                expires_at, session_key = float(raw[:raw.index(b":")]), raw[raw.index(b":") + 1:]
+                if expires_at > time.time() and session_id(session_key) == sid:
+                    self._put(sid, session_key, expires_at)
+                    self.shared_hits += 1
+                    return self._store[sid][0]
+        self.misses += 1
+        return None
+
+    async def add(self, session_key: bytes) -> Tuple[str, AESGCM]:
+        """缓存新解包的会话密钥"""
+        sid = session_id(session_key)
+        expires_at = time.time() + self.ttl
+        self._put(sid, session_key, expires_at)
+        self.handshakes += 1
+        if SESSION_KEY_SHARED:
+            await set_key(_SESSION_PREFIX + sid, f"{expires_at:.3f}:".encode() + session_key, ex=self.ttl)
+        return sid, self._store[sid][0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话密钥缓存统计信息"""
+        return {
+            'sessions': len(self._store),
+            'max_sessions': self.max_size,
+            'ttl': self.ttl,
+            'shared': SESSION_KEY_SHARED,
+            'handshakes': self.handshakes,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def is_hybrid(data: dict) -> bool:
+    """是否为混合加密信封"""
+    return isinstance(data, dict) and str(data.get('v')) == "2"
+
+
+async def open_envelope(data: dict) -> str:
+    """
+    解开混合加密信封
+    :param data: 请求体
+    :return: 明文字符串
+    :raises SessionExpired: 只有 sid 且会话已失效
+    :raises EnvelopeError: 格式错误或认证失败
+    """
+    try:
+        iv = base64.b64decode(data['iv'])
+        ciphertext = base64.b64decode(data['data'])
+        aad = str(data['timestamp']).encode()
+    except Exception:
+        raise EnvelopeError("Malformed envelope")
+
+    aesgcm = None
+    sid = data.get('sid')
+    if sid:
+        aesgcm = await session_keys.get(str(sid))
+    if aesgcm is None:
+        if not data.get('key'):
+            raise SessionExpired("Session expired")
+        try:
+            session_key = await key_ring.decrypt(base64.b64decode(data['key']), data.get('kid'))
+        except Exception:
+            raise EnvelopeError("Invalid session key")
+        if len(session_key) not in (16, 24, 32):
+            raise EnvelopeError("Invalid session key length")
+        sid, aesgcm = await session_keys.add(session_key)
+
+    try:
+        return aesgcm.decrypt(iv, ciphertext, aad).decode('utf-8')
+    except Exception:
+        raise EnvelopeError("Decryption failed")
+
+
+# 全局实例
+session_keys = SessionKeyCache(SESSION_KEY_MAX, SESSION_KEY_TTL)
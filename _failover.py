@@ -0,0 +1,206 @@
+"""
+存储故障切换模块 - Redis 运行中故障时切换到本地内存 KV，恢复后回放期间的写入
+连续 FAILOVER_FAILURE_THRESHOLD 次连接类错误后进入降级模式：读写都走本进程的内存 KV，
+写操作同时按键合并记入回写队列（只保留每个键的最后一次写入，过期时间记为绝对时间）；
+后台每 FAILOVER_PROBE_INTERVAL 秒探测 Redis，恢复后用管道回放队列（跳过已过期的键、按剩余时间设置过期），
+回放完成后切回 Redis，并清空 L1 与内存层，避免下次故障时读到旧数据。
+回放按“最后写入者胜出”处理冲突：降级期间其它实例直接写入 Redis 的同名键会被本进程队列中的值覆盖，
+因此不应在降级期间写入需要跨实例一致的键（如密钥环，见 _keyring.KeyRing.maintain）
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import dotenv
+from redis import exceptions as redis_exceptions
+
+from _l1cache import l1_cache
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 是否启用运行时故障切换（仅 Redis 模式）
+FAILOVER_ENABLED = os.getenv("FAILOVER_ENABLED", "true").lower() == "true"
+# 连续多少次连接错误后切换到内存 KV
+FAILOVER_FAILURE_THRESHOLD = int(os.getenv("FAILOVER_FAILURE_THRESHOLD", 3))
+# 降级期间探测 Redis 的间隔与超时（秒）
+FAILOVER_PROBE_INTERVAL = float(os.getenv("FAILOVER_PROBE_INTERVAL", 1))
+FAILOVER_PROBE_TIMEOUT = float(os.getenv("FAILOVER_PROBE_TIMEOUT", 1))
+# 回写队列最多保留的键数，超过后丢弃最早的写入
+FAILOVER_QUEUE_MAX = int(os.getenv("FAILOVER_QUEUE_MAX", 10000))
+
+_CONNECTION_ERRORS = (redis_exceptions.ConnectionError, redis_exceptions.TimeoutError, ConnectionError,
+                      asyncio.TimeoutError, OSError)
+
+_SET = "set"
+_DELETE = "delete"
+
+
+def is_connection_error(e: BaseException) -> bool:
+    """是否为连接类错误（命令本身的错误如 WRONGTYPE 不触发切换）"""
+    return isinstance(e, _CONNECTION_ERRORS)
+
+
+class StorageFailover:
+    """Redis 健康状态与降级期间的回写队列"""
+
+    def __init__(self, enabled: bool, threshold: int, queue_max: int):
+        self.enabled = enabled
+        self.threshold = max(1, threshold)
+        self.queue_max = queue_max
+        self.degraded = False
+        self.degraded_since = 0.0
+        self.failures = 0
+        # 键 -> (操作, 值, 过期时间戳)，按写入顺序排列
+        self._queue: "OrderedDict[str, Tuple[str, Any, Optional[float]]]" = OrderedDict()
+        self._probe_task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+        self.failovers = 0
+        self.recoveries = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self, e: BaseException, client=None, memory_kv=None) -> bool:
+        """
+        记录一次 Redis 错误，达到阈值时进入降级模式
+        :param client: Redis 客户端，用于后台探测
+        :param memory_kv: 降级期间使用的内存 KV，恢复后清空
+        :return: 当前是否处于降级模式
+        """
+        if not self.enabled or not is_connection_error(e):
+            return self.degraded
+        self.failures += 1
+        if not self.degraded and self.failures >= self.threshold and client is not None:
+            self.degraded = True
+            self.degraded_since = time.time()
+            self.failovers += 1
+            logger.warning(f"Redis unavailable ({e or type(e).__name__}), switching to memory KV")
+            self._probe_task = asyncio.create_task(self._probe_loop(client, memory_kv))
+        return self.degraded
+
+    def _prune_expired(self, now: float) -> int:
+        """从队列中删除已过期的写入"""
+        expired = [key for key, (op, _, expires_at) in self._queue.items()
+                   if op == _SET and expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._queue[key]
+        self.expired += len(expired)
+        return len(expired)
+
+    def _enqueue(self, key: str, item: Tuple[str, Any, Optional[float]]):
+        self._queue.pop(key, None)
+        self._queue[key] = item
+        if len(self._queue) > self.queue_max:
+            # 队列满时先腾出已过期的写入（每秒最多遍历一次），仍然超出再丢弃最早的写入
+            now = time.time()
+            if now - self._pruned_at >= 1:
+                self._pruned_at = now
+                self._prune_expired(now)
+        while len(self._queue) > self.queue_max:
+            self._queue.popitem(last=False)
+            self.dropped += 1
+
+    def queue_set(self, key: str, value: Any, ex: Optional[int] = None, px: Optional[int] = None):
+        """记录降级期间的写入，过期时间转换为绝对时间"""
+        expires_at = None
+        if px is not None:
+            expires_at = time.time() + px / 1000
+        elif ex is not None:
+            expires_at = time.time() + ex
+        self._enqueue(key, (_SET, value, expires_at))
+
+    def queue_delete(self, key: str):
+        """记录降级期间的删除"""
+        self._enqueue(key, (_DELETE, None, None))
+
+    async def _replay(self, client) -> int:
+        """用一次管道回放队列；失败时把未被新写入覆盖的条目放回队列"""
+        batch, self._queue = self._queue, OrderedDict()
+        now = time.time()
+        pipe = client.pipeline(transaction=False)
+        count = 0
+        for key, (op, value, expires_at) in batch.items():
+            if op == _DELETE:
+                pipe.delete(key)
+            elif expires_at is None:
+                pipe.set(key, value)
+            else:
+                px = int((expires_at - now) * 1000)
+                if px <= 0:
+                    self.expired += 1
+                    continue
+                pipe.set(key, value, px=px)
+            count += 1
+        try:
+            if count:
+                await pipe.execute()
+        except Exception:
+            # 旧条目排在降级期间新写入之前
+            merged = OrderedDict((key, item) for key, item in batch.items() if key not in self._queue)
+            merged.update(self._queue)
+            self._queue = merged
+            raise
+        self.replayed += count
+        return count
+
+    async def _probe_loop(self, client, memory_kv):
+        """降级期间周期性探测 Redis，恢复后回放队列并切回"""
+        if memory_kv is not None:
+            # 内存 KV 模式之外内存 KV 没有启动，降级期间同样需要清理过期键；不加载也不写入快照
+            await memory_kv.start(snapshot=False)
+        while self.degraded:
+            try:
+                await asyncio.sleep(FAILOVER_PROBE_INTERVAL)
+                await asyncio.wait_for(client.ping(), timeout=FAILOVER_PROBE_TIMEOUT)
+                # 回放期间仍可能有新的写入进入队列，直到队列清空再切回
+                while self._queue:
+                    await self._replay(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info(f"Redis still unavailable: {e or type(e).__name__}")
+                continue
+            self.degraded = False
+            self.failures = 0
+            self.recoveries += 1
+            l1_cache.clear()
+            if memory_kv is not None:
+                await memory_kv.flushdb()
+            logger.warning(f"Redis recovered after {time.time() - self.degraded_since:.1f}s, "
+                           f"{self.replayed} writes replayed in total")
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取故障切换状态"""
+        return {
+            'enabled': self.enabled,
+            'degraded': self.degraded,
+            'degraded_for': round(time.time() - self.degraded_since, 1) if self.degraded else 0,
+            'consecutive_failures': self.failures,
+            'queued_writes': len(self._queue),
+            'failovers': self.failovers,
+            'recoveries': self.recoveries,
+            'replayed': self.replayed,
+            'dropped': self.dropped,
+            'expired': self.expired,
+        }
+
+
+# 全局实例
+storage_failover = StorageFailover(FAILOVER_ENABLED, FAILOVER_FAILURE_THRESHOLD, FAILOVER_QUEUE_MAX)
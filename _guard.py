@@ -0,0 +1,224 @@
+"""
+上游保护模块 - 按上游接口的熔断器与自适应并发限制
+上游变慢或出错时快速失败，避免事件循环任务和连接堆积；
+调用方在快速失败时可继续使用缓存或过期数据
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import dotenv
+
+dotenv.load_dotenv()
+
+T = TypeVar("T")
+
+# 熔断：连续失败次数阈值、打开后多久进入半开（秒）
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", 5))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", 30))
+# 自适应并发限制（AIMD）：初始 / 最小 / 最大并发
+UPSTREAM_LIMIT_INITIAL = int(os.getenv("UPSTREAM_LIMIT_INITIAL", 20))
+UPSTREAM_LIMIT_MIN = int(os.getenv("UPSTREAM_LIMIT_MIN", 2))
+UPSTREAM_LIMIT_MAX = int(os.getenv("UPSTREAM_LIMIT_MAX", 200))
+# 超过该延迟（秒）视为过载，按比例收缩并发上限
+UPSTREAM_LATENCY_TARGET = float(os.getenv("UPSTREAM_LATENCY_TARGET", 2.0))
+UPSTREAM_LIMIT_BACKOFF = float(os.getenv("UPSTREAM_LIMIT_BACKOFF", 0.9))
+
+
+class UpstreamUnavailable(Exception):
+    """上游被熔断或超过并发限制，请求未发出"""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int = 1):
+        super().__init__(f"Upstream {endpoint} unavailable: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，reset_timeout 后半开放行一个探测请求"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """是否放行请求（半开状态下只放行一个探测）"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def retry_after(self) -> int:
+        """距离进入半开的剩余秒数"""
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(int(remaining + 0.999), 1)
+
+    def release_probe(self):
+        """探测请求被取消时允许下一个请求继续探测"""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = self.CLOSED
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'trips': self.trips,
+            'retry_after': self.retry_after() if self.state == self.OPEN else 0,
+        }
+
+
+class AdaptiveLimiter:
+    """AIMD 并发限制：成功且延迟正常时加性增长，失败或延迟过高时乘性收缩"""
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_target: float,
+                 backoff: float):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.inflight = 0
+        self.rejected = 0
+
+    def has_capacity(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    def acquire(self):
+        self.inflight += 1
+
+    def reject(self):
+        self.rejected += 1
+
+    def release(self, latency: float, ok: bool):
+        self.inflight -= 1
+        if ok and latency <= self.latency_target:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'limit': int(self.limit),
+            'inflight': self.inflight,
+            'rejected': self.rejected,
+        }
+
+
+class _Endpoint:
+    __slots__ = ('breaker', 'limiter', 'calls', 'failures', 'last_latency')
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET)
+        self.limiter = AdaptiveLimiter(UPSTREAM_LIMIT_INITIAL, UPSTREAM_LIMIT_MIN, UPSTREAM_LIMIT_MAX,
+                                       UPSTREAM_LATENCY_TARGET, UPSTREAM_LIMIT_BACKOFF)
+        self.calls = 0
+        self.failures = 0
+        self.last_latency = 0.0
+
+
+class UpstreamGuard:
+    """按上游接口名维护熔断器和并发限制"""
+
+    def __init__(self):
+        self._endpoints: Dict[str, _Endpoint] = {}
+
+    def _endpoint(self, name: str) -> _Endpoint:
+        ep = self._endpoints.get(name)
+        if ep is None:
+            ep = self._endpoints[name] = _Endpoint()
+        return ep
+
+    def is_open(self, name: str) -> bool:
+        """该接口当前是否处于熔断状态"""
+        ep = self._endpoints.get(name)
+        return ep is not None and ep.breaker.state == CircuitBreaker.OPEN
+
+    async def call(self, name: str, fn: Callable[[], Awaitable[T]],
+                   is_failure: Optional[Callable[[T], bool]] = None) -> T:
+        """
+        在熔断器和并发限制保护下执行上游调用
+        :param name: 上游接口名
+        :param fn: 发起请求的函数
+        :param is_failure: 根据返回值判断是否算作失败（例如 5xx）
+        :return: fn 的返回值
+        :raises UpstreamUnavailable: 熔断打开或超过并发限制时快速失败
+        """
+        ep = self._endpoint(name)
+        if not ep.limiter.has_capacity():
+            ep.limiter.reject()
+            raise UpstreamUnavailable(name, "concurrency limit reached")
+        if not ep.breaker.allow():
+            ep.limiter.reject()
+            raise UpstreamUnavailable(name, "circuit open", ep.breaker.retry_after())
+
+        ep.limiter.acquire()
+        ep.calls += 1
+        start = time.monotonic()
+        ok = False
+        try:
+            result = await fn()
+            ok = not (is_failure and is_failure(result))
+            return result
+        except asyncio.CancelledError:
+            # 调用方取消（例如客户端断开）不代表上游异常
+            ok = None
+            raise
+        finally:
+            latency = time.monotonic() - start
+            ep.last_latency = latency
+            if ok is None:
+                ep.limiter.inflight -= 1
+                ep.breaker.release_probe()
+            else:
+                ep.limiter.release(latency, ok)
+                if ok:
+                    ep.breaker.record_success()
+                else:
+                    ep.failures += 1
+                    ep.breaker.record_failure()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各上游接口的熔断与并发状态"""
+        return {
+            name: {
+                **ep.breaker.get_stats(),
+                **ep.limiter.get_stats(),
+                'calls': ep.calls,
+                'failures': ep.failures,
+                'last_latency_ms': round(ep.last_latency * 1000, 1),
+            }
+            for name, ep in self._endpoints.items()
+        }
+
+
+# 全局实例
+upstream_guard = UpstreamGuard()
@@ -0,0 +1,217 @@
+"""
+对冲请求与重试预算模块 - 针对幂等的上游 GET 请求
+对冲：首个请求超过该接口近期延迟的指定分位数仍未返回时再发一个，取先成功的结果；
+重试：网络异常或 5xx 时按带抖动的指数退避重试，所有重试和对冲共享一个全局预算，
+避免在上游故障时成倍放大流量
+"""
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import dotenv
+import httpx
+
+from _guard import UpstreamUnavailable
+
+dotenv.load_dotenv()
+
+T = TypeVar("T")
+
+# 是否启用对冲请求（默认关闭），以及启用对冲的上游接口
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"
+UPSTREAM_HEDGE_ROUTES = {r.strip() for r in os.getenv(
+    "UPSTREAM_HEDGE_ROUTES", "search,keywords,detail,trending,trending_v2").split(",") if r.strip()}
+# 对冲延迟取近期成功请求延迟的分位数，以及最小延迟（秒）
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", 95))
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", 0.05))
+# 每次请求最多重试次数，默认 0 不重试（按需开启）
+UPSTREAM_RETRY_MAX = int(os.getenv("UPSTREAM_RETRY_MAX", 0))
+# 重试预算：每个请求存入的额度比例、每秒保底额度、额度上限
+UPSTREAM_RETRY_BUDGET_RATIO = float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", 0.1))
+UPSTREAM_RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("UPSTREAM_RETRY_BUDGET_MIN_PER_SEC", 1))
+UPSTREAM_RETRY_BUDGET_MAX = float(os.getenv("UPSTREAM_RETRY_BUDGET_MAX", 20))
+# 退避：基础时间与上限（秒），实际等待为 [0, min(上限, 基础 * 2^n)] 内的随机值
+UPSTREAM_RETRY_BACKOFF_BASE = float(os.getenv("UPSTREAM_RETRY_BACKOFF_BASE", 0.1))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", 1.0))
+
+# 计算分位数需要的最少样本数
+_MIN_SAMPLES = 20
+_WINDOW = 256
+
+
+class RetryBudget:
+    """全局重试预算（令牌桶）：请求按比例存入额度，另有按时间补充的保底额度"""
+
+    def __init__(self, ratio: float, min_per_sec: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._last) * self.min_per_sec)
+        self._last = now
+
+    def deposit(self):
+        """每个原始请求存入 ratio 个额度"""
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        """取出一个额度用于重试或对冲，不足时返回 False"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _RouteStats:
+    __slots__ = ('latencies', 'requests', 'retries', 'retries_denied', 'hedges', 'hedge_wins',
+                 'hedges_denied')
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=_WINDOW)
+        self.requests = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_denied = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """近期延迟的分位数，样本不足时返回 None（不对冲）"""
+        if len(self.latencies) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, math.ceil(UPSTREAM_HEDGE_PERCENTILE / 100 * len(ordered)) - 1)
+        return max(ordered[max(index, 0)], UPSTREAM_HEDGE_MIN_DELAY)
+
+
+class RequestPolicy:
+    """为上游请求提供对冲与受预算限制的重试"""
+
+    def __init__(self, budget: RetryBudget):
+        self.budget = budget
+        self._routes: Dict[str, _RouteStats] = {}
+
+    def _route(self, name: str) -> _RouteStats:
+        stats = self._routes.get(name)
+        if stats is None:
+            stats = self._routes[name] = _RouteStats()
+        return stats
+
+    async def _timed(self, stats: _RouteStats, attempt: Callable[[], Awaitable[T]],
+                     is_failure: Callable[[T], bool]) -> T:
+        start = time.monotonic()
+        result = await attempt()
+        if not is_failure(result):
+            stats.latencies.append(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, stats: _RouteStats, attempt: Callable[[], Awaitable[T]],
+                      is_failure: Callable[[T], bool]) -> T:
+        delay = stats.hedge_delay()
+        first = asyncio.ensure_future(self._timed(stats, attempt, is_failure))
+        if delay is None:
+            return await first
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            if not self.budget.try_withdraw():
+                stats.hedges_denied += 1
+                return await first
+            stats.hedges += 1
+            second = asyncio.ensure_future(self._timed(stats, attempt, is_failure))
+            pending.add(second)
+            last = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and not is_failure(task.result()):
+                        if task is second:
+                            stats.hedge_wins += 1
+                        return task.result()
+                    last = task
+            # 两个请求都失败，按最后完成的结果返回或抛出
+            return last.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def run(self, route: str, attempt: Callable[[], Awaitable[T]],
+                  is_failure: Callable[[T], bool], retryable: Callable[[BaseException], bool]) -> T:
+        """
+        执行一次上游请求，必要时对冲和重试
+        :param route: 上游接口名
+        :param attempt: 发起一次请求的函数
+        :param is_failure: 根据返回值判断是否失败（失败的返回值可重试）
+        :param retryable: 根据异常判断是否可重试
+        :return: attempt 的返回值
+        """
+        stats = self._route(route)
+        stats.requests += 1
+        self.budget.deposit()
+        hedge = UPSTREAM_HEDGE_ENABLED and route in UPSTREAM_HEDGE_ROUTES
+        retries = 0
+        while True:
+            try:
+                if hedge:
+                    result = await self._hedged(stats, attempt, is_failure)
+                else:
+                    result = await self._timed(stats, attempt, is_failure)
+                if not is_failure(result) or retries >= UPSTREAM_RETRY_MAX:
+                    return result
+            except Exception as e:
+                if not retryable(e) or retries >= UPSTREAM_RETRY_MAX:
+                    raise
+                result = e
+            if not self.budget.try_withdraw():
+                stats.retries_denied += 1
+                if isinstance(result, Exception):
+                    raise result
+                return result
+            retries += 1
+            stats.retries += 1
+            await asyncio.sleep(random.uniform(0, min(UPSTREAM_RETRY_BACKOFF_MAX,
+                                                      UPSTREAM_RETRY_BACKOFF_BASE * 2 ** retries)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各接口的对冲与重试计数"""
+        routes = {}
+        for name, stats in self._routes.items():
+            delay = stats.hedge_delay()
+            routes[name] = {
+                'requests': stats.requests,
+                'retries': stats.retries,
+                'retries_denied': stats.retries_denied,
+                'hedges': stats.hedges,
+                'hedge_wins': stats.hedge_wins,
+                'hedges_denied': stats.hedges_denied,
+                'hedge_delay_ms': round(delay * 1000, 1) if delay is not None else None,
+            }
+        return {
+            'hedge_enabled': UPSTREAM_HEDGE_ENABLED,
+            'retry_budget_tokens': round(self.budget.tokens, 2),
+            'routes': routes,
+        }
+
+
+def is_retryable_error(e: BaseException) -> bool:
+    """网络层异常可重试；熔断/限流导致的快速失败不重试"""
+    if isinstance(e, UpstreamUnavailable):
+        return False
+    return isinstance(e, httpx.TransportError)
+
+
+# 全局实例
+upstream_policy = RequestPolicy(RetryBudget(UPSTREAM_RETRY_BUDGET_RATIO, UPSTREAM_RETRY_BUDGET_MIN_PER_SEC,
+                                            UPSTREAM_RETRY_BUDGET_MAX))
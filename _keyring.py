@@ -0,0 +1,298 @@
+"""
+RSA 密钥环模块 - 进程内缓存解析后的私钥对象
+密钥环保存在 Redis（crypto:keyring），每个密钥有 kid（公钥 DER 的 SHA-256 前 16 位十六进制）；
+只有版本号变化时才重新加载并解析新增的密钥，请求路径上不再读取 Redis 或解析 PEM。
+支持按周期轮换，轮换后旧密钥在重叠窗口内仍可解密；解密本身在 _cryptopool 的工作池中执行
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import dotenv
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from _cryptopool import decrypt_pool
+from _failover import storage_failover
+from _redis import acquire_lock, get_key, get_many, release_lock, set_many
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KEYRING_KEY = "crypto:keyring"
+KEYRING_VERSION_KEY = "crypto:keyring:version"
+KEYRING_LOCK = "crypto:keyring:lock"
+_LOCK_TTL_MS = 30000
+
+# 检查 Redis 中密钥环版本的间隔（秒）
+KEYRING_REFRESH_INTERVAL = int(os.getenv("KEYRING_REFRESH_INTERVAL", 30))
+# 自动轮换周期（秒），0 表示不轮换
+KEYRING_ROTATE_INTERVAL = int(os.getenv("KEYRING_ROTATE_INTERVAL", 0))
+# 轮换后旧密钥继续可用于解密的时间（秒）
+KEYRING_OVERLAP = int(os.getenv("KEYRING_OVERLAP", 24 * 60 * 60))
+KEYRING_KEY_SIZE = int(os.getenv("KEYRING_KEY_SIZE", 2048))
+
+
+def key_id(public_key) -> str:
+    """公钥指纹，作为密钥 id"""
+    der = public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return hashlib.sha256(der).hexdigest()[:16]
+
+
+def generate_private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=KEYRING_KEY_SIZE)
+
+
+class RingKey:
+    """解析后的密钥，expires_at 为 None 表示未进入退役倒计时"""
+    __slots__ = ('kid', 'private_key', 'pem', 'public_pem', 'created_at', 'expires_at')
+
+    def __init__(self, private_key, created_at: float, expires_at: Optional[float] = None):
+        self.private_key = private_key
+        self.kid = key_id(private_key.public_key())
+        self.pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        self.public_pem = private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        self.created_at = created_at
+        self.expires_at = expires_at
+
+    def private_pem(self) -> str:
+        return self.pem.decode()
+
+    def active(self, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        return self.expires_at is None or now < self.expires_at
+
+
+class KeyRing:
+    """进程内密钥环，current 用于加密方（客户端）获取公钥，所有未过期的密钥都可解密"""
+
+    def __init__(self):
+        self._keys: Dict[str, RingKey] = {}
+        self.current: Optional[RingKey] = None
+        self.version = 0
+        self._checked_at = 0.0
+        self._missing = False
+        self.reloads = 0
+        self.rotations = 0
+        self.unknown_kid = 0
+
+    def _apply(self, raw: str):
+        doc = json.loads(raw)
+        keys = {}
+        for item in doc['keys']:
+            key = self._keys.get(item['kid'])
+            if key is None:
+                # 只解析新增的密钥
+                private_key = serialization.load_pem_private_key(item['private'].encode(), password=None)
+                key = RingKey(private_key, item['created'])
+            key.expires_at = item.get('expires')
+            keys[key.kid] = key
+        self._keys = keys
+        self.current = keys[doc['current']]
+        self.version = doc['version']
+        self.reloads += 1
+
+    def _dump(self) -> str:
+        return json.dumps({
+            'version': self.version,
+            'current': self.current.kid,
+            'keys': [
+                {'kid': key.kid, 'private': key.private_pem(), 'created': key.created_at, 'expires': key.expires_at}
+                for key in self._keys.values()
+            ],
+        })
+
+    async def _save(self):
+        self.version += 1
+        # 一次事务写入，其它实例不会读到新版本号对应旧密钥环
+        await set_many({
+            KEYRING_KEY: self._dump(),
+            KEYRING_VERSION_KEY: str(self.version),
+            # 兼容旧键名：始终对应当前密钥
+            "private_key": self.current.private_pem(),
+            "public_key": self.current.public_pem,
+        })
+        self._missing = False
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Redis 中的版本号变化时重新加载
+        :param force: 忽略检查间隔
+        :return: 是否重新加载
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < KEYRING_REFRESH_INTERVAL:
+            return False
+        self._checked_at = now
+        raw = None
+        if self.current is None:
+            # 尚未加载时一定需要密钥环，与版本号一次读取
+            version, raw = await get_many([KEYRING_VERSION_KEY, KEYRING_KEY])
+        else:
+            version = await get_key(KEYRING_VERSION_KEY)
+        self._missing = version is None
+        if version is None or (int(version) == self.version and self.current is not None):
+            return False
+        raw = raw or await get_key(KEYRING_KEY)
+        if not raw:
+            return False
+        self._apply(raw)
+        logger.info(f"Key ring reloaded, version {self.version}, current {self.current.kid}")
+        return True
+
+    async def load_or_create(self):
+        """
+        启动时加载密钥环；不存在时迁移旧的 private_key，或生成新密钥
+        多个实例同时启动时只有持有锁的实例创建，其它实例等待后加载
+        """
+        if await self.refresh(force=True):
+            return
+        token = None
+        for _ in range(50):
+            token = await acquire_lock(KEYRING_LOCK, _LOCK_TTL_MS)
+            if token:
+                break
+            await asyncio.sleep(0.1)
+            if await self.refresh(force=True):
+                return
+        try:
+            if await self.refresh(force=True):
+                return
+            legacy = await get_key("private_key")
+            if legacy:
+                key = RingKey(serialization.load_pem_private_key(legacy.encode(), password=None), time.time())
+            else:
+                key = RingKey(generate_private_key(), time.time())
+            self._keys = {key.kid: key}
+            self.current = key
+            await self._save()
+            logger.info(f"Key ring created, current {key.kid}")
+        finally:
+            if token:
+                await release_lock(KEYRING_LOCK, token)
+
+    async def rotate(self) -> RingKey:
+        """生成新密钥作为当前密钥，其余密钥在重叠窗口后过期"""
+        now = time.time()
+        key = RingKey(generate_private_key(), now)
+        for old in self._keys.values():
+            if old.expires_at is None:
+                old.expires_at = now + KEYRING_OVERLAP
+        self._keys = {kid: old for kid, old in self._keys.items() if old.active(now)}
+        self._keys[key.kid] = key
+        self.current = key
+        await self._save()
+        self.rotations += 1
+        logger.info(f"Key ring rotated, current {key.kid}")
+        return key
+
+    def _rotation_due(self, now: float) -> bool:
+        return KEYRING_ROTATE_INTERVAL > 0 and now - self.current.created_at >= KEYRING_ROTATE_INTERVAL
+
+    async def maintain(self):
+        """
+        定时任务：同步 Redis 中的密钥环，按周期轮换、清理过期密钥，Redis 数据丢失时写回
+        写操作通过锁只由一个实例执行；Redis 故障切换期间跳过：此时读到的是本进程空的内存 KV，
+        若把密钥环当作丢失写回，恢复后的回放会覆盖其它实例在 Redis 中轮换后的密钥环
+        """
+        if storage_failover.degraded:
+            return
+        await self.refresh(force=True)
+        if self.current is None:
+            await self.load_or_create()
+            return
+        now = time.time()
+        expired = any(not key.active(now) for key in self._keys.values())
+        if not (self._missing or expired or self._rotation_due(now)):
+            return
+        token = await acquire_lock(KEYRING_LOCK, _LOCK_TTL_MS)
+        if not token:
+            return
+        try:
+            await self.refresh(force=True)
+            now = time.time()
+            if self._rotation_due(now):
+                await self.rotate()
+            elif self._missing or any(not key.active(now) for key in self._keys.values()):
+                self._keys = {kid: key for kid, key in self._keys.items() if key.active(now)}
+                await self._save()
+        finally:
+            await release_lock(KEYRING_LOCK, token)
+
+    def candidates(self, kid: Optional[str] = None) -> List[RingKey]:
+        """
+        可用于解密的密钥
+        :param kid: 信封中的密钥 id；为空时当前密钥优先，然后是重叠窗口内的旧密钥
+        """
+        now = time.time()
+        if kid:
+            key = self._keys.get(kid)
+            return [key] if key is not None and key.active(now) else []
+        keys = [self.current] if self.current is not None else []
+        keys += [key for key in self._keys.values() if key is not self.current and key.active(now)]
+        return keys
+
+    async def decrypt_many(self, ciphertexts: List[bytes], kid: Optional[str] = None) -> List[Union[bytes, Exception]]:
+        """
+        RSA-OAEP 批量解密，在工作池中执行
+        :param ciphertexts: 密文列表
+        :param kid: 密钥 id，可为空
+        :return: 与 ciphertexts 对应的明文列表，失败的位置为异常对象
+        """
+        if self.current is None:
+            await self.load_or_create()
+        keys = self.candidates(kid)
+        if not keys and kid:
+            self.unknown_kid += 1
+            # 可能是其它实例刚轮换的密钥，限制频率地从 Redis 重新加载
+            if time.monotonic() - self._checked_at >= 1 and await self.refresh(force=True):
+                keys = self.candidates(kid)
+            if not keys:
+                return [ValueError(f"Unknown key id: {kid}")] * len(ciphertexts)
+        return await decrypt_pool.decrypt_many(keys, ciphertexts)
+
+    async def decrypt(self, ciphertext: bytes, kid: Optional[str] = None) -> bytes:
+        """
+        RSA-OAEP 解密单个密文
+        :param ciphertext: 密文
+        :param kid: 密钥 id，可为空
+        :return: 明文
+        """
+        result = (await self.decrypt_many([ciphertext], kid))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取密钥环状态（不含密钥内容）"""
+        now = time.time()
+        return {
+            'version': self.version,
+            'current': self.current.kid if self.current is not None else None,
+            'keys': [
+                {'kid': key.kid, 'created': int(key.created_at),
+                 'expires': int(key.expires_at) if key.expires_at is not None else None,
+                 'active': key.active(now)}
+                for key in self._keys.values()
+            ],
+            'reloads': self.reloads,
+            'rotations': self.rotations,
+            'unknown_kid': self.unknown_kid,
+            'pool': decrypt_pool.get_stats(),
+        }
+
+
+# 全局实例
+key_ring = KeyRing()
@@ -0,0 +1,374 @@
+"""
+共享内存 KV 服务模块 - 同一主机上的多个 worker 共享一个 MemoryKV
+gunicorn 多 worker 的内存 KV 模式下，第一个绑定 unix socket 的 worker 成为宿主，
+在自己的事件循环里用 RESP 协议（Redis 协议子集）对外提供 MemoryKV；其它 worker 用
+redis 客户端连接该 socket，走与 Redis 模式相同的代码路径。
+宿主 worker 退出后 socket 失效，gunicorn 重启的 worker 会接管（配合快照可恢复数据）
+"""
+import asyncio
+import errno
+import fcntl
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import dotenv
+from redis.exceptions import NoScriptError, ResponseError
+
+from _memory_kv import MemoryKV, as_bytes
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 共享 socket 路径，为空表示每个 worker 使用独立的内存 KV
+MEMORY_KV_SHARED_SOCKET = os.getenv("MEMORY_KV_SHARED_SOCKET", "")
+
+
+class RespError(Exception):
+    """返回给客户端的错误"""
+
+
+class RespSimple(str):
+    """简单字符串回复（如 +PONG）"""
+
+
+def encode(value: Any) -> bytes:
+    """按 RESP2 编码回复"""
+    if value is None:
+        return b"$-1\r\n"
+    if value is True:
+        return b"+OK\r\n"
+    if isinstance(value, RespSimple):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, RespError):
+        return b"-" + str(value).encode() + b"\r\n"
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    data = as_bytes(value)
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    """读取一条命令（数组或内联格式），连接关闭返回 None"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        if not header.startswith(b"$"):
+            raise RespError("ERR Protocol error: expected '$'")
+        size = int(header[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+class KVServer:
+    """在 unix socket 上以 RESP 协议提供 MemoryKV"""
+
+    def __init__(self, kv: MemoryKV):
+        self.kv = kv
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.commands = 0
+        self._handlers: Dict[bytes, Callable[[List[bytes]], Awaitable[Any]]] = {
+            b"PING": self._ping,
+            b"ECHO": self._echo,
+            b"HELLO": self._hello,
+            b"GET": self._get,
+            b"SET": self._set,
+            b"DEL": self._del,
+            b"UNLINK": self._del,
+            b"EXISTS": self._exists,
+            b"MGET": self._mget,
+            b"MSET": self._mset,
+            b"INCR": self._incr,
+            b"INCRBY": self._incrby,
+            b"EXPIRE": self._expire,
+            b"PEXPIRE": self._pexpire,
+            b"TTL": self._ttl,
+            b"PTTL": self._pttl,
+            b"KEYS": self._keys,
+            b"SCAN": self._scan,
+            b"DBSIZE": self._dbsize,
+            b"ZADD": self._zadd,
+            b"ZREM": self._zrem,
+            b"ZSCORE": self._zscore,
+            b"ZCARD": self._zcard,
+            b"ZRANGEBYSCORE": self._zrangebyscore,
+            b"ZREMRANGEBYSCORE": self._zremrangebyscore,
+            b"SCRIPT": self._script,
+            b"EVAL": self._eval,
+            b"EVALSHA": self._evalsha,
+            b"CLIENT": self._ok,
+            b"SELECT": self._ok,
+        }
+
+    async def start(self, sock: socket.socket):
+        self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        queued: Optional[List[List[bytes]]] = None
+        try:
+            while True:
+                try:
+                    args = await read_command(reader)
+                except RespError as e:
+                    writer.write(encode(e))
+                    break
+                if args is None:
+                    break
+                if not args:
+                    continue
+                self.commands += 1
+                name = args[0].upper()
+                if name == b"MULTI":
+                    if queued is None:
+                        queued, reply = [], True
+                    else:
+                        reply = RespError("ERR MULTI calls can not be nested")
+                elif name in (b"EXEC", b"DISCARD"):
+                    if queued is None:
+                        reply = RespError(f"ERR {name.decode()} without MULTI")
+                    elif name == b"EXEC":
+                        # 排队的命令之间没有 await 切换，整体原子执行
+                        reply = [await self.execute(command) for command in queued]
+                    else:
+                        reply = True
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    reply = RespSimple("QUEUED")
+                else:
+                    reply = await self.execute(args)
+                writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def execute(self, args: List[bytes]) -> Any:
+        handler = self._handlers.get(args[0].upper())
+        if handler is None:
+            return RespError(f"ERR unknown command '{args[0].decode(errors='replace')}'")
+        try:
+            return await handler(args[1:])
+        except RespError as e:
+            return e
+        except NoScriptError as e:
+            return RespError(f"NOSCRIPT {e}")
+        except ResponseError as e:
+            return RespError(f"ERR {e}")
+        except (IndexError, ValueError):
+            return RespError(f"ERR wrong number or type of arguments for '{args[0].decode(errors='replace')}'")
+
+    async def _ok(self, args):
+        return True
+
+    async def _ping(self, args):
+        return args[0] if args else RespSimple("PONG")
+
+    async def _hello(self, args):
+        # 只支持 RESP2，客户端需以 protocol=2 连接
+        if args and args[0] != b"2":
+            raise RespError("NOPROTO unsupported protocol version")
+        return [b"server", b"memory-kv", b"proto", 2, b"mode", b"standalone", b"role", b"master"]
+
+    async def _echo(self, args):
+        return args[0]
+
+    async def _get(self, args):
+        value = await self.kv.get(args[0].decode())
+        return None if value is None else as_bytes(value)
+
+    async def _set(self, args):
+        key, value = args[0].decode(), args[1]
+        ex = px = None
+        nx = xx = get = False
+        i = 2
+        while i < len(args):
+            option = args[i].upper()
+            if option == b"EX":
+                ex, i = int(args[i + 1]), i + 1
+            elif option == b"PX":
+                px, i = int(args[i + 1]), i + 1
+            elif option == b"NX":
+                nx = True
+            elif option == b"XX":
+                xx = True
+            elif option == b"GET":
+                get = True
+            else:
+                raise RespError("ERR syntax error")
+            i += 1
+        old = await self.kv.get(key) if get or xx else None
+        if xx and old is None:
+            return None
+        ok = await self.kv.set(key, value, ex=ex, px=px, nx=nx)
+        if get:
+            return old
+        return True if ok else None
+
+    async def _del(self, args):
+        removed = 0
+        for key in args:
+            key = key.decode()
+            if await self.kv.exists(key):
+                await self.kv.delete(key)
+                removed += 1
+        return removed
+
+    async def _exists(self, args):
+        return sum([await self.kv.exists(key.decode()) for key in args])
+
+    async def _mget(self, args):
+        return [await self._get([key]) for key in args]
+
+    async def _mset(self, args):
+        if not args or len(args) % 2:
+            raise IndexError
+        return await self.kv.mset({args[i].decode(): args[i + 1] for i in range(0, len(args), 2)})
+
+    async def _incr(self, args):
+        return await self.kv.incr(args[0].decode())
+
+    async def _incrby(self, args):
+        return await self.kv.incr(args[0].decode(), int(args[1]))
+
+    async def _expire(self, args):
+        return int(await self.kv.expire(args[0].decode(), int(args[1])))
+
+    async def _pexpire(self, args):
+        return int(await self.kv.pexpire(args[0].decode(), int(args[1])))
+
+    async def _ttl(self, args):
+        return await self.kv.ttl(args[0].decode())
+
+    async def _pttl(self, args):
+        return await self.kv.pttl(args[0].decode())
+
+    async def _zadd(self, args):
+        # 不支持 NX/XX/GT/LT/CH/INCR 选项
+        if len(args) < 3 or len(args) % 2 == 0:
+            raise IndexError
+        return await self.kv.zadd(args[0].decode(),
+                                  {args[i + 1].decode(): float(args[i]) for i in range(1, len(args), 2)})
+
+    async def _zrem(self, args):
+        return await self.kv.zrem(args[0].decode(), *[member.decode() for member in args[1:]])
+
+    async def _zscore(self, args):
+        score = await self.kv.zscore(args[0].decode(), args[1].decode())
+        return None if score is None else repr(score).encode()
+
+    async def _zcard(self, args):
+        return await self.kv.zcard(args[0].decode())
+
+    async def _zrangebyscore(self, args):
+        withscores, start, num = False, None, None
+        i = 3
+        while i < len(args):
+            option = args[i].upper()
+            if option == b"WITHSCORES":
+                withscores = True
+            elif option == b"LIMIT":
+                start, num, i = int(args[i + 1]), int(args[i + 2]), i + 2
+            else:
+                raise RespError("ERR syntax error")
+            i += 1
+        items = await self.kv.zrangebyscore(args[0].decode(), args[1], args[2], start=start, num=num,
+                                            withscores=withscores)
+        if not withscores:
+            return items
+        return [value for member, score in items for value in (member, repr(score).encode())]
+
+    async def _zremrangebyscore(self, args):
+        return await self.kv.zremrangebyscore(args[0].decode(), args[1], args[2])
+
+    async def _keys(self, args):
+        return await self.kv.scan_iter(args[0].decode())
+
+    async def _scan(self, args):
+        # 游标为内存 KV 的槽号，与 Redis 相同：返回 0 表示扫描结束，COUNT 默认 10
+        match, count = "*", 10
+        for i in range(1, len(args) - 1):
+            option = args[i].upper()
+            if option == b"MATCH":
+                match = args[i + 1].decode()
+            elif option == b"COUNT":
+                count = int(args[i + 1])
+        cursor, keys = await self.kv.scan(int(args[0]), match, count)
+        return [str(cursor).encode(), keys]
+
+    async def _dbsize(self, args):
+        return self.kv.get_stats()['total_keys']
+
+    async def _script(self, args):
+        sub = args[0].upper()
+        if sub == b"LOAD":
+            return await self.kv.script_load(args[1].decode())
+        if sub == b"EXISTS":
+            return [int(found) for found in await self.kv.script_exists(*[sha.decode() for sha in args[1:]])]
+        if sub == b"FLUSH":
+            return True
+        raise RespError("ERR unknown subcommand")
+
+    async def _eval(self, args):
+        return await self.kv.eval(args[0].decode(), int(args[1]), *args[2:])
+
+    async def _evalsha(self, args):
+        return await self.kv.evalsha(args[0].decode(), int(args[1]), *args[2:])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'connections': self.connections,
+            'commands': self.commands,
+        }
+
+
+def elect_shared_host(path: str) -> Optional[socket.socket]:
+    """
+    选举宿主 worker：绑定成功的 worker 成为宿主并返回监听中的 socket，其它 worker 返回 None
+    socket 文件存在但无法连接时视为上一个宿主遗留，删除后重新绑定
+    """
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            for _ in range(2):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.bind(path)
+                    sock.listen(128)
+                    sock.setblocking(False)
+                    return sock
+                except OSError as e:
+                    sock.close()
+                    if e.errno != errno.EADDRINUSE:
+                        raise
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(path)
+                    return None  # 已有宿主在监听
+                except OSError:
+                    os.unlink(path)
+                finally:
+                    probe.close()
+            return None
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
@@ -0,0 +1,139 @@
+"""
+进程内 L1 缓存模块 - 位于 Redis 之前的有界 LRU/TTL 缓存
+按键前缀配置策略（是否缓存及最长缓存时间），容量以字节为上限
+"""
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# 是否启用 L1 缓存（仅在 Redis 模式下生效，内存 KV 本身就在进程内）
+L1_CACHE_ENABLED = os.getenv("L1_CACHE_ENABLED", "true").lower() == "true"
+# 容量上限（字节）
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# 按前缀的缓存策略: "前缀=秒,前缀=秒"，未匹配的键不进入 L1
+L1_CACHE_POLICIES = os.getenv(
+    "L1_CACHE_POLICIES",
+    "vv=30,public_key=300,private_key=300,server_status=60,trending_cache_=60,trending_v2_cache_=60,detail_=15"
+)
+
+_MISSING = object()
+
+
+def parse_policies(raw: str) -> Dict[str, float]:
+    """
+    解析前缀策略配置
+    :param raw: "vv=30,detail_=15"
+    :return: {前缀: 最长缓存秒数}
+    """
+    policies = {}
+    for item in raw.split(","):
+        item = item.strip()
+        if not item or "=" not in item:
+            continue
+        prefix, ttl = item.split("=", 1)
+        policies[prefix.strip()] = float(ttl)
+    return policies
+
+
+class L1Cache:
+    """有界 LRU 缓存，条目同时受前缀策略 TTL 和写入时 ex 的约束"""
+
+    def __init__(self, max_bytes: int, policies: Dict[str, float]):
+        self.max_bytes = max_bytes
+        # 最长前缀优先匹配
+        self._policies = sorted(policies.items(), key=lambda p: len(p[0]), reverse=True)
+        self._store: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def policy_for(self, key: str) -> Optional[float]:
+        """返回键的最长缓存时间，不缓存返回 None"""
+        for prefix, ttl in self._policies:
+            if key.startswith(prefix):
+                return ttl
+        return None
+
+    def get(self, key: str) -> Any:
+        """读取，未命中返回 _MISSING"""
+        item = self._store.get(key)
+        if item is None:
+            self.misses += 1
+            return _MISSING
+        value, expires_at, _ = item
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return _MISSING
+        self._store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ex: Optional[float] = None, ttl: Optional[float] = None):
+        """
+        写入，受前缀策略控制；ex 为存储层过期时间，L1 不会比它更久
+        :param ttl: 覆盖前缀策略的缓存时间（用于由失效通知保证一致的键）
+        """
+        policy = self.policy_for(key)
+        if policy is None or value is None:
+            return
+        ttl = policy if ttl is None else ttl
+        if ex is not None:
+            ttl = min(ttl, ex)
+        if ttl <= 0:
+            self.invalidate(key)
+            return
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            self.invalidate(key)
+            return
+        self._remove(key)
+        self._store[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._store:
+            oldest = next(iter(self._store))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        """删除单个键"""
+        self._remove(key)
+
+    def invalidate_prefixes(self, prefixes) -> int:
+        """删除匹配任一前缀的键，返回删除数量"""
+        prefixes = tuple(prefixes)
+        keys = [key for key in self._store if key.startswith(prefixes)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._store.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        item = self._store.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取 L1 统计信息"""
+        return {
+            'keys': len(self._store),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# 全局实例
+l1_cache = L1Cache(L1_CACHE_MAX_BYTES, parse_policies(L1_CACHE_POLICIES))
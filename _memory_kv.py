@@ -1,71 +1,724 @@
 """
 内存 KV 存储模块 - 用于替代 Redis 的轻量级内存存储
-支持键值对存储和过期时间管理
+支持键值对、有序集合和过期时间管理
 """
 import asyncio
+import bisect
+import errno
+import fcntl
+import functools
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
 import time
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict
+from itertools import islice
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, List, Set, Tuple
 
+import dotenv
+from redis.exceptions import NoScriptError, ResponseError
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 内存上限（字节），0 表示不限制
+MEMORY_KV_MAXMEMORY = int(os.getenv("MEMORY_KV_MAXMEMORY", 256 * 1024 * 1024))
+# 淘汰策略，与 Redis maxmemory-policy 相同:
+# allkeys-lru / allkeys-lfu / volatile-lru / volatile-lfu / volatile-ttl / noeviction
+MEMORY_KV_EVICTION_POLICY = os.getenv("MEMORY_KV_EVICTION_POLICY", "allkeys-lru").lower()
+# LFU / volatile 策略每次从最久未访问的一端取样的键数
+MEMORY_KV_EVICTION_SAMPLES = int(os.getenv("MEMORY_KV_EVICTION_SAMPLES", 16))
+
+_POLICIES = ('allkeys-lru', 'allkeys-lfu', 'volatile-lru', 'volatile-lfu', 'volatile-ttl', 'noeviction')
+
+# 快照文件路径（为空表示不持久化）与写入间隔（秒）；启动时先加载快照再对外提供服务
+MEMORY_KV_SNAPSHOT_PATH = os.getenv("MEMORY_KV_SNAPSHOT_PATH", "")
+MEMORY_KV_SNAPSHOT_INTERVAL = int(os.getenv("MEMORY_KV_SNAPSHOT_INTERVAL", 300))
+
+# 快照格式: 文件头 MAGIC + (写入时间, 记录数)，之后每条记录为 (类型, 过期时间, 键长, 值长) + 键 + 值
+# 过期时间为绝对时间戳，0 表示永不过期；记录按最久未访问在前的顺序写入
+_SNAPSHOT_MAGIC = b"MKVSNAP1"
+_SNAPSHOT_HEADER = struct.Struct("<dQ")
+_SNAPSHOT_RECORD = struct.Struct("<BdII")
+_TYPE_STR, _TYPE_BYTES, _TYPE_INT = 0, 1, 2
+
+# 每轮最多回收的过期键数量，超过后让出事件循环，下一轮继续
+_CLEANUP_BATCH = 10000
+# 清理间隔（秒）；只处理已到期的键，间隔可以很短
+_CLEANUP_INTERVAL = 1
+
+# LFU 对数计数器（与 Redis 相同）：新键初始值、增长因子、每分钟衰减 1
+_LFU_INIT = 5
+_LFU_LOG_FACTOR = 10
+# 每个键在值和键本身之外的固定开销：OrderedDict 节点与哈希表槽位（估算）
+_SLOT_OVERHEAD = 104
+
+
+# 键空间索引的分隔符：键按第一个分隔符之前的部分（如 "pushTask:"、"node:"）分组
+_NS_SEP = ":"
+_GLOB_SPECIAL = "*?[\\"
+# 每个键空间内再按键的哈希分为固定数量的槽（2 的幂），SCAN 的游标即下一个要扫描的槽号
+_SCAN_SLOTS = 1024
+
+
+@functools.lru_cache(maxsize=256)
+def compile_glob(pattern: str) -> "re.Pattern":
+    """
+    按 Redis 的 glob 语义编译匹配模式: * ? [abc] [^a] [a-z] 以及 \\ 转义
+    :param pattern: 模式
+    :return: 用 fullmatch 匹配的正则
+    """
+    out, i, n = [], 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        if c == "*":
+            out.append(".*")
+        elif c == "?":
+            out.append(".")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            j = i + 1
+            negate = pattern[j] == "^"
+            if negate:
+                j += 1
+            items = []
+            while pattern[j] != "]":
+                if pattern[j] == "\\" and j + 1 < n:
+                    items.append(re.escape(pattern[j + 1]))
+                    j += 2
+                elif j + 2 < n and pattern[j + 1] == "-" and pattern[j + 2] != "]":
+                    lo, hi = sorted((pattern[j], pattern[j + 2]))
+                    items.append(f"{re.escape(lo)}-{re.escape(hi)}")
+                    j += 3
+                else:
+                    items.append(re.escape(pattern[j]))
+                    j += 1
+                if j >= n:
+                    break
+            if not items:
+                out.append("." if negate else "(?!)")
+            else:
+                out.append(("[^" if negate else "[") + "".join(items) + "]")
+            i = j + 1
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out), re.DOTALL)
+
+
+def literal_prefix(pattern: str) -> str:
+    """模式中第一个通配符之前的字面量前缀（已去除转义）"""
+    prefix, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            prefix.append(pattern[i + 1])
+            i += 2
+            continue
+        if c in _GLOB_SPECIAL:
+            break
+        prefix.append(c)
+        i += 1
+    return "".join(prefix)
+
+
+def as_bytes(value: Any) -> bytes:
+    """按 Redis 的方式把值转换为字节串"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+
+# Lua 脚本没有解释器，由 Python 实现: sha1 -> (kv, keys, args) -> 结果
+# 未注册实现的脚本可以 SCRIPT LOAD，但执行时报错
+ScriptHandler = Callable[["MemoryKV", List[str], List[bytes]], Awaitable[Any]]
+_SCRIPT_HANDLERS: Dict[str, ScriptHandler] = {}
+_SCRIPT_BODIES: Dict[str, str] = {}
+
+
+def script_sha(body: str) -> str:
+    return hashlib.sha1(body.encode()).hexdigest()
+
+
+def register_script(body: str, handler: ScriptHandler) -> str:
+    """
+    注册一个由 Python 实现的 Lua 脚本，使 EVAL / EVALSHA 在内存 KV 上可用
+    :param body: 与客户端发送的完全相同的脚本内容
+    :param handler: 实现函数
+    :return: sha1
+    """
+    sha = script_sha(body)
+    _SCRIPT_HANDLERS[sha] = handler
+    _SCRIPT_BODIES[sha] = body
+    return sha
+
+
+def _namespace(key: str) -> Optional[str]:
+    i = key.find(_NS_SEP)
+    return key[:i + 1] if i >= 0 else None
 
-class MemoryKV:
-    """内存 KV 存储，支持过期时间"""
+
+def _scan_slot(key: str) -> int:
+    return hash(key) & (_SCAN_SLOTS - 1)
+
+
+def write_snapshot(path: str, records: List[Tuple[str, Any, Optional[float]]]) -> int:
+    """
+    写入快照（先写同目录下唯一的临时文件再原子替换，替换后 fsync 目录），跳过不支持的值类型
+    :param records: [(键, 值, 过期时间)]
+    :return: 写入的记录数
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_SNAPSHOT_MAGIC)
+            f.write(_SNAPSHOT_HEADER.pack(time.time(), 0))
+            for key, value, expires_at in records:
+                if isinstance(value, str):
+                    kind, data = _TYPE_STR, value.encode("utf-8")
+                elif isinstance(value, (bytes, bytearray)):
+                    kind, data = _TYPE_BYTES, bytes(value)
+                elif isinstance(value, int) and not isinstance(value, bool):
+                    kind, data = _TYPE_INT, str(value).encode()
+                else:
+                    continue
+                key_data = key.encode("utf-8")
+                f.write(_SNAPSHOT_RECORD.pack(kind, expires_at or 0.0, len(key_data), len(data)))
+                f.write(key_data)
+                f.write(data)
+                written += 1
+            f.seek(len(_SNAPSHOT_MAGIC))
+            f.write(_SNAPSHOT_HEADER.pack(time.time(), written))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    # 目录项也落盘，避免掉电后替换丢失
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return written
+
+
+def read_snapshot(path: str, now: Optional[float] = None) -> List[Tuple[str, Any, Optional[float]]]:
+    """
+    通过 mmap 读取快照，跳过已过期的记录
+    :return: [(键, 值, 过期时间)]，文件不存在或格式不符时返回空列表
+    """
+    now = time.time() if now is None else now
+    if not os.path.exists(path) or os.path.getsize(path) < len(_SNAPSHOT_MAGIC) + _SNAPSHOT_HEADER.size:
+        return []
+    records = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            logger.warning(f"Ignoring snapshot {path}: bad magic")
+            return []
+        offset = len(_SNAPSHOT_MAGIC)
+        _, count = _SNAPSHOT_HEADER.unpack_from(mm, offset)
+        offset += _SNAPSHOT_HEADER.size
+        for _ in range(count):
+            kind, expires_at, key_len, value_len = _SNAPSHOT_RECORD.unpack_from(mm, offset)
+            offset += _SNAPSHOT_RECORD.size
+            key = mm[offset:offset + key_len].decode("utf-8")
+            offset += key_len
+            data = mm[offset:offset + value_len]
+            offset += value_len
+            if expires_at and expires_at <= now:
+                continue
+            if kind == _TYPE_STR:
+                value = data.decode("utf-8")
+            elif kind == _TYPE_INT:
+                value = int(data)
+            else:
+                value = data
+            records.append((key, value, expires_at or None))
+    return records
+
+
+class _Entry:
+    """单个键的记录"""
+    __slots__ = ('value', 'expires_at', 'size', 'freq', 'touched')
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.freq = _LFU_INIT
+        self.touched = int(time.monotonic() // 60)
+
+    def lfu(self, now_min: int) -> int:
+        """按空闲分钟数衰减后的访问频率"""
+        return max(0, self.freq - (now_min - self.touched))
+
+    def hit(self):
+        now_min = int(time.monotonic() // 60)
+        freq = self.lfu(now_min)
+        if freq < 255 and random.random() < 1.0 / ((max(freq - _LFU_INIT, 0)) * _LFU_LOG_FACTOR + 1):
+            freq += 1
+        self.freq = freq
+        self.touched = now_min
+
+
+_ENTRY_SIZE = sys.getsizeof(_Entry(None, None, 0))
+
+
+def entry_size(key: str, value: Any) -> int:
+    """键、值、记录与表槽位占用的字节数"""
+    return sys.getsizeof(key) + sys.getsizeof(value) + _ENTRY_SIZE + _SLOT_OVERHEAD
+
+
+def parse_score_bound(value: Any) -> Tuple[float, bool]:
+    """
+    解析 ZRANGEBYSCORE 的分数边界: 数字、"-inf"/"+inf"，"(" 前缀表示开区间
+    :return: (分数, 是否开区间)
+    """
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    if isinstance(value, str) and value.startswith("("):
+        return float(value[1:]), True
+    return float(value), False
+
+
+class SortedSet:
+    """
+    有序集合：成员 -> 分数的字典，加上按 (分数, 成员) 排序的列表；
+    按分数的范围查询用二分查找定位，代价为 O(log n + 返回数量)
+    """
+    __slots__ = ('scores', 'items', '_member_bytes')
+
+    # 每个成员在成员字符串之外的开销估算：(分数, 成员) 元组、float、字典槽位
+    _MEMBER_OVERHEAD = 120
 
     def __init__(self):
-        self._store: Dict[str, Dict[str, Any]] = {}
-        self._lock = asyncio.Lock()
+        self.scores: Dict[str, float] = {}
+        self.items: List[Tuple[float, str]] = []
+        self._member_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self.scores) + sys.getsizeof(self.items) + self._member_bytes
+
+    def add(self, member: str, score: float) -> bool:
+        """添加或更新成员，返回是否为新成员"""
+        old = self.scores.get(member)
+        if old is not None:
+            if old == score:
+                return False
+            del self.items[bisect.bisect_left(self.items, (old, member))]
+        else:
+            self._member_bytes += sys.getsizeof(member) + self._MEMBER_OVERHEAD
+        self.scores[member] = score
+        bisect.insort(self.items, (score, member))
+        return old is None
+
+    def remove(self, member: str) -> bool:
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        del self.items[bisect.bisect_left(self.items, (score, member))]
+        self._member_bytes -= sys.getsizeof(member) + self._MEMBER_OVERHEAD
+        return True
+
+    def _span(self, min_score: Any, max_score: Any) -> Tuple[int, int]:
+        """分数范围对应的列表下标区间 [lo, hi)"""
+        low, low_open = parse_score_bound(min_score)
+        high, high_open = parse_score_bound(max_score)
+        score = lambda item: item[0]
+        lo = (bisect.bisect_right if low_open else bisect.bisect_left)(self.items, low, key=score)
+        hi = (bisect.bisect_left if high_open else bisect.bisect_right)(self.items, high, key=score)
+        return lo, max(lo, hi)
+
+    def range_by_score(self, min_score: Any, max_score: Any) -> List[Tuple[str, float]]:
+        """按分数从低到高返回范围内的 (成员, 分数)"""
+        lo, hi = self._span(min_score, max_score)
+        return [(member, score) for score, member in self.items[lo:hi]]
+
+    def remove_range_by_score(self, min_score: Any, max_score: Any) -> int:
+        """删除分数范围内的成员，返回删除数量"""
+        lo, hi = self._span(min_score, max_score)
+        for _, member in self.items[lo:hi]:
+            del self.scores[member]
+            self._member_bytes -= sys.getsizeof(member) + self._MEMBER_OVERHEAD
+        del self.items[lo:hi]
+        return hi - lo
+
+
+class MemoryPipeline:
+    """
+    与 redis-py 管道相同的用法：调用命令只排队并返回管道本身，execute 时依次执行
+    命令之间没有 await 切换，整体等同于 MULTI / EXEC
+    """
+
+    def __init__(self, kv: "MemoryKV"):
+        self._kv = kv
+        self._commands: List[Tuple[Callable[..., Awaitable[Any]], tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._kv, name)
+
+        def queue(*args, **kwargs) -> "MemoryPipeline":
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    async def __aenter__(self) -> "MemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.reset()
+
+    def reset(self):
+        self._commands = []
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        """
+        执行排队的命令
+        :param raise_on_error: 为 True 时全部执行后抛出第一个错误，否则错误以异常对象放在结果中
+        :return: 各命令的结果
+        """
+        commands, self._commands = self._commands, []
+        results = []
+        for method, args, kwargs in commands:
+            try:
+                results.append(await method(*args, **kwargs))
+            except Exception as e:
+                results.append(e)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+
+class MemoryKV:
+    """
+    内存 KV 存储，支持过期时间与内存上限
+    所有操作在事件循环线程内同步完成、中间没有 await，因此不需要加锁；
+    带过期时间的键同时记录在最小堆中，清理只弹出已到期的部分，代价与过期键数成正比；
+    键按访问顺序排列（最久未访问在前），超过内存上限时按策略淘汰
+    """
+
+    def __init__(self, maxmemory: int = MEMORY_KV_MAXMEMORY, policy: str = MEMORY_KV_EVICTION_POLICY,
+                 snapshot_path: str = MEMORY_KV_SNAPSHOT_PATH):
+        self._store: "OrderedDict[str, _Entry]" = OrderedDict()
+        # (过期时间, 键)；键被覆盖或删除后旧记录留在堆中，弹出时与当前记录比对后丢弃
+        self._expiry: List[Tuple[float, str]] = []
+        # 带过期时间的键，与 _store 一样按访问顺序排列；volatile-* 策略只在其中挑选，不必跳过永久键
+        self._volatile: "OrderedDict[str, None]" = OrderedDict()
+        # 键空间索引: "pushTask:" -> {槽号: 该前缀下落在该槽的键}，没有分隔符的键记在 None 下；
+        # 键的槽号在进程内固定，按槽号递增扫描时，扫描期间一直存在的键恰好返回一次
+        self._namespaces: Dict[Optional[str], Dict[int, Set[str]]] = {}
         self._cleanup_task = None
+        self._snapshot_task = None
+        self.snapshot_path = snapshot_path
+        # 写操作计数，快照时没有变化则跳过
+        self._changes = 0
+        self._snapshot_changes = 0
+        self.snapshot_loaded = 0
+        self.snapshot_written = 0
+        self.last_snapshot_at = 0.0
+        # 多个 worker 共用同一快照路径时，持有 {快照路径}.lock 文件锁的 worker 负责写入
+        self._snapshot_lock = None
+        # 启动（含加载快照）完成后才对外报告就绪
+        self.ready = False
+        self.maxmemory = maxmemory
+        self.policy = policy if policy in _POLICIES else 'allkeys-lru'
+        self.used_memory = 0
+        self.expired = 0
+        self.evicted = 0
+        self.rejected = 0
 
-    async def start(self):
-        """启动后台清理任务"""
+    async def start(self, snapshot: bool = True):
+        """
+        加载快照（如有）并启动后台清理与快照任务，已启动时不做任何事
+        :param snapshot: 是否加载并定期写入快照；Redis 故障切换时为 False，不读入旧快照也不覆盖快照文件
+        """
+        if self.ready:
+            return
+        if snapshot and self.snapshot_path:
+            self.load_snapshot()
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
         self._cleanup_task = asyncio.create_task(self._cleanup_expired())
+        self.ready = True
 
     async def stop(self):
-        """停止后台清理任务"""
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
+        """停止后台任务，并写入最后一次快照"""
+        persist = self._snapshot_task is not None
+        for task in (self._cleanup_task, self._snapshot_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._cleanup_task = self._snapshot_task = None
+        if persist:
+            await self.save_snapshot()
+        self._release_snapshot_owner()
+        self.ready = False
+
+    def load_snapshot(self) -> int:
+        """
+        从快照恢复数据，保留原有的过期时间
+        :return: 恢复的键数
+        """
+        try:
+            start = time.monotonic()
+            records = read_snapshot(self.snapshot_path)
+            for key, value, expires_at in records:
+                self._put(key, value, expires_at)
+            self._snapshot_changes = self._changes
+            self.snapshot_loaded = len(records)
+            logger.info(f"Loaded {len(records)} keys from {self.snapshot_path} "
+                        f"in {time.monotonic() - start:.2f}s")
+            return len(records)
+        except Exception as e:
+            logger.warning(f"Failed to load snapshot {self.snapshot_path}: {e}")
+            return 0
+
+    def _acquire_snapshot_owner(self) -> bool:
+        """
+        尝试成为快照写入者（非阻塞文件锁，进程退出时自动释放，其它 worker 在下一次快照时接管）
+        :return: 当前进程是否负责写入快照
+        """
+        if self._snapshot_lock is not None:
+            return True
+        lock_file = open(f"{self.snapshot_path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise
+        self._snapshot_lock = lock_file
+        return True
+
+    def _release_snapshot_owner(self):
+        if self._snapshot_lock is not None:
+            fcntl.flock(self._snapshot_lock, fcntl.LOCK_UN)
+            self._snapshot_lock.close()
+            self._snapshot_lock = None
+
+    async def save_snapshot(self) -> int:
+        """
+        写入快照：在事件循环内复制键值引用，在线程中序列化和写盘
+        同一快照路径只有一个 worker 写入，其它 worker 只在启动时加载
+        :return: 写入的记录数，没有变化或不负责写入时返回 0
+        """
+        if self._changes == self._snapshot_changes:
+            return 0
+        try:
+            if not self._acquire_snapshot_owner():
+                return 0
+        except Exception as e:
+            logger.warning(f"Failed to lock snapshot {self.snapshot_path}: {e}")
+            return 0
+        changes = self._changes
+        records = [(key, entry.value, entry.expires_at) for key, entry in self._store.items()]
+        try:
+            written = await asyncio.to_thread(write_snapshot, self.snapshot_path, records)
+        except Exception as e:
+            logger.warning(f"Failed to write snapshot {self.snapshot_path}: {e}")
+            return 0
+        self._snapshot_changes = changes
+        self.snapshot_written = written
+        self.last_snapshot_at = time.time()
+        return written
+
+    async def _snapshot_loop(self):
+        """定期写入快照"""
+        while True:
             try:
-                await self._cleanup_task
+                await asyncio.sleep(MEMORY_KV_SNAPSHOT_INTERVAL)
+                await self.save_snapshot()
             except asyncio.CancelledError:
-                pass
+                break
+            except Exception as e:
+                logger.warning(f"Error in snapshot task: {e}")
+
+    def _insert(self, key: str, entry: _Entry):
+        self._changes += 1
+        self._store[key] = entry
+        if entry.expires_at is not None:
+            self._volatile[key] = None
+        self.used_memory += entry.size
+        self._namespaces.setdefault(_namespace(key), {}).setdefault(_scan_slot(key), set()).add(key)
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self._store.pop(key, None)
+        if entry is not None:
+            self._volatile.pop(key, None)
+            self._changes += 1
+            self.used_memory -= entry.size
+            ns, slot = _namespace(key), _scan_slot(key)
+            slots = self._namespaces[ns]
+            keys = slots[slot]
+            keys.discard(key)
+            if not keys:
+                del slots[slot]
+                if not slots:
+                    del self._namespaces[ns]
+        return entry
+
+    def _live(self, key: str, now: Optional[float] = None) -> Optional[_Entry]:
+        """返回未过期的记录，已过期的顺便删除"""
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= (time.time() if now is None else now):
+            self._remove(key)
+            self.expired += 1
+            return None
+        return entry
+
+    def _touch(self, key: str, entry: _Entry):
+        """记录一次访问"""
+        self._store.move_to_end(key)
+        if entry.expires_at is not None:
+            self._volatile.move_to_end(key)
+        entry.hit()
+
+    def _eviction_candidate(self) -> Optional[str]:
+        """按策略选出一个待淘汰的键"""
+        if self.policy == 'noeviction' or not self._store:
+            return None
+        if self.policy == 'volatile-ttl':
+            # 堆顶即最早过期的键，跳过已失效的旧记录
+            heap = self._expiry
+            while heap:
+                expires_at, key = heap[0]
+                entry = self._store.get(key)
+                if entry is not None and entry.expires_at == expires_at:
+                    return key
+                heapq.heappop(heap)
+            return None
+        keys = self._volatile if self.policy.startswith('volatile-') else self._store
+        if self.policy.endswith('-lru'):
+            return next(iter(keys), None)
+
+        # LFU: 在最久未访问的若干个键中选访问频率最低的
+        now_min = int(time.monotonic() // 60)
+        best, best_score = None, None
+        for key in islice(keys, MEMORY_KV_EVICTION_SAMPLES):
+            score = self._store[key].lfu(now_min)
+            if best is None or score < best_score:
+                best, best_score = key, score
+        return best
+
+    def _reserve(self, size: int) -> bool:
+        """为新写入腾出空间，无法腾出时返回 False"""
+        if not self.maxmemory:
+            return True
+        if size > self.maxmemory:
+            return False
+        while self.used_memory + size > self.maxmemory:
+            key = self._eviction_candidate()
+            if key is None:
+                return False
+            self._remove(key)
+            self.evicted += 1
+        return True
+
+    def _put(self, key: str, value: Any, expires_at: Optional[float]) -> bool:
+        size = entry_size(key, value)
+        old = self._remove(key)
+        if not self._reserve(size):
+            if old is not None:
+                # 写入被拒绝时保留旧值
+                self._insert(key, old)
+            self.rejected += 1
+            return False
+        entry = _Entry(value, expires_at, size)
+        if old is not None:
+            entry.freq, entry.touched = old.freq, old.touched
+            entry.hit()
+        self._insert(key, entry)
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+        return True
+
+    def _reap(self, now: float, limit: int = _CLEANUP_BATCH) -> int:
+        """弹出已到期的堆记录并删除仍然匹配的键"""
+        reaped = 0
+        heap = self._expiry
+        while heap and heap[0][0] <= now and reaped < limit:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._store.get(key)
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                self.expired += 1
+            reaped += 1
+        # 覆盖写入留下的旧记录过多时重建堆
+        if len(heap) > 2 * len(self._store) + 1024:
+            self._expiry = [(e.expires_at, k) for k, e in self._store.items() if e.expires_at is not None]
+            heapq.heapify(self._expiry)
+        return reaped
 
     async def _cleanup_expired(self):
         """定期清理过期键"""
         while True:
             try:
-                await asyncio.sleep(60)  # 每60秒清理一次
-                async with self._lock:
-                    current_time = time.time()
-                    expired_keys = [
-                        key for key, data in self._store.items()
-                        if data.get('expires_at') and data['expires_at'] < current_time
-                    ]
-                    for key in expired_keys:
-                        del self._store[key]
+                await asyncio.sleep(_CLEANUP_INTERVAL)
+                while self._reap(time.time()) >= _CLEANUP_BATCH:
+                    await asyncio.sleep(0)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 print(f"Error in cleanup task: {e}")
 
-    async def set(self, key: str, value: str, ex: Optional[int] = None) -> bool:
+    async def set(self, key: str, value: str, ex: Optional[int] = None, px: Optional[int] = None,
+                  nx: bool = False) -> bool:
         """
         设置键值对
         :param key: 键
         :param value: 值
         :param ex: 过期时间（秒），None 表示永不过期
-        :return: 是否成功
+        :param px: 过期时间（毫秒），优先于 ex
+        :param nx: 仅在键不存在时设置
+        :return: 是否成功（nx 模式下键已存在、或超过内存上限且无法淘汰时返回 False）
         """
         try:
-            async with self._lock:
-                expires_at = None
-                if ex is not None:
-                    expires_at = time.time() + ex
-
-                self._store[key] = {
-                    'value': value,
-                    'expires_at': expires_at,
-                    'created_at': time.time()
-                }
-                return True
+            now = time.time()
+            if nx and self._live(key, now) is not None:
+                return False
+
+            expires_at = None
+            if px is not None:
+                expires_at = now + px / 1000
+            elif ex is not None:
+                expires_at = now + ex
+
+            return self._put(key, value, expires_at)
         except Exception as e:
             print(f"Error setting key {key}: {e}")
             return False
@@ -76,38 +729,248 @@ class MemoryKV:
         :param key: 键
         :return: 值，如果不存在或已过期返回 None
         """
+        entry = self._live(key)
+        if entry is None:
+            return None
+        if isinstance(entry.value, SortedSet):
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        self._touch(key, entry)
+        return entry.value
+
+    async def mget(self, keys, *args) -> List[Optional[Any]]:
+        """
+        批量获取
+        :param keys: 键或键列表，与 redis-py 相同也可以作为多个参数传入
+        :return: 与键对应的值列表，不存在为 None
+        """
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys, *args]
+        return [await self.get(key) for key in keys]
+
+    async def mset(self, mapping: Dict[str, Any]) -> bool:
+        """
+        批量设置（不带过期时间）
+        :param mapping: 键值字典
+        :return: 全部写入成功返回 True
+        """
+        ok = True
+        for key, value in mapping.items():
+            ok = await self.set(key, value) and ok
+        return ok
+
+    async def set_many(self, mapping: Dict[str, Any], ex: Optional[int] = None, px: Optional[int] = None) -> bool:
+        """
+        批量设置，所有键使用相同的过期时间
+        :param mapping: 键值字典
+        :param ex: 过期时间（秒）
+        :param px: 过期时间（毫秒），优先于 ex
+        :return: 全部写入成功返回 True
+        """
+        ok = True
+        for key, value in mapping.items():
+            ok = await self.set(key, value, ex=ex, px=px) and ok
+        return ok
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[Any], int]:
+        """
+        同时获取值与剩余过期时间
+        :param key: 键
+        :return: (值, 剩余秒数)，剩余秒数的含义与 ttl 相同
+        """
+        return await self.get(key), await self.ttl(key)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        """
+        将整数值加上 amount，键不存在时从 0 开始，保留原有的过期时间
+        :param key: 键
+        :param amount: 增量
+        :return: 新值
+        """
+        now = time.time()
+        entry = self._live(key, now)
+        old = entry.value if entry is not None else None
         try:
-            async with self._lock:
-                if key not in self._store:
-                    return None
+            value = (int(old) if old is not None else 0) + amount
+        except (TypeError, ValueError):
+            raise ResponseError("value is not an integer or out of range")
+        # 保持原来的值类型，get 返回的内容与 Redis 一致
+        new = str(value).encode() if isinstance(old, bytes) else str(value)
+        if not self._put(key, new, entry.expires_at if entry is not None else None):
+            raise ResponseError("OOM command not allowed when used memory > 'maxmemory'")
+        return value
 
-                data = self._store[key]
+    incrby = incr
 
-                # 检查是否过期
-                if data.get('expires_at') and data['expires_at'] < time.time():
-                    del self._store[key]
-                    return None
+    async def pexpire(self, key: str, milliseconds: int) -> bool:
+        """
+        设置过期时间（毫秒），不大于 0 时立即删除
+        :return: 键存在时返回 True
+        """
+        now = time.time()
+        entry = self._live(key, now)
+        if entry is None:
+            return False
+        if milliseconds <= 0:
+            self._remove(key)
+            return True
+        entry.expires_at = now + milliseconds / 1000
+        heapq.heappush(self._expiry, (entry.expires_at, key))
+        # 新带上过期时间的键排在 volatile 顺序的末尾，直到下次访问
+        self._volatile.setdefault(key)
+        self._changes += 1
+        return True
 
-                return data['value']
-        except Exception as e:
-            print(f"Error getting key {key}: {e}")
-            return None
+    async def expire(self, key: str, seconds: int) -> bool:
+        """
+        设置过期时间（秒）
+        :return: 键存在时返回 True
+        """
+        return await self.pexpire(key, seconds * 1000)
+
+    async def pttl(self, key: str) -> int:
+        """
+        剩余过期时间（毫秒）
+        :return: 键不存在返回 -2，没有过期时间返回 -1
+        """
+        now = time.time()
+        entry = self._live(key, now)
+        if entry is None:
+            return -2
+        if entry.expires_at is None:
+            return -1
+        return max(0, round((entry.expires_at - now) * 1000))
+
+    async def ttl(self, key: str) -> int:
+        """
+        剩余过期时间（秒，四舍五入）
+        :return: 键不存在返回 -2，没有过期时间返回 -1
+        """
+        ms = await self.pttl(key)
+        return ms if ms < 0 else (ms + 500) // 1000
+
+    def _zset(self, key: str, create: bool = False) -> Optional[_Entry]:
+        """
+        取有序集合所在的记录
+        :param create: 不存在时创建空集合
+        :raises ResponseError: 键存在但不是有序集合
+        """
+        entry = self._live(key)
+        if entry is None:
+            if not create:
+                return None
+            if not self._put(key, SortedSet(), None):
+                raise ResponseError("OOM command not allowed when used memory > 'maxmemory'")
+            entry = self._store[key]
+        elif not isinstance(entry.value, SortedSet):
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        self._touch(key, entry)
+        return entry
+
+    def _resize(self, key: str, entry: _Entry):
+        """原地修改集合后更新占用，空集合与 Redis 一样删除键；超过上限时按策略淘汰"""
+        if not len(entry.value):
+            self._remove(key)
+            return
+        size = entry_size(key, entry.value)
+        self.used_memory += size - entry.size
+        entry.size = size
+        self._changes += 1
+        self._reserve(0)
+
+    async def zadd(self, key: str, mapping: Dict[str, float]) -> int:
+        """
+        添加或更新有序集合成员
+        :param mapping: 成员 -> 分数
+        :return: 新增的成员数
+        """
+        entry = self._zset(key, create=True)
+        added = sum(entry.value.add(member, float(score)) for member, score in mapping.items())
+        self._resize(key, entry)
+        return added
+
+    async def zrem(self, key: str, *members: str) -> int:
+        """删除成员，返回删除数量"""
+        entry = self._zset(key)
+        if entry is None:
+            return 0
+        removed = sum(entry.value.remove(member) for member in members)
+        self._resize(key, entry)
+        return removed
+
+    async def zscore(self, key: str, member: str) -> Optional[float]:
+        entry = self._zset(key)
+        return entry.value.scores.get(member) if entry is not None else None
+
+    async def zcard(self, key: str) -> int:
+        entry = self._zset(key)
+        return len(entry.value) if entry is not None else 0
+
+    async def zrangebyscore(self, key: str, min: Any, max: Any, start: Optional[int] = None,
+                            num: Optional[int] = None, withscores: bool = False) -> List[Any]:
+        """
+        按分数范围查询，参数与 redis-py 相同
+        :param min: 下界，可为 "-inf" 或以 "(" 开头表示开区间
+        :param max: 上界，可为 "+inf" 或以 "(" 开头表示开区间
+        :return: 成员列表；withscores 时为 (成员, 分数) 列表
+        """
+        entry = self._zset(key)
+        items = entry.value.range_by_score(min, max) if entry is not None else []
+        if start is not None and num is not None:
+            items = items[start:] if num < 0 else items[start:start + num]
+        return items if withscores else [member for member, _ in items]
+
+    async def zremrangebyscore(self, key: str, min: Any, max: Any) -> int:
+        """删除分数范围内的成员，返回删除数量"""
+        entry = self._zset(key)
+        if entry is None:
+            return 0
+        removed = entry.value.remove_range_by_score(min, max)
+        self._resize(key, entry)
+        return removed
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        """创建管道（transaction 参数仅为兼容 redis-py）"""
+        return MemoryPipeline(self)
+
+    async def script_load(self, script: str) -> str:
+        """
+        登记脚本并返回 sha1
+        :param script: 脚本内容
+        """
+        sha = script_sha(script)
+        _SCRIPT_BODIES.setdefault(sha, script)
+        return sha
+
+    async def script_exists(self, *shas: str) -> List[bool]:
+        return [sha in _SCRIPT_BODIES for sha in shas]
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args) -> Any:
+        """
+        执行已登记的脚本，语义与 Redis 相同
+        :raises NoScriptError: 脚本未登记
+        :raises ResponseError: 脚本没有 Python 实现
+        """
+        sha = sha.lower()
+        if sha not in _SCRIPT_BODIES:
+            raise NoScriptError("No matching script. Please use EVAL.")
+        handler = _SCRIPT_HANDLERS.get(sha)
+        if handler is None:
+            raise ResponseError("script is not supported by the memory KV")
+        numkeys = int(numkeys)
+        keys = [key.decode() if isinstance(key, bytes) else str(key) for key in keys_and_args[:numkeys]]
+        return await handler(self, keys, [as_bytes(arg) for arg in keys_and_args[numkeys:]])
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args) -> Any:
+        """登记并执行脚本"""
+        return await self.evalsha(await self.script_load(script), numkeys, *keys_and_args)
 
     async def delete(self, key: str) -> bool:
         """
-        删除键
+        删除键（堆中的过期记录在到期时丢弃）
         :param key: 键
         :return: 是否成功
         """
-        try:
-            async with self._lock:
-                if key in self._store:
-                    del self._store[key]
-                    return True
-                return True  # 键不存在也返回成功
-        except Exception as e:
-            print(f"Error deleting key {key}: {e}")
-            return False
+        self._remove(key)
+        return True  # 键不存在也返回成功
 
     async def exists(self, key: str) -> int:
         """
@@ -115,48 +978,79 @@ class MemoryKV:
         :param key: 键
         :return: 1 表示存在，0 表示不存在或已过期
         """
-        try:
-            async with self._lock:
-                if key not in self._store:
-                    return 0
+        return 1 if self._live(key) is not None else 0
 
-                data = self._store[key]
-                if data.get('expires_at') and data['expires_at'] < time.time():
-                    del self._store[key]
-                    return 0
+    async def scan(self, cursor: int = 0, match: str = "*", count: int = 1000) -> Tuple[int, List[str]]:
+        """
+        按游标扫描一批匹配的键（Redis SCAN 语义）：字面量前缀包含分隔符时只扫描对应键空间
+        :param cursor: 上一次返回的游标，0 表示从头开始
+        :param match: 匹配模式，支持 * ? [] 与 \\ 转义
+        :param count: 本批至少检查的键数
+        :return: (下一个游标, 匹配的键)，游标为 0 表示扫描结束
+        """
+        regex = compile_glob(match)
+        prefix = literal_prefix(match)
+        ns = _namespace(prefix)
+        if ns is None:
+            indexes = list(self._namespaces.values())
+        else:
+            indexes = [self._namespaces[ns]] if ns in self._namespaces else []
+        now = time.time()
+        keys, examined, slot, count = [], 0, max(int(cursor), 0), max(int(count), 1)
+        while slot < _SCAN_SLOTS and examined < count:
+            for index in indexes:
+                # _live 会删除过期键，先复制该槽（约为键数 / _SCAN_SLOTS）
+                for key in list(index.get(slot, ())):
+                    examined += 1
+                    if key.startswith(prefix) and regex.fullmatch(key) and self._live(key, now) is not None:
+                        keys.append(key)
+            slot += 1
+        return (slot if slot < _SCAN_SLOTS else 0), keys
 
-                return 1
-        except Exception as e:
-            print(f"Error checking key {key}: {e}")
-            return 0
+    async def iscan(self, match: str = "*", count: int = 1000) -> AsyncIterator[List[str]]:
+        """
+        异步迭代匹配的键，每批检查约 count 个键后产出一批并让出事件循环；
+        扫描期间一直存在的键恰好产出一次，期间新增或删除的键可能产出也可能不产出
+        :param match: 匹配模式
+        :param count: 每批检查的键数
+        """
+        cursor = 0
+        while True:
+            cursor, keys = await self.scan(cursor, match, count)
+            if keys:
+                yield keys
+            if cursor == 0:
+                return
+            await asyncio.sleep(0)
 
     async def scan_iter(self, match: str = "*") -> List[str]:
         """
-        扫描匹配模式的键（简单通配符支持）
-        :param match: 匹配模式，支持 * 通配符
+        扫描匹配模式的键（Redis glob 语义），分批进行，期间让出事件循环
+        :param match: 匹配模式，支持 * ? [] 与 \\ 转义
         :return: 匹配的键列表
         """
         try:
-            async with self._lock:
-                current_time = time.time()
-                pattern = match.replace("*", ".*")
-                import re
-
-                result = []
-                for key, data in self._store.items():
-                    # 跳过过期的键
-                    if data.get('expires_at') and data['expires_at'] < current_time:
-                        continue
-
-                    # 检查是否匹配
-                    if re.match(f"^{pattern}$", key):
-                        result.append(key)
-
-                return result
+            keys = []
+            async for chunk in self.iscan(match):
+                keys.extend(chunk)
+            return keys
         except Exception as e:
             print(f"Error scanning keys with pattern {match}: {e}")
             return []
 
+    async def flushdb(self) -> bool:
+        """
+        清空所有键
+        :return: 总是返回 True
+        """
+        self._store.clear()
+        self._expiry = []
+        self._volatile.clear()
+        self._namespaces.clear()
+        self.used_memory = 0
+        self._changes += 1
+        return True
+
     async def ping(self) -> bool:
         """
         健康检查
@@ -165,23 +1059,25 @@ class MemoryKV:
         return True
 
     def get_stats(self) -> Dict[str, Any]:
-        """获取存储统计信息"""
-        try:
-            current_time = time.time()
-            total_keys = len(self._store)
-            expired_keys = sum(
-                1 for data in self._store.values()
-                if data.get('expires_at') and data['expires_at'] < current_time
-            )
-
-            return {
-                'total_keys': total_keys,
-                'expired_keys': expired_keys,
-                'active_keys': total_keys - expired_keys
-            }
-        except Exception as e:
-            print(f"Error getting stats: {e}")
-            return {}
+        """获取存储统计信息（不遍历键）"""
+        return {
+            'total_keys': len(self._store),
+            'namespaces': len(self._namespaces) - (None in self._namespaces),
+            'expiry_heap': len(self._expiry),
+            'volatile_keys': len(self._volatile),
+            'expired_total': self.expired,
+            'used_memory': self.used_memory,
+            'maxmemory': self.maxmemory,
+            'maxmemory_policy': self.policy,
+            'evicted_keys': self.evicted,
+            'rejected_writes': self.rejected,
+            'ready': self.ready,
+            'snapshot_path': self.snapshot_path or None,
+            'snapshot_owner': self._snapshot_lock is not None,
+            'snapshot_loaded': self.snapshot_loaded,
+            'snapshot_written': self.snapshot_written,
+            'last_snapshot_at': int(self.last_snapshot_at) or None,
+        }
 
 
 # 全局实例
@@ -192,3 +1088,8 @@ async def get_memory_kv() -> MemoryKV:
     """获取内存 KV 存储实例"""
     return _memory_kv
 
+
+def get_memory_kv_stats() -> Dict[str, Any]:
+    """获取内存 KV 存储统计信息"""
+    return _memory_kv.get_stats()
+
@@ -0,0 +1,257 @@
+"""
+限流模块 - 进程内令牌桶 + 定期与存储层对账
+每个限流键在进程内维护一个令牌桶（容量 times，每个窗口补满），请求在本地判定，无需访问 Redis；
+放行的请求计入按窗口划分的待同步计数，后台每 RATE_LIMIT_SYNC_INTERVAL 秒用一次管道批量 INCRBY 到存储层，
+得到所有实例在该窗口内的总用量，超过上限的键在本窗口剩余时间内直接拒绝。
+单个键未同步的放行数超过 RATE_LIMIT_MAX_DRIFT 时在请求内同步对账，因此每个实例最多多放行该数量；
+RATE_LIMIT_MODE=redis 恢复每个请求执行一次 EVALSHA 的原有行为，local 只做本地判定
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import dotenv
+from fastapi_limiter import FastAPILimiter, depends
+from starlette.requests import Request
+
+from _redis import get_storage_backend, incr_counters
+
+dotenv.load_dotenv()
+
+# 限流模式: hybrid / redis / local
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "hybrid").lower()
+# 后台对账间隔（秒）
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", 0.2))
+# 单个键最多允许的未对账放行数，超过后在请求内同步对账；0 表示每个请求都同步（等同 redis 模式的精度）
+RATE_LIMIT_MAX_DRIFT = int(os.getenv("RATE_LIMIT_MAX_DRIFT", 4))
+# 进程内最多保留的令牌桶数（按最近使用淘汰）
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+_COUNTER_PREFIX = "ratelimit:"
+
+
+class TokenBucket:
+    """单个限流键的本地状态"""
+    __slots__ = ('capacity', 'window_ms', 'tokens', 'updated_at', 'blocked_until', 'used', 'unsynced')
+
+    def __init__(self, capacity: int, window_ms: int, now_ms: float):
+        self.capacity = capacity
+        self.window_ms = window_ms
+        self.tokens = float(capacity)
+        self.updated_at = now_ms
+        # 存储层报告本窗口已用完时，拒绝到窗口结束
+        self.blocked_until = 0.0
+        # 最近一次对账得到的本窗口全局用量
+        self.used = 0
+        self.unsynced = 0
+
+    def refill(self, now_ms: float):
+        elapsed = now_ms - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.window_ms)
+            self.updated_at = now_ms
+
+    def wait_ms(self, now_ms: float) -> int:
+        """距离下一个可用令牌的毫秒数"""
+        if now_ms < self.blocked_until:
+            return math.ceil(self.blocked_until - now_ms)
+        return max(1, math.ceil((1 - self.tokens) * self.window_ms / self.capacity))
+
+
+class RateLimitEngine:
+    """所有 RateLimiter 依赖共享的限流引擎"""
+
+    def __init__(self, mode: str):
+        self.mode = mode if mode in ('hybrid', 'redis', 'local') else 'hybrid'
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # 计数键 -> (限流键, 待同步数量, 窗口结束时间 ms, 计数键过期时间 ms)
+        self._pending: Dict[str, Tuple[str, int, float, int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.remote_limited = 0
+        self.inline_syncs = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    @property
+    def reconcile(self) -> bool:
+        # 纯内存 KV 且不共享时只有本进程在计数，无需对账
+        return self.mode == 'hybrid' and get_storage_backend() != 'memory'
+
+    def _bucket(self, key: str, times: int, window_ms: int, now_ms: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.capacity != times or bucket.window_ms != window_ms:
+            bucket = self._buckets[key] = TokenBucket(times, window_ms, now_ms)
+            while len(self._buckets) > RATE_LIMIT_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def _record(self, key: str, window_ms: int, now_ms: float, count: int = 1):
+        """计入当前窗口的待同步计数"""
+        window = int(now_ms // window_ms)
+        counter = f"{_COUNTER_PREFIX}{key}:{window}"
+        item = self._pending.get(counter)
+        if item is None:
+            self._pending[counter] = (key, count, (window + 1) * window_ms, 2 * window_ms)
+        else:
+            self._pending[counter] = (key, item[1] + count, item[2], item[3])
+
+    async def _take(self, key: str, times: int, window_ms: int, count: int) -> Tuple[int, int]:
+        """
+        申请最多 count 个令牌，令牌不足时只放行可用的部分
+        :return: (放行数量, 放行数量为 0 时建议等待的毫秒数)
+        """
+        if times <= 0 or window_ms <= 0:
+            self.limited += 1
+            return 0, max(window_ms, 1000)
+        now_ms = time.time() * 1000
+        bucket = self._bucket(key, times, window_ms, now_ms)
+        bucket.refill(now_ms)
+        granted = min(count, int(bucket.tokens))
+        if now_ms < bucket.blocked_until or granted < 1:
+            self.limited += 1
+            return 0, bucket.wait_ms(now_ms)
+        bucket.tokens -= granted
+        if not self.reconcile:
+            self.allowed += granted
+            return granted, 0
+
+        self._record(key, window_ms, now_ms, granted)
+        bucket.unsynced += granted
+        if bucket.unsynced > RATE_LIMIT_MAX_DRIFT:
+            self.inline_syncs += 1
+            await self.flush()
+            now_ms = time.time() * 1000
+            if now_ms < bucket.blocked_until and bucket.used > bucket.capacity:
+                # 本次请求已计入存储层，但全局用量超过上限；恰好用满上限的请求仍然放行
+                self.limited += 1
+                return 0, bucket.wait_ms(now_ms)
+        else:
+            self._schedule_flush()
+        self.allowed += granted
+        return granted, 0
+
+    async def check(self, key: str, times: int, window_ms: int) -> int:
+        """
+        判定一次请求
+        :param key: 限流键
+        :param times: 每个窗口允许的次数
+        :param window_ms: 窗口长度（毫秒）
+        :return: 0 表示放行，否则为建议等待的毫秒数
+        """
+        granted, wait_ms = await self._take(key, times, window_ms, 1)
+        return 0 if granted else wait_ms
+
+    async def take(self, key: str, times: int, window_ms: int, count: int) -> int:
+        """
+        一次申请 count 次（批量请求按子操作计费），额度不足时只放行一部分
+        :return: 放行的次数
+        """
+        if count <= 0:
+            return 0
+        granted, _ = await self._take(key, times, window_ms, count)
+        return granted
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """有待同步的计数时周期性对账，没有时退出"""
+        while self._pending:
+            await asyncio.sleep(RATE_LIMIT_SYNC_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        """把待同步计数一次性写入存储层，并按全局用量更新本地令牌桶"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            for key, *_ in pending.values():
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.unsynced = 0
+            totals = await incr_counters([(counter, count, ttl_ms)
+                                          for counter, (_, count, _, ttl_ms) in pending.items()])
+            self.flushes += 1
+            if len(totals) != len(pending):
+                # 存储层不可用时退化为本地限流，丢弃本批计数
+                self.flush_errors += 1
+                return
+            now_ms = time.time() * 1000
+            for (key, _, window_end, _), total in zip(pending.values(), totals):
+                bucket = self._buckets.get(key)
+                if bucket is None or window_end <= now_ms:
+                    continue
+                bucket.used = total
+                bucket.tokens = min(bucket.tokens, max(0, bucket.capacity - total))
+                if total >= bucket.capacity and window_end > bucket.blocked_until:
+                    bucket.blocked_until = window_end
+                    self.remote_limited += 1
+
+    async def close(self):
+        """停止后台对账并写入剩余计数"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self.reconcile:
+            await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计信息"""
+        return {
+            'mode': self.mode,
+            'reconcile': self.reconcile,
+            'sync_interval': RATE_LIMIT_SYNC_INTERVAL,
+            'max_drift': RATE_LIMIT_MAX_DRIFT,
+            'buckets': len(self._buckets),
+            'pending': len(self._pending),
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'remote_limited': self.remote_limited,
+            'inline_syncs': self.inline_syncs,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+        }
+
+
+class RateLimiter(depends.RateLimiter):
+    """
+    fastapi-limiter RateLimiter 的替代品，参数与用法相同：
+    Depends(RateLimiter(times=2, seconds=1))
+    """
+
+    async def _check(self, key):
+        if rate_limit_engine.mode == 'redis':
+            return await super()._check(key)
+        return await rate_limit_engine.check(key, self.times, self.milliseconds)
+
+    async def take(self, request: Request, scope: str, count: int) -> int:
+        """
+        不作为路由依赖使用：在本限流器的额度内一次申请 count 次，额度不足时只放行一部分
+        :param scope: 额度名称，与客户端标识一起组成限流键
+        :return: 放行的次数
+        """
+        identifier = self.identifier or FastAPILimiter.identifier
+        key = f"{FastAPILimiter.prefix}:{await identifier(request)}:{scope}"
+        if rate_limit_engine.mode != 'redis':
+            return await rate_limit_engine.take(key, self.times, self.milliseconds, count)
+        granted = 0
+        while granted < count and await super()._check(key) == 0:
+            granted += 1
+        return granted
+
+
+# 全局实例
+rate_limit_engine = RateLimitEngine(RATE_LIMIT_MODE)
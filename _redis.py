@@ -1,62 +1,213 @@
+import asyncio
 import json
 import os
-from typing import Optional
+import uuid
+from typing import Dict, List, Optional, Tuple, Union
 
 import dotenv
+from fastapi_limiter import FastAPILimiter
 from redis import asyncio as redis
 
-from _memory_kv import get_memory_kv
+from _failover import storage_failover
+from _kv_server import MEMORY_KV_SHARED_SOCKET, elect_shared_host
+from _l1cache import L1_CACHE_ENABLED, _MISSING, l1_cache
+from _memory_kv import as_bytes, get_memory_kv, get_memory_kv_stats, register_script
+from _tracking import CLIENT_TRACKING_ENABLED, client_tracking
 
 dotenv.load_dotenv()
 
 # 配置：是否使用 Redis，默认优先尝试 Redis，失败则降级到内存存储
 USE_REDIS = os.getenv("USE_REDIS", "true").lower() == "true"
 FALLBACK_TO_MEMORY = os.getenv("FALLBACK_TO_MEMORY", "true").lower() == "true"
+# 连接池大小，以及连接池耗尽时等待空闲连接的最长时间（秒）
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 20))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+# 启动探测（建立连接 + PING）的超时（秒）
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 2))
+# 单条命令等待回复的超时（秒）；Redis 停止响应但不拒绝连接时以超时错误返回，计入故障切换阈值
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 3))
 
-# Configuration
+# 存储状态，由 init_storage 在 lifespan 中设置
 redis_client = None
 use_memory_kv = False
+# 内存 KV 模式下同一主机的多个 worker 通过 unix socket 共享一个 MemoryKV：
+# 宿主 worker 持有监听 socket（在 lifespan 中启动服务），其它 worker 以 redis 客户端连接
+shared_kv_socket = None
+shared_kv_role = None
+_storage_initialized = False
 
-if USE_REDIS:
+
+def _redis_url() -> str:
+    if os.getenv("REDIS_CONN") is not None:
+        return os.getenv("REDIS_CONN")
+    host = os.getenv("REDIS_HOST", "localhost")
+    port = int(os.getenv("REDIS_PORT", 6379))
+    db = int(os.getenv("REDIS_DB", 0))
+    password = os.getenv("REDIS_PASSWORD", None)
+    # 在集群环境下，使用 redis:// 连接字符串 并且 tcp()包裹
+    return f"redis://default:{password}@{host}:{port}/{db}"
+
+
+async def _connect_redis() -> Optional[redis.Redis]:
+    """创建 Redis 客户端并在限定时间内探测，失败时按 FALLBACK_TO_MEMORY 决定降级或抛出"""
+    client = None
     try:
-        if os.getenv("REDIS_CONN") is not None:
-            REDIS_CONN = os.getenv("REDIS_CONN")
-        else:
-            REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-            REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-            REDIS_DB = int(os.getenv("REDIS_DB", 0))
-            REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
-            # 在集群环境下，使用 redis:// 连接字符串 并且 tcp()包裹
-            REDIS_CONN = f"redis://default:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
-
-        # Initialize Redis client
-        redis_client = redis.from_url(REDIS_CONN)
-        # set max size of redis connection pool
-        redis_client.connection_pool.max_connections = 3
-
-        # 测试连接
-        import asyncio
-        try:
-            asyncio.run(redis_client.ping())
-            print("✓ Redis connection successful")
-        except Exception as e:
-            print(f"✗ Redis connection failed: {e}")
-            if FALLBACK_TO_MEMORY:
-                print("! Falling back to memory KV storage")
-                redis_client = None
-                use_memory_kv = True
-            else:
-                raise
+        pool = redis.BlockingConnectionPool.from_url(
+            _redis_url(), max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT, socket_timeout=REDIS_SOCKET_TIMEOUT)
+        client = redis.Redis(connection_pool=pool)
+        await asyncio.wait_for(client.ping(), timeout=REDIS_CONNECT_TIMEOUT)
+        print("✓ Redis connection successful")
+        return client
     except Exception as e:
-        print(f"✗ Redis initialization failed: {e}")
-        if FALLBACK_TO_MEMORY:
-            print("! Using memory KV storage instead")
-            use_memory_kv = True
-        else:
+        # 超时异常没有消息，打印类型名
+        print(f"✗ Redis connection failed: {e or type(e).__name__}")
+        if client is not None:
+            await client.aclose(close_connection_pool=True)
+        if not FALLBACK_TO_MEMORY:
             raise
-else:
-    print("! Redis is disabled, using memory KV storage")
-    use_memory_kv = True
+        print("! Falling back to memory KV storage")
+        return None
+
+
+async def init_storage() -> str:
+    """
+    初始化存储后端（在 lifespan 中调用，重复调用无副作用）：
+    连接并探测 Redis，失败时降级到内存 KV；内存 KV 模式下按配置选举共享宿主
+    :return: 后端名称 redis / memory / shared-host / shared-client
+    """
+    global redis_client, use_memory_kv, shared_kv_socket, shared_kv_role, _storage_initialized
+    if _storage_initialized:
+        return get_storage_backend()
+    _storage_initialized = True
+
+    if USE_REDIS:
+        redis_client = await _connect_redis()
+    else:
+        print("! Redis is disabled, using memory KV storage")
+    use_memory_kv = redis_client is None
+    if redis_client is not None and CLIENT_TRACKING_ENABLED and L1_CACHE_ENABLED:
+        client_tracking.start(redis_client.connection_pool)
+
+    if use_memory_kv and MEMORY_KV_SHARED_SOCKET:
+        try:
+            shared_kv_socket = elect_shared_host(MEMORY_KV_SHARED_SOCKET)
+            if shared_kv_socket is None:
+                pool = redis.BlockingConnectionPool(
+                    connection_class=redis.UnixDomainSocketConnection, path=MEMORY_KV_SHARED_SOCKET, protocol=2,
+                    max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT)
+                redis_client = redis.Redis(connection_pool=pool)
+                use_memory_kv = False
+                shared_kv_role = "client"
+                print(f"✓ Using shared memory KV at {MEMORY_KV_SHARED_SOCKET}")
+            else:
+                shared_kv_role = "host"
+                print(f"✓ Hosting shared memory KV at {MEMORY_KV_SHARED_SOCKET}")
+        except Exception as e:
+            print(f"✗ Shared memory KV unavailable, using a per-worker memory KV: {e}")
+    return get_storage_backend()
+
+
+async def close_storage():
+    """关闭 Redis 连接池"""
+    global redis_client, _storage_initialized
+    await client_tracking.close()
+    if redis_client is not None:
+        await redis_client.aclose(close_connection_pool=True)
+        redis_client = None
+    _storage_initialized = False
+
+
+def get_redis_client() -> Optional[redis.Redis]:
+    """当前的 Redis 客户端（共享内存 KV 的客户端 worker 也返回客户端），内存 KV 模式下为 None"""
+    return redis_client
+
+
+def is_memory_kv() -> bool:
+    """是否直接使用本进程的内存 KV"""
+    return use_memory_kv
+
+
+def get_shared_kv_socket():
+    """共享内存 KV 宿主持有的监听 socket，非宿主为 None"""
+    return shared_kv_socket
+
+
+def get_storage_backend() -> str:
+    """后端名称 redis / memory / shared-host / shared-client"""
+    if shared_kv_role is not None:
+        return f"shared-{shared_kv_role}"
+    return "memory" if use_memory_kv else "redis"
+
+
+def get_storage_mode() -> str:
+    """当前实际使用的存储：后端名称，Redis 故障降级期间为 memory-failover"""
+    return "memory-failover" if storage_failover.degraded else get_storage_backend()
+
+
+def get_pool_stats() -> Optional[dict]:
+    """
+    连接池使用情况
+    :return: 内存 KV 模式下为 None
+    """
+    if redis_client is None:
+        return None
+    pool = redis_client.connection_pool
+    in_use = len(pool._in_use_connections)
+    idle = len(pool._available_connections)
+    return {
+        'max_connections': pool.max_connections,
+        'in_use': in_use,
+        'idle': idle,
+        'utilization': round(in_use / pool.max_connections, 3) if pool.max_connections else None,
+    }
+
+
+# 存储层（L2: Redis 或内存 KV）命中统计
+_l2_stats = {'hits': 0, 'misses': 0}
+
+
+def _local() -> bool:
+    """是否使用本进程的内存 KV：内存 KV 模式，或 Redis 故障降级期间"""
+    return use_memory_kv or storage_failover.degraded
+
+
+async def _redis_failed(e: Exception) -> bool:
+    """
+    记录一次 Redis 调用失败
+    :return: 已切换到内存 KV 时返回 True，调用方改为在内存 KV 上重试
+    """
+    return storage_failover.record_failure(e, redis_client, await get_memory_kv())
+
+
+def _l1_active(key: str) -> bool:
+    """L1 仅在 Redis 模式下且键匹配前缀策略时生效"""
+    return L1_CACHE_ENABLED and not _local() and l1_cache.policy_for(key) is not None
+
+
+def _l1_set(key: str, value, ex: Optional[int] = None, epoch: Optional[int] = None):
+    """
+    写入 L1；被跟踪的键按失效跟踪放宽缓存时间
+    :param epoch: 读取 Redis 前的 client_tracking.epoch，期间收到过失效通知则不写入
+    """
+    if epoch is not None and epoch != client_tracking.epoch:
+        return
+    l1_cache.set(key, value, ex=ex, ttl=client_tracking.ttl_for(key))
+
+
+def get_cache_stats() -> dict:
+    """
+    获取各级缓存的命中统计
+    :return: {'l1': {...}, 'l2': {...}}
+    """
+    return {
+        'l1': {**l1_cache.get_stats(), 'enabled': L1_CACHE_ENABLED and not use_memory_kv,
+               'tracking': client_tracking.get_stats()},
+        'l2': {**_l2_stats, 'backend': get_storage_backend(), 'mode': get_storage_mode(), 'pool': get_pool_stats()},
+        'memory': get_memory_kv_stats() if _local() else None,
+        'failover': storage_failover.get_stats() if not use_memory_kv else None,
+    }
 
 
 async def test_redis():
@@ -80,8 +231,9 @@ async def get_keys_by_pattern(pattern: str) -> list:
     支持 Redis 和内存 KV 存储
     """
     maxAttempts = 3
+    local = _local()
     try:
-        if use_memory_kv:
+        if local:
             memory_kv = await get_memory_kv()
             keys = await memory_kv.scan_iter(match=pattern)
             return keys
@@ -89,8 +241,11 @@ async def get_keys_by_pattern(pattern: str) -> list:
             keys = []
             async for key in redis_client.scan_iter(match=pattern):
                 keys.append(key.decode())
+            storage_failover.record_success()
             return keys
     except Exception as e:
+        if not local and await _redis_failed(e):
+            return await get_keys_by_pattern(pattern)
         if maxAttempts > 0:
             data = await get_keys_by_pattern(pattern)
             maxAttempts -= 1
@@ -101,26 +256,96 @@ async def get_keys_by_pattern(pattern: str) -> list:
 
 
 # Set a key-value pair
-async def set_key(key: str, value: str, ex: Optional[int] = None) -> bool:
+async def set_key(key: str, value: Union[str, bytes], ex: Optional[int] = None) -> bool:
     """
     Set a value with an optional expiration time (in seconds).
     支持 Redis 和内存 KV 存储
     """
+    local = _local()
     try:
         if type(value) is dict:
             value = json.dumps(value)
 
-        if use_memory_kv:
+        if local:
             memory_kv = await get_memory_kv()
+            if not use_memory_kv:
+                # 降级期间的写入在 Redis 恢复后回放
+                storage_failover.queue_set(key, value, ex=ex)
             return await memory_kv.set(key, value, ex=ex)
         else:
+            epoch = client_tracking.epoch
             await redis_client.set(name=key, value=value, ex=ex)
+            storage_failover.record_success()
+            # write-through
+            if _l1_active(key):
+                _l1_set(key, value, ex=ex, epoch=epoch)
             return True
     except Exception as e:
+        if not local and await _redis_failed(e):
+            return await set_key(key, value, ex)
         print(f"Error setting key: {e}")
         return False
 
 
+# Set many key-value pairs
+async def set_many(mapping: Dict[str, Union[str, bytes]], ex: Optional[int] = None) -> bool:
+    """
+    Set many values with the same optional expiration time (in seconds) in one round trip.
+    Redis 模式下在一个 MULTI/EXEC 事务中写入，其它实例不会读到只写了一部分的结果
+    支持 Redis 和内存 KV 存储
+    """
+    if not mapping:
+        return True
+    mapping = {key: json.dumps(value) if type(value) is dict else value for key, value in mapping.items()}
+    try:
+        epoch = client_tracking.epoch
+        async with StoragePipeline() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+            await pipe.execute()
+        if not _local():
+            # write-through
+            for key, value in mapping.items():
+                if _l1_active(key):
+                    _l1_set(key, value, ex=ex, epoch=epoch)
+        return True
+    except Exception as e:
+        print(f"Error setting keys: {e}")
+        return False
+
+
+async def _get_raw(key: str):
+    """
+    读取原始值：Redis 返回 bytes，内存 KV 返回写入时的类型
+    Redis 模式下先查 L1
+    """
+    if _local():
+        memory_kv = await get_memory_kv()
+        data = await memory_kv.get(key)
+        _l2_stats['hits' if data is not None else 'misses'] += 1
+        return data
+    l1 = _l1_active(key)
+    if l1:
+        value = l1_cache.get(key)
+        if value is not _MISSING:
+            return value
+    epoch = client_tracking.epoch
+    try:
+        data = await redis_client.get(key)
+    except Exception as e:
+        if await _redis_failed(e):
+            return await _get_raw(key)
+        raise
+    storage_failover.record_success()
+    if data is None:
+        _l2_stats['misses'] += 1
+        return None
+    _l2_stats['hits'] += 1
+    if l1:
+        _l1_set(key, data, epoch=epoch)
+    return data
+
+
 # Get a value by key
 async def get_key(key: str) -> Optional[str]:
     """
@@ -128,34 +353,126 @@ async def get_key(key: str) -> Optional[str]:
     支持 Redis 和内存 KV 存储
     """
     try:
-        if use_memory_kv:
-            memory_kv = await get_memory_kv()
-            return await memory_kv.get(key)
-        else:
-            data = await redis_client.get(key)
-            if data:
-                return data.decode()
-            else:
-                return None
+        data = await _get_raw(key)
+        if not data:
+            return None
+        if isinstance(data, bytes):
+            return data.decode()
+        return data
+    except Exception as e:
+        print(f"Error getting key: {e}")
+        return None
+
+
+# Get a raw value by key
+async def get_key_bytes(key: str) -> Optional[bytes]:
+    """
+    Get a value by key as bytes, without decoding. Returns None if the key does not exist.
+    用于直接透传缓存的响应体
+    支持 Redis 和内存 KV 存储
+    """
+    try:
+        data = await _get_raw(key)
+        if not data:
+            return None
+        if isinstance(data, str):
+            return data.encode()
+        return data
     except Exception as e:
         print(f"Error getting key: {e}")
         return None
 
 
+# Get many raw values
+async def get_many_bytes(keys: List[str]) -> List[Optional[bytes]]:
+    """
+    Get many values as bytes in one round trip (MGET). Missing keys are None.
+    Redis 模式下先查 L1，只对未命中的键发起一次 MGET
+    支持 Redis 和内存 KV 存储
+    """
+    results: List[Optional[bytes]] = [None] * len(keys)
+    local = _local()
+    try:
+        if local:
+            memory_kv = await get_memory_kv()
+            for i, key in enumerate(keys):
+                results[i] = await memory_kv.get(key)
+                _l2_stats['hits' if results[i] is not None else 'misses'] += 1
+        else:
+            missing = []
+            for i, key in enumerate(keys):
+                if _l1_active(key):
+                    value = l1_cache.get(key)
+                    if value is not _MISSING:
+                        results[i] = value
+                        continue
+                missing.append(i)
+            if missing:
+                epoch = client_tracking.epoch
+                values = await redis_client.mget([keys[i] for i in missing])
+                storage_failover.record_success()
+                for i, value in zip(missing, values):
+                    results[i] = value
+                    _l2_stats['hits' if value is not None else 'misses'] += 1
+                    if value is not None and _l1_active(keys[i]):
+                        _l1_set(keys[i], value, epoch=epoch)
+        return [value.encode() if isinstance(value, str) else (value or None) for value in results]
+    except Exception as e:
+        if not local and await _redis_failed(e):
+            return await get_many_bytes(keys)
+        print(f"Error getting keys: {e}")
+        return results
+
+
+# Get many values
+async def get_many(keys: List[str]) -> List[Optional[str]]:
+    """
+    Get many values in one round trip (MGET). Missing keys are None.
+    支持 Redis 和内存 KV 存储
+    """
+    return [value.decode() if value is not None else None for value in await get_many_bytes(keys)]
+
+
+# Get a value together with its remaining ttl
+async def get_with_ttl(key: str) -> Tuple[Optional[str], int]:
+    """
+    Get a value and its remaining ttl (in seconds) in one round trip (pipelined GET + TTL).
+    支持 Redis 和内存 KV 存储
+    :return: (值, 剩余秒数)；剩余秒数 -1 表示不过期，-2 表示键不存在
+    """
+    try:
+        async with StoragePipeline() as pipe:
+            data, ttl = await pipe.get(key).ttl(key).execute()
+        _l2_stats['hits' if data is not None else 'misses'] += 1
+        if isinstance(data, bytes):
+            data = data.decode()
+        return data or None, int(ttl)
+    except Exception as e:
+        print(f"Error getting key with ttl: {e}")
+        return None, -2
+
+
 # Delete a key
 async def delete_key(key: str) -> bool:
     """
     Delete a key.
     支持 Redis 和内存 KV 存储
     """
+    local = _local()
     try:
-        if use_memory_kv:
+        if local:
             memory_kv = await get_memory_kv()
+            if not use_memory_kv:
+                storage_failover.queue_delete(key)
             return await memory_kv.delete(key)
         else:
+            l1_cache.invalidate(key)
             await redis_client.delete(key)
+            storage_failover.record_success()
             return True
     except Exception as e:
+        if not local and await _redis_failed(e):
+            return await delete_key(key)
         print(f"Error deleting key: {e}")
         return False
 
@@ -166,12 +483,196 @@ async def key_exists(key: str) -> bool:
     Check if a key exists.
     支持 Redis 和内存 KV 存储
     """
+    local = _local()
     try:
-        if use_memory_kv:
+        if local:
             memory_kv = await get_memory_kv()
             return await memory_kv.exists(key) == 1
         else:
+            if _l1_active(key) and l1_cache.get(key) is not _MISSING:
+                return True
             return await redis_client.exists(key) == 1
     except Exception as e:
+        if not local and await _redis_failed(e):
+            return await key_exists(key)
         print(f"Error checking key: {e}")
         return False
+
+
+class StoragePipeline:
+    """
+    在当前存储层（Redis 或内存 KV）上用一次往返批量执行命令，用法与 redis-py 的 pipeline 相同：
+        async with StoragePipeline() as pipe:
+            value, ttl = await pipe.get(key).ttl(key).execute()
+    写命令涉及的键在执行前从 L1 失效；降级期间的 set/delete 记入回写队列。
+    Redis 连接失败并切换到内存 KV 时，整批命令在内存 KV 上重新执行；其它错误抛给调用方
+    """
+    _WRITES = {'set', 'delete', 'incr', 'incrby', 'expire', 'pexpire', 'mset'}
+
+    def __init__(self, transaction: bool = True):
+        self.transaction = transaction
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._commands = []
+
+    @staticmethod
+    def _written_keys(name: str, args: tuple) -> List[str]:
+        if name == 'delete':
+            return list(args)
+        if name == 'mset':
+            return list(args[0])
+        return [args[0]]
+
+    async def execute(self) -> list:
+        """执行排队的命令，返回与命令顺序对应的结果"""
+        commands, self._commands = self._commands, []
+        return await self._execute(commands)
+
+    async def _execute(self, commands: List[Tuple[str, tuple, dict]]) -> list:
+        if not commands:
+            return []
+        local = _local()
+        try:
+            if local:
+                client = await get_memory_kv()
+                if not use_memory_kv:
+                    for name, args, kwargs in commands:
+                        if name == 'set' and not kwargs.get('nx'):
+                            storage_failover.queue_set(args[0], args[1], ex=kwargs.get('ex'), px=kwargs.get('px'))
+                        elif name == 'delete':
+                            for key in args:
+                                storage_failover.queue_delete(key)
+            else:
+                client = redis_client
+                for name, args, _ in commands:
+                    if name in self._WRITES:
+                        for key in self._written_keys(name, args):
+                            l1_cache.invalidate(key)
+            pipe = client.pipeline(transaction=self.transaction)
+            for name, args, kwargs in commands:
+                getattr(pipe, name)(*args, **kwargs)
+            results = await pipe.execute()
+            if not local:
+                storage_failover.record_success()
+            return results
+        except Exception as e:
+            if not local and await _redis_failed(e):
+                return await self._execute(commands)
+            raise
+
+
+# Increment many counters
+async def incr_counters(items: List[Tuple[str, int, int]]) -> List[int]:
+    """
+    Increment many counters and refresh their expiry in one round trip (pipelined INCRBY + PEXPIRE).
+    支持 Redis 和内存 KV 存储
+    :param items: [(键, 增量, 过期时间毫秒)]
+    :return: 与 items 对应的新值；失败时返回空列表
+    """
+    if not items:
+        return []
+    try:
+        async with StoragePipeline(transaction=False) as pipe:
+            for key, amount, ttl_ms in items:
+                pipe.incrby(key, amount)
+                pipe.pexpire(key, ttl_ms)
+            results = await pipe.execute()
+        return [int(value) for value in results[::2]]
+    except Exception as e:
+        print(f"Error incrementing counters: {e}")
+        return []
+
+
+# 仅当 value 与持有者 token 一致时删除，避免误删其它实例的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def _release_lock_script(kv, keys: List[str], args: List[bytes]) -> int:
+    """内存 KV 上 _RELEASE_LOCK_SCRIPT 的实现"""
+    value = await kv.get(keys[0])
+    if value is not None and as_bytes(value) == args[0]:
+        await kv.delete(keys[0])
+        return 1
+    return 0
+
+
+async def _rate_limit_script(kv, keys: List[str], args: List[bytes]) -> int:
+    """
+    内存 KV 上 FastAPILimiter.lua_script 的实现（固定窗口计数）
+    :return: 0 表示放行，否则为窗口剩余毫秒数
+    """
+    key, limit, expire_ms = keys[0], int(args[0]), int(args[1])
+    current = int(await kv.get(key) or 0)
+    if current > 0:
+        if current + 1 > limit:
+            return await kv.pttl(key)
+        await kv.incr(key)
+        return 0
+    await kv.set(key, b"1", px=expire_ms)
+    return 0
+
+
+register_script(_RELEASE_LOCK_SCRIPT, _release_lock_script)
+register_script(FastAPILimiter.lua_script, _rate_limit_script)
+
+
+async def acquire_lock(name: str, ttl_ms: int) -> Optional[str]:
+    """
+    尝试获取一个带过期时间的分布式锁（SET NX PX）
+    支持 Redis 和内存 KV 存储
+    :param name: 锁名
+    :param ttl_ms: 锁过期时间（毫秒）
+    :return: 获取成功返回持有者 token，否则返回 None
+    """
+    token = uuid.uuid4().hex
+    local = _local()
+    try:
+        if local:
+            memory_kv = await get_memory_kv()
+            ok = await memory_kv.set(name, token, px=ttl_ms, nx=True)
+        else:
+            ok = await redis_client.set(name=name, value=token, px=ttl_ms, nx=True)
+        return token if ok else None
+    except Exception as e:
+        if not local and await _redis_failed(e):
+            return await acquire_lock(name, ttl_ms)
+        print(f"Error acquiring lock: {e}")
+        return None
+
+
+async def release_lock(name: str, token: str) -> bool:
+    """
+    释放由 acquire_lock 获取的锁
+    支持 Redis 和内存 KV 存储
+    """
+    try:
+        if _local():
+            memory_kv = await get_memory_kv()
+            return await memory_kv.eval(_RELEASE_LOCK_SCRIPT, 1, name, token) == 1
+        else:
+            return await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, name, token) == 1
+    except Exception as e:
+        print(f"Error releasing lock: {e}")
+        return False
@@ -0,0 +1,89 @@
+"""
+实例注册表模块 - 以心跳时间为分数的有序集合记录存活实例
+instances（有序集合）: 成员为实例 id，分数为最近一次心跳的时间戳；
+instance:{id}（字符串，带过期时间）: 实例元数据（版本、负载等）的 JSON，不含主机名、进程号等主机信息。
+查询存活实例时先删除心跳超过 INSTANCE_TTL 的成员，再按分数范围读取并一次 MGET 元数据，
+代价为 O(log n + 实例数)，与键空间大小无关（原先的 node:* 需要 SCAN 整个键空间）
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import dotenv
+
+from _redis import StoragePipeline, get_many
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INSTANCES_KEY = "instances"
+_META_PREFIX = "instance:"
+
+# 心跳间隔（秒）
+INSTANCE_HEARTBEAT_INTERVAL = int(os.getenv("INSTANCE_HEARTBEAT_INTERVAL", 60))
+# 超过该时间（秒）没有心跳的实例视为下线
+INSTANCE_TTL = int(os.getenv("INSTANCE_TTL", 180))
+
+
+async def register_instance(instance_id: str, version: str, meta: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    写入一次心跳，同时记录版本与当前负载（1 分钟平均负载）
+    :param instance_id: 实例 id
+    :param version: 实例版本
+    :param meta: 其它元数据，需可 JSON 序列化；会通过 /stats 返回，不要放入主机名、进程号等主机信息
+    :return: 是否成功
+    """
+    now = time.time()
+    record = {**(meta or {}), 'id': instance_id, 'version': version, 'load': round(os.getloadavg()[0], 2)}
+    try:
+        async with StoragePipeline() as pipe:
+            pipe.zadd(INSTANCES_KEY, {instance_id: now})
+            pipe.set(_META_PREFIX + instance_id, json.dumps(record), ex=INSTANCE_TTL)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Error registering instance: {e}")
+        return False
+
+
+async def unregister_instance(instance_id: str) -> bool:
+    """
+    移除实例（正常退出时调用，异常退出的实例在 INSTANCE_TTL 后自然过期）
+    :return: 是否成功
+    """
+    try:
+        async with StoragePipeline() as pipe:
+            pipe.zrem(INSTANCES_KEY, instance_id)
+            pipe.delete(_META_PREFIX + instance_id)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Error unregistering instance: {e}")
+        return False
+
+
+async def get_live_instances() -> List[Dict[str, Any]]:
+    """
+    获取存活实例
+    :return: [{'id', 'heartbeat', 'version', 'load', 以及注册时的其它元数据}]，按心跳时间从早到晚排列
+    """
+    cutoff = time.time() - INSTANCE_TTL
+    try:
+        async with StoragePipeline() as pipe:
+            pipe.zremrangebyscore(INSTANCES_KEY, "-inf", f"({cutoff}")
+            pipe.zrangebyscore(INSTANCES_KEY, cutoff, "+inf", withscores=True)
+            _, members = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error getting live instances: {e}")
+        return []
+    ids = [member.decode() if isinstance(member, bytes) else member for member, _ in members]
+    metas = await get_many([_META_PREFIX + instance_id for instance_id in ids])
+    instances = []
+    for instance_id, (_, heartbeat), meta in zip(ids, members, metas):
+        info = json.loads(meta) if meta else {'id': instance_id}
+        info['heartbeat'] = int(heartbeat)
+        instances.append(info)
+    return instances
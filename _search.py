@@ -1,23 +1,35 @@
+import asyncio
 import datetime
 import json
 import logging
+import os
 from http.client import HTTPException
 from time import time
 
-import httpx
-from fastapi import BackgroundTasks, Depends
+from fastapi import Depends
 from fastapi.routing import APIRouter
-from fastapi_limiter.depends import RateLimiter
 from starlette.requests import Request
-from starlette.responses import JSONResponse, RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse, Response
 
-from _crypto import decryptData
-from _redis import delete_key as redis_delete_key, get_key as redis_get_key, key_exists as redis_key_exists, \
-    set_key as redis_set_key
+from _cache import cache_get_many, cached_response, render, swr_fetch, swr_resolve
+from _crypto import CRYPTO_MAX_CHUNKS, decryptData, decryptDataBatch
+from _envelope import SessionExpired, is_hybrid, open_envelope
+from _ratelimit import RateLimiter
+from _redis import delete_key as redis_delete_key
+from _guard import UpstreamUnavailable
+from _upstream import upstream_get
 from _utils import _getRandomUserAgent, generate_vv_detail, url_encode
 
 searchRouter = APIRouter(prefix='/api/query/ole', tags=['Search', 'Search Api'])
 
+# 详情缓存：软过期后返回旧数据并后台刷新，硬过期后回源
+DETAIL_CACHE_SOFT_TTL = int(os.getenv("DETAIL_CACHE_SOFT_TTL", 1800))
+DETAIL_CACHE_HARD_TTL = int(os.getenv("DETAIL_CACHE_HARD_TTL", 6 * 60 * 60))
+# 批量接口：单次请求最多包含的子操作数、未命中子操作的回源并发
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", 50))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_UPSTREAM_PER_SECOND = int(os.getenv("BATCH_UPSTREAM_PER_SECOND", 3))
+
 
 async def _getProxy():
     return None  # 废弃接口，直接返回 None
@@ -35,14 +47,34 @@ async def checkSum(data):
             raise HTTPException("Invalid Request, timestamp expired")
     except Exception as e:
         raise HTTPException("Invalid Request")
+    if isinstance(data.get('data'), list) and len(data['data']) > CRYPTO_MAX_CHUNKS:
+        # 解密前拒绝，避免单个请求触发大量 RSA 解密
+        raise HTTPException(f"Invalid Request, at most {CRYPTO_MAX_CHUNKS} chunks")
     try:
-        data = await decryptData(data.get('data'))
+        if is_hybrid(data):
+            # RSA 包装的 AES-GCM 会话密钥，会话有效期内只需对称解密
+            data = await open_envelope(data)
+        elif isinstance(data.get('data'), list):
+            # 超过单个 RSA 块容量的数据按块分别加密，按顺序拼接
+            data = await decryptDataBatch(data.get('data'), data.get('kid'))
+        else:
+            data = await decryptData(data.get('data'), data.get('kid'))
+    except SessionExpired:
+        # 由路由统一转换为 session_expired 响应，客户端据此重新携带 key 字段建立会话
+        raise
     except Exception as e:
         logging.error(e)
         raise HTTPException("Invalid Request")
     return json.loads(data)
 
 
+def session_expired_response() -> JSONResponse:
+    """
+    会话已失效的响应，error 字段固定为 session_expired，客户端据此重新握手
+    """
+    return JSONResponse({"error": "session_expired"}, status_code=401)
+
+
 async def checkTimeStamp(ts):
     """
     检查时间戳是否在有效范围内 1分钟
@@ -70,8 +102,7 @@ async def search_api(keyword, page=1, size=4):
         'Origin': 'https://www.olevod.com/',
     }
     logging.info(f"Search API: {base_url}")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(base_url, headers=headers)
+    response = await upstream_get("search", base_url, headers=headers)
     if response.status_code != 200:
         logging.error(f"Upstream Error, base_url: {base_url}, headers: {headers}")
         raise Exception("Upstream Error")
@@ -96,8 +127,7 @@ async def link_keywords(keyword):
         'accept-encoding': 'gzip, deflate, br, zstd',
         'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,zh-TW;q=0.7',
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(base_url, headers=headers)
+    response = await upstream_get("keywords", base_url, headers=headers)
     if response.status_code != 200:
         return JSONResponse(content={"error": "Upstream Error"}, status_code=507)
     try:
@@ -113,42 +143,131 @@ async def link_keywords(keyword):
         return response.json()
 
 
+class UpstreamResponseError(Exception):
+    """上游返回了不应缓存的结果，携带需要直接返回给客户端的响应"""
+
+    def __init__(self, response):
+        super().__init__("Uncacheable upstream response")
+        self.response = response
+
+
+async def detail_api(id):
+    """
+    详情 API
+    :param id:  视频 ID
+    :return:  返回详情数据
+    :raises UpstreamResponseError: 上游返回非 2xx（不写缓存，后台刷新时继续提供旧数据）
+    """
+    vv = await generate_vv_detail()
+    url = f"https://api.olelive.com/v1/pub/vod/detail/{id}/true?_vv={vv}"
+    headers = {
+            'User-Agent': _getRandomUserAgent(),
+            'Referer': 'https://www.olevod.com/',
+            'Origin': 'https://www.olevod.com/',
+    }
+    response = await upstream_get("detail", url, headers=headers)
+    if not response.is_success:
+        raise UpstreamResponseError(JSONResponse({"error": "Upstream Error"}, status_code=502,
+                                                 headers={"X-Cache": "MISS, Upstream Error"}))
+    return response.json()
+
+
+async def _fetch_search(keyword, page, size):
+    """
+    请求上游搜索（仅缓存有结果的响应）
+    """
+    result = await search_api(keyword, page, size)
+    if result and result['data']['total'] == 0:
+        raise UpstreamResponseError(JSONResponse({"error": "No result Found"}, status_code=200))
+    return result
+
+
+async def _fetch_keyword(keyword):
+    """
+    请求上游联想词，上游出错时原样返回错误响应且不缓存
+    """
+    data = await link_keywords(keyword)
+    if isinstance(data, JSONResponse):
+        raise UpstreamResponseError(data)
+    return data
+
+
+def search_spec(keyword, page, size):
+    """
+    搜索结果的缓存规格（缓存一天）
+    :return: (缓存键, 上游获取函数, 软过期, 硬过期)
+    """
+    id = f"search_{keyword}_{page}_{size}_{datetime.datetime.now().strftime('%Y-%m-%d')}"
+    return id, lambda: _fetch_search(keyword, page, size), None, 86400
+
+
+def keyword_spec(keyword):
+    """
+    联想词的缓存规格（缓存一天）
+    :return: (缓存键, 上游获取函数, 软过期, 硬过期)
+    """
+    redis_key = f"keyword_{datetime.datetime.now().strftime('%Y-%m-%d')}_{keyword}"
+    return redis_key, lambda: _fetch_keyword(keyword), None, 86400
+
+
+def detail_spec(id):
+    """
+    详情的缓存规格：软过期后返回旧数据并后台刷新
+    :return: (缓存键, 上游获取函数, 软过期, 硬过期)
+    """
+    return f"detail_{id}", lambda: detail_api(id), DETAIL_CACHE_SOFT_TTL, DETAIL_CACHE_HARD_TTL
+
+
+async def resolve_search(keyword, page, size):
+    """
+    搜索结果，相同缓存键的并发未命中只请求一次上游
+    :return: (CacheEntry, X-Cache 状态)
+    """
+    return await swr_fetch(*search_spec(keyword, page, size))
+
+
+async def resolve_keyword(keyword):
+    """
+    联想词
+    :return: (CacheEntry, X-Cache 状态)
+    """
+    return await swr_fetch(*keyword_spec(keyword))
+
+
+async def resolve_detail(id):
+    """
+    详情：软过期前直接返回，软过期后返回旧数据并后台刷新，未命中时回源（每个 id 只有一个进行中的请求）
+    :return: (CacheEntry, X-Cache 状态)
+    """
+    return await swr_fetch(*detail_spec(id))
+
+
 @searchRouter.api_route('/search', dependencies=[Depends(RateLimiter(times=3, seconds=1))], methods=['POST'],
                         name='search')
-async def search(request: Request, background_tasks: BackgroundTasks):
+async def search(request: Request):
     """
     搜索接口
     """
     data = await request.json()
-    data = await checkSum(data)
+    try:
+        data = await checkSum(data)
+    except SessionExpired:
+        return session_expired_response()
+    except HTTPException as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     keyword, page, size = data.get('keyword'), data.get('page'), data.get('size')
     if keyword == '' or keyword == 'your keyword':
         return JSONResponse({}, status_code=200)
     page, size = int(page), int(size)
     try:
-        id = f"search_{keyword}_{page}_{size}_{datetime.datetime.now().strftime('%Y-%m-%d')}"
-        if await redis_key_exists(id):
-            cached = await redis_get_key(id)
-            if cached is not None:
-                cached_data = json.loads(cached)
-                if isinstance(cached_data, dict):
-                    cached_data["msg"] = "cached"
-                return JSONResponse(cached_data, status_code=200, headers={"X-Cache": "HIT" if "msg" in cached_data and cached_data["msg"] == "cached" else "MISS"})
-    except Exception as e:
-        logging.info(f"Invalid Request: {data}, {e}")
-        pass
-    try:
-        result = await search_api(keyword, page, size)
+        entry, state = await resolve_search(keyword, page, size)
+    except UpstreamResponseError as e:
+        return e.response
+    except UpstreamUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=503)
-    if result and result['data']['total'] == 0:
-        return JSONResponse({"error": "No result Found"}, status_code=200)
-    if result:
-        background_tasks.add_task(redis_set_key, id, json.dumps(result), ex=86400)  # 缓存一天
-    try:
-        return JSONResponse(result)
-    except:
-        return JSONResponse(json.dumps(result), status_code=200)
+    return cached_response(request, entry, state)
 
 
 @searchRouter.api_route('/keyword', dependencies=[Depends(RateLimiter(times=2, seconds=1))], methods=['POST'],
@@ -157,6 +276,8 @@ async def keyword(request: Request):
     data = await request.json()
     try:
         data = await checkSum(data)
+    except SessionExpired:
+        return session_expired_response()
     except HTTPException as e:
         return JSONResponse({"error": str(e)}, status_code=400)
     except Exception as e:
@@ -169,74 +290,168 @@ async def keyword(request: Request):
         return JSONResponse(
             {"code": 0, "data": [{"type": "vod", "words": ["pong"]}],
              "msg": "ok"}, status_code=200, headers={"X-Info": "Success"})
-    redis_key = f"keyword_{datetime.datetime.now().strftime('%Y-%m-%d')}_{_keyword}"
     try:
-        cached = await redis_get_key(redis_key)
-        if cached is not None:
-            parsed = json.loads(cached)
-            if isinstance(parsed, dict):
-                parsed["msg"] = "cached"
-            data = parsed
-        else:
-            data = await link_keywords(_keyword)
-            await redis_set_key(redis_key, json.dumps(data), ex=86400)  # 缓存一天
+        entry, state = await resolve_keyword(_keyword)
+    except UpstreamResponseError as e:
+        return e.response
+    except UpstreamUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logging.error("Error: " + str(e), stack_info=True)
         return JSONResponse({"error": str(e)}, status_code=501, headers={"X-Error": str(e)})
-    try:
-        return JSONResponse(data, status_code=200, headers={"X-Cache": "HIT" if "msg" in data and data["msg"] == "cached" else "MISS"})
-    except:
-        return JSONResponse(json.loads(data), status_code=200, headers={"X-Cache": "MISS"})
+    return cached_response(request, entry, state)
 
 
 @searchRouter.api_route('/detail', methods=['POST'], name='detail',
                         dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def detail(request: Request, background_tasks: BackgroundTasks):
+async def detail(request: Request):
     data = await request.json()
-    data = await checkSum(data)
+    try:
+        data = await checkSum(data)
+    except SessionExpired:
+        return session_expired_response()
+    except HTTPException as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     try:
         id = data.get('id')
     except Exception as e:
         return JSONResponse({"error": "Invalid Request, missing param: id"}, status_code=400,
                             headers={"X-Cache": "MISS"})
 
-    # Try to return cached detail (cache for 30 minutes)
-    redis_key = f"detail_{id}"
     try:
-        cached = await redis_get_key(redis_key)
-        if cached:
-            cached_data = json.loads(cached)
-            # mark as cached so clients can know
-            if isinstance(cached_data, dict):
-                cached_data["msg"] = "cached"
-            return JSONResponse(cached_data, status_code=200, headers={"X-Cache": "HIT"})
+        entry, state = await resolve_detail(id)
+        return cached_response(request, entry, state)
+    except UpstreamResponseError as e:
+        return e.response
+    except UpstreamUnavailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503,
+                            headers={"X-Cache": "MISS, Upstream Unavailable", "Retry-After": str(e.retry_after)})
+    except Exception:
+        return JSONResponse({"error": "Upstream Error"}, status_code=501, headers={"X-Cache": "MISS, Upstream Error"})
+
+
+def _batch_ops(data):
+    """
+    解析批量请求中的子操作
+    完整格式: {"ops": [{"op": "detail", "id": 1}, {"op": "keyword", "keyword": "x"},
+                       {"op": "search", "keyword": "x", "page": 1, "size": 4}]}
+    简写格式: {"detail": [1, 2, 3], "keyword": ["x"]}（RSA 信封容量有限时更紧凑）
+    请求体不是对象、或 ops / detail / keyword 不是列表时抛出 ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Invalid Request, body must be an object")
+    for field in ('ops', 'detail', 'keyword'):
+        if data.get(field) is not None and not isinstance(data[field], list):
+            raise ValueError(f"Invalid Request, {field} must be a list")
+    ops = list(data.get('ops') or [])
+    ops += [{"op": "detail", "id": id} for id in data.get('detail') or []]
+    ops += [{"op": "keyword", "keyword": kw} for kw in data.get('keyword') or []]
+    return ops
+
+
+def _batch_spec(op):
+    """
+    子操作对应的缓存规格，参数不合法时抛出 ValueError
+    """
+    kind = op.get('op') if isinstance(op, dict) else None
+    if kind == 'detail':
+        if op.get('id') is None:
+            raise ValueError("Invalid Request, missing param: id")
+        return detail_spec(op['id'])
+    if kind in ('keyword', 'search'):
+        if not op.get('keyword') or op.get('keyword') == 'your keyword':
+            raise ValueError("Invalid Request, missing param: keyword")
+        if kind == 'keyword':
+            return keyword_spec(op['keyword'])
+        return search_spec(op['keyword'], int(op.get('page') or 1), int(op.get('size') or 4))
+    raise ValueError(f"Invalid Request, unknown op: {kind}")
+
+
+def _batch_item(op, status, cache=None, body=None, error=None) -> bytes:
+    """
+    单个子操作的结果，body 为已序列化的 JSON，直接拼接不再解析
+    """
+    head = {"op": op.get('op') if isinstance(op, dict) else None, "status": status}
+    if isinstance(op, dict):
+        for field in ('id', 'keyword', 'page', 'size'):
+            if field in op:
+                head[field] = op[field]
+    if cache:
+        head["cache"] = cache
+    if error is not None:
+        head["error"] = error
+    head = render(head)
+    if body is None:
+        return head
+    return head[:-1] + b',"data":' + body + b'}'
+
+
+# 批量接口未命中缓存的子操作按个数计入的回源额度，与单个接口的限流相当
+batch_upstream_limiter = RateLimiter(times=BATCH_UPSTREAM_PER_SECOND, seconds=1)
+
+
+@searchRouter.api_route('/batch', methods=['POST'], name='batch',
+                        dependencies=[Depends(RateLimiter(times=2, seconds=1))])
+async def batch(request: Request):
+    """
+    批量接口：一个加密信封内包含多个 detail / keyword / search 子操作
+    只做一次解密；缓存通过一次 MGET 读取，命中的子操作不计回源额度，
+    未命中的子操作按不同缓存键的个数计入回源额度，超出额度的逐项返回 429，其余按有限并发回源
+    """
+    data = await request.json()
+    try:
+        data = await checkSum(data)
+    except SessionExpired:
+        return session_expired_response()
     except Exception as e:
-        logging.info(f"Invalid Request: {data}, {e}", stack_info=True)
-        pass
-    # if redis lookup fails, continue to fetch upstream
-    vv = await generate_vv_detail()
-    url = f"https://api.olelive.com/v1/pub/vod/detail/{id}/true?_vv={vv}"
-    headers = {
-            'User-Agent': _getRandomUserAgent(),
-            'Referer': 'https://www.olevod.com/',
-            'Origin': 'https://www.olevod.com/',
-    }
+        logging.info(f"Invalid Request: {e}")
+        return JSONResponse({"error": "Invalid Request"}, status_code=400)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-        response_data = response.json()
-        # cache the response for 30 minutes (1800 seconds) in background
+        ops = _batch_ops(data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not ops:
+        return JSONResponse({"error": "Invalid Request, empty batch"}, status_code=400)
+    if len(ops) > BATCH_MAX_OPS:
+        return JSONResponse({"error": f"Invalid Request, at most {BATCH_MAX_OPS} ops per batch"}, status_code=400)
+
+    specs = []
+    for op in ops:
         try:
-            background_tasks.add_task(redis_set_key, redis_key, json.dumps(response_data), ex=1800)
-        except Exception:
-            # if scheduling background task fails, attempt immediate set but don't block on errors
-            try:
-                await redis_set_key(redis_key, json.dumps(response_data), ex=1800)
-            except Exception:
-                pass
-        return JSONResponse(response_data, status_code=200, headers={"X-Cache": "MISS"})
-    except Exception:
-        return JSONResponse({"error": "Upstream Error"}, status_code=501, headers={"X-Cache": "MISS, Upstream Error"})
+            specs.append(_batch_spec(op))
+        except (ValueError, TypeError) as e:
+            specs.append(e)
+    cached = iter(await cache_get_many([spec[0] for spec in specs if not isinstance(spec, Exception)]))
+    entries = [None if isinstance(spec, Exception) else next(cached) for spec in specs]
+    misses = list(dict.fromkeys(spec[0] for spec, entry in zip(specs, entries)
+                                if not isinstance(spec, Exception) and entry is None))
+    granted = await batch_upstream_limiter.take(request, "batch_upstream", len(misses)) if misses else 0
+    throttled = set(misses[granted:])
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def _resolve(op, spec, entry):
+        if isinstance(spec, Exception):
+            return _batch_item(op, 400, error=str(spec))
+        key, fetch, soft_ttl, hard_ttl = spec
+        if key in throttled:
+            return _batch_item(op, 429, error="Too Many Requests")
+        try:
+            if entry is None:
+                async with semaphore:
+                    entry, state = await swr_resolve(key, None, fetch, soft_ttl, hard_ttl)
+            else:
+                entry, state = await swr_resolve(key, entry, fetch, soft_ttl, hard_ttl)
+            return _batch_item(op, 200, state, entry.decoded())
+        except UpstreamResponseError as e:
+            return _batch_item(op, e.response.status_code, body=e.response.body)
+        except UpstreamUnavailable as e:
+            return _batch_item(op, 503, error=str(e))
+        except Exception as e:
+            logging.info(f"Batch op failed: {op}, {e}")
+            return _batch_item(op, 502, error="Upstream Error")
+
+    items = await asyncio.gather(*[_resolve(op, spec, entry) for op, spec, entry in zip(ops, specs, entries)])
+    return Response(content=b'{"code":0,"results":[' + b",".join(items) + b']}', media_type="application/json")
 
 
 @searchRouter.api_route('/report/keyword', methods=['POST'], name='report_keyword',
@@ -248,7 +463,12 @@ async def report_keyword(request: Request):
     # purge cache for the keyword and search result
     data = await request.json()
     # print(data, "checkpoint 1")
-    data = await checkSum(data)
+    try:
+        data = await checkSum(data)
+    except SessionExpired:
+        return session_expired_response()
+    except HTTPException as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     # print(data, "checkpoint 2")
     keyword = data.get('keyword')
     if keyword == '' or keyword == 'your keyword':
@@ -0,0 +1,104 @@
+"""
+Single-flight 模块 - 合并相同缓存键的并发上游请求
+同一进程内每个键只有一个进行中的上游请求，其余等待者共享结果；
+可选 Redis 锁模式将合并范围扩展到所有实例
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import dotenv
+
+from _redis import acquire_lock, release_lock
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 是否使用 Redis 锁在多实例之间合并请求
+SINGLEFLIGHT_REDIS_LOCK = os.getenv("SINGLEFLIGHT_REDIS_LOCK", "false").lower() == "true"
+# 锁的过期时间（毫秒），应大于一次上游请求的最长耗时
+SINGLEFLIGHT_LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", 10000))
+# 未拿到锁时等待其它实例写入缓存的最长时间（秒）
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", 10))
+# 等待期间轮询缓存的间隔（秒）
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 0.05))
+
+
+class SingleFlight:
+    """按键合并并发调用，同一时刻每个键只执行一次"""
+
+    def __init__(self, redis_lock: bool = False):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.redis_lock = redis_lock
+        self._leaders = 0
+        self._shared = 0
+        self._remote_hits = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 peek: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        执行 fn，相同 key 的并发调用共享同一个结果
+        :param key: 合并键（通常就是缓存键）
+        :param fn: 实际的上游获取函数，负责写入缓存
+        :param peek: 读取缓存的函数，Redis 锁模式下用于等待其它实例的结果
+        :return: fn 的返回值
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self._leaders += 1
+            task = asyncio.ensure_future(self._run(key, fn, peek))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self._shared += 1
+        # shield: 某个等待者被取消不会影响其它等待者
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]],
+                   peek: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        if not self.redis_lock or peek is None:
+            return await fn()
+
+        lock_name = f"singleflight:{key}"
+        token = await acquire_lock(lock_name, SINGLEFLIGHT_LOCK_TTL_MS)
+        if token:
+            try:
+                return await fn()
+            finally:
+                await release_lock(lock_name, token)
+
+        # 其它实例正在请求上游，等待其写入缓存
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SINGLEFLIGHT_WAIT_TIMEOUT
+        while loop.time() < deadline:
+            await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+            try:
+                result = await peek()
+            except Exception as e:
+                logger.debug(f"singleflight peek failed for {key}: {e}")
+                result = None
+            if result is not None:
+                self._remote_hits += 1
+                return result
+        logger.info(f"singleflight wait timed out for {key}, fetching upstream")
+        return await fn()
+
+    def in_flight(self, key: str) -> bool:
+        """该键当前是否有进行中的调用"""
+        return key in self._calls
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self._leaders,
+            'shared': self._shared,
+            'remote_hits': self._remote_hits,
+            'redis_lock': self.redis_lock,
+        }
+
+
+# 全局实例
+upstream_flight = SingleFlight(redis_lock=SINGLEFLIGHT_REDIS_LOCK)
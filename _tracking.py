@@ -0,0 +1,185 @@
+"""
+客户端缓存失效跟踪模块 - 基于 Redis 6+ 的 RESP3 CLIENT TRACKING（BCAST 模式）
+单独维持一个 RESP3 连接，对 CLIENT_TRACKING_PREFIXES 开启广播跟踪：任何实例写入或删除匹配的键时，
+Redis 推送 invalidate 消息，本进程立即从 L1 删除对应条目。连接正常期间这些键在 L1 中的缓存时间
+放宽到 CLIENT_TRACKING_TTL，读取不再访问 Redis；连接断开时清空这些条目并回到前缀策略的 TTL，
+后台重连后重新开启跟踪。空闲时每 CLIENT_TRACKING_PING_INTERVAL 秒发送一次 PING，
+下一个间隔内没有收到任何回复则视为连接已断开（静默断开的连接收不到失效通知）。
+读取与失效通知走不同连接，epoch 在每次失效时递增，读取前后 epoch 不一致的结果不写入 L1
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import dotenv
+from redis._parsers import _AsyncRESP3Parser
+from redis.exceptions import ResponseError
+
+from _l1cache import l1_cache
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 是否启用客户端缓存失效跟踪（需要 Redis 6+，仅 Redis 模式）
+CLIENT_TRACKING_ENABLED = os.getenv("CLIENT_TRACKING_ENABLED", "false").lower() == "true"
+# 跟踪的键前缀，需同时在 L1_CACHE_POLICIES 中配置才会进入 L1
+CLIENT_TRACKING_PREFIXES = os.getenv("CLIENT_TRACKING_PREFIXES", "vv,public_key,private_key,server_status")
+# 跟踪正常时被跟踪键在 L1 中的最长缓存时间（秒）
+CLIENT_TRACKING_TTL = float(os.getenv("CLIENT_TRACKING_TTL", 3600))
+# 跟踪连接断开后的重连间隔（秒）
+CLIENT_TRACKING_RETRY = float(os.getenv("CLIENT_TRACKING_RETRY", 1))
+# 空闲时发送 PING 的间隔（秒），PING 在下一个间隔内没有回复时重连
+CLIENT_TRACKING_PING_INTERVAL = float(os.getenv("CLIENT_TRACKING_PING_INTERVAL", 5))
+
+
+class ClientTracking:
+    """维持跟踪连接并把失效通知应用到 L1"""
+
+    def __init__(self, prefixes: List[str], ttl: float):
+        self.prefixes = tuple(prefix for prefix in prefixes if prefix)
+        self.ttl = ttl
+        self.active = False
+        self.epoch = 0
+        self._task: Optional[asyncio.Task] = None
+        # 最近一次从跟踪连接读到数据（推送或 PING 回复）的时间
+        self._last_read = 0.0
+        self.connects = 0
+        self.ping_timeouts = 0
+        self.disconnects = 0
+        self.invalidations = 0
+        self.flushes = 0
+
+    def start(self, pool):
+        """
+        在后台建立跟踪连接
+        :param pool: Redis 客户端的连接池，复用其地址、认证与超时配置
+        """
+        if self._task is None and self.prefixes:
+            self._task = asyncio.create_task(self._run(pool))
+
+    def ttl_for(self, key: str) -> Optional[float]:
+        """被跟踪的键在跟踪正常时返回放宽后的缓存时间，否则返回 None（使用前缀策略）"""
+        if self.active and key.startswith(self.prefixes):
+            return self.ttl
+        return None
+
+    def _reset(self):
+        """丢弃可能错过失效通知的条目"""
+        self.epoch += 1
+        l1_cache.invalidate_prefixes(self.prefixes)
+
+    async def _on_invalidate(self, message):
+        """处理一条推送：["invalidate", [键...]]，键列表为 None 表示 FLUSHALL/FLUSHDB"""
+        self.epoch += 1
+        keys = message[1] if len(message) > 1 else None
+        if keys is None:
+            self.flushes += 1
+            l1_cache.invalidate_prefixes(self.prefixes)
+            return message
+        for key in keys:
+            l1_cache.invalidate(key.decode() if isinstance(key, bytes) else key)
+            self.invalidations += 1
+        return message
+
+    async def _run(self, pool):
+        # 空闲时一直阻塞读取推送，不使用连接池的读超时
+        kwargs = {**pool.connection_kwargs, 'protocol': 3, 'parser_class': _AsyncRESP3Parser, 'socket_timeout': None}
+        if 'host' in kwargs:
+            kwargs['socket_keepalive'] = True
+        while True:
+            connection = pool.connection_class(**kwargs)
+            try:
+                await connection.connect()
+                connection._parser.set_invalidation_push_handler(self._on_invalidate)
+                args: List[Any] = ['CLIENT', 'TRACKING', 'ON', 'BCAST']
+                for prefix in self.prefixes:
+                    args += ['PREFIX', prefix]
+                await connection.send_command(*args)
+                await connection.read_response()
+                self._reset()
+                self.active = True
+                self.connects += 1
+                logger.info(f"Client tracking enabled for prefixes {list(self.prefixes)}")
+                await self._keepalive(connection)
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                # HELLO 3 或 CLIENT TRACKING 不被支持（Redis 6 以下），不再重试
+                logger.warning(f"Client tracking unavailable: {e}")
+                return
+            except Exception as e:
+                # 只在连接断开时告警，重连失败降为 info
+                (logger.warning if self.active else logger.info)(
+                    f"Client tracking connection lost: {e or type(e).__name__}")
+            finally:
+                if self.active:
+                    self.active = False
+                    self.disconnects += 1
+                self._reset()
+                await connection.disconnect()
+            await asyncio.sleep(CLIENT_TRACKING_RETRY)
+
+    async def _read_loop(self, connection):
+        """持续读取推送与 PING 回复，推送由 _on_invalidate 处理"""
+        while True:
+            await connection.read_response(push_request=True)
+            self._last_read = time.monotonic()
+
+    async def _keepalive(self, connection):
+        """
+        读取连接并在空闲时发送 PING；连接关闭或 PING 超时时抛出异常
+        """
+        self._last_read = time.monotonic()
+        reader = asyncio.create_task(self._read_loop(connection))
+        ping_sent_at = None
+        try:
+            while True:
+                await asyncio.wait({reader}, timeout=CLIENT_TRACKING_PING_INTERVAL)
+                if reader.done():
+                    reader.result()
+                    raise ConnectionError("Tracking connection closed")
+                now = time.monotonic()
+                if ping_sent_at is not None and self._last_read < ping_sent_at:
+                    self.ping_timeouts += 1
+                    raise TimeoutError("No reply to PING on tracking connection")
+                if now - self._last_read < CLIENT_TRACKING_PING_INTERVAL:
+                    # 期间有数据到达，连接可用
+                    ping_sent_at = None
+                    continue
+                ping_sent_at = now
+                await connection.send_command('PING')
+        finally:
+            reader.cancel()
+            # 只等待读取任务结束，不吞掉发给外层任务的取消
+            await asyncio.wait({reader})
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取跟踪状态"""
+        return {
+            'enabled': self._task is not None,
+            'active': self.active,
+            'prefixes': list(self.prefixes),
+            'ttl': self.ttl,
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'invalidations': self.invalidations,
+            'flushes': self.flushes,
+            'ping_timeouts': self.ping_timeouts,
+        }
+
+
+# 全局实例
+client_tracking = ClientTracking([prefix.strip() for prefix in CLIENT_TRACKING_PREFIXES.split(",")],
+                                 CLIENT_TRACKING_TTL)
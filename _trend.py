@@ -1,17 +1,19 @@
 import datetime
-import json
 import logging
+import os
 from json import JSONDecodeError
 from typing import Optional
 
 import httpx
 from fastapi import Depends
 from fastapi.routing import APIRouter
-from fastapi_limiter.depends import RateLimiter
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
-from _redis import get_key, set_key
+from _cache import cached_response, swr_fetch
+from _guard import UpstreamUnavailable
+from _ratelimit import RateLimiter
+from _upstream import upstream_get
 from _utils import _getRandomUserAgent, generate_vv_detail as gen_vv
 
 trendingRoute = APIRouter(prefix='/api/trending', tags=['Trending'])
@@ -19,6 +21,10 @@ trendingRoute = APIRouter(prefix='/api/trending', tags=['Trending'])
 ALLOWED_PERIODS = {'day', 'week', 'month', 'all'}
 ALLOWED_TYPE_IDS = {1, 2, 3, 4}
 
+# 热榜缓存：软过期后返回旧数据并后台刷新，硬过期为一天（键中包含日期）
+TRENDING_CACHE_SOFT_TTL = int(os.getenv("TRENDING_CACHE_SOFT_TTL", 60 * 60))
+TRENDING_CACHE_HARD_TTL = int(os.getenv("TRENDING_CACHE_HARD_TTL", 60 * 60 * 24))
+
 
 async def gen_url(typeID: int, period: str, amount=10):
     if period not in ALLOWED_PERIODS:
@@ -36,6 +42,46 @@ async def gen_url_v2(typeID: int, amount=10):
     return f"https://api.olelive.com/v1/pub/index/vod/hot/{typeID}/0/{amount}?_vv={vv}"
 
 
+def trending_spec(typeID: int, period: str, amount=10, day: Optional[datetime.date] = None):
+    """
+    按周期的热榜的缓存规格
+    :param day: 缓存键中的日期，默认今天（预热时传入明天）
+    :return: (缓存键, 上游获取函数, 软过期, 硬过期)
+    """
+    day = day or datetime.date.today()
+    key = f"trending_cache_{day.strftime('%Y-%m-%d')}_{period}_{typeID}_{amount}"
+
+    async def _fetch():
+        url = await gen_url(typeID, period, amount)
+        logging.info(f"Fetching trending data from: {url}")
+        response = await upstream_get("trending", url, headers={'User-Agent': _getRandomUserAgent()}, timeout=30)
+        # 非 2xx 抛出 HTTPStatusError，不写缓存，后台刷新时继续提供旧数据
+        response.raise_for_status()
+        return response.json()
+
+    return key, _fetch, TRENDING_CACHE_SOFT_TTL, TRENDING_CACHE_HARD_TTL
+
+
+def trending_v2_spec(typeID: int, amount=10, day: Optional[datetime.date] = None):
+    """
+    v2 热榜的缓存规格
+    :param day: 缓存键中的日期，默认今天（预热时传入明天）
+    :return: (缓存键, 上游获取函数, 软过期, 硬过期)
+    """
+    day = day or datetime.date.today()
+    key = f"trending_v2_cache_{day.strftime('%Y-%m-%d')}_{typeID}_{amount}"
+
+    async def _fetch():
+        url = await gen_url_v2(typeID, amount)
+        logging.info(f"Fetching trending data from: {url}")
+        response = await upstream_get("trending_v2", url, headers={'User-Agent': _getRandomUserAgent()}, timeout=30)
+        # 非 2xx 抛出 HTTPStatusError，不写缓存，后台刷新时继续提供旧数据
+        response.raise_for_status()
+        return response.json()
+
+    return key, _fetch, TRENDING_CACHE_SOFT_TTL, TRENDING_CACHE_HARD_TTL
+
+
 @trendingRoute.post('/{period}/trend')
 async def fetch_trending_data(request: Request, period: Optional[str] = 'day'):
     try:
@@ -62,26 +108,19 @@ async def fetch_trending_data(request: Request, period: Optional[str] = 'day'):
         logging.error(f"typeID: {typeID}, hint:typeID not in [1,2,3,4]")
         return JSONResponse(status_code=400, content={'error': 'Invalid typeID parameter, must be one of: 1 --> 电影, 2 --> 电视剧（连续剧）, 3 --> 综艺, 4 --> 动漫'})
 
-    url = await gen_url(typeID, period, amount=10)
-    logging.info(f"Fetching trending data from: {url}")
-
-    resp = None
-    api_payload = None
+    redis_key, _fetch, soft_ttl, hard_ttl = trending_spec(typeID, period, amount=10)
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, headers={'User-Agent': _getRandomUserAgent()}, timeout=30)
-            api_payload = resp.json()
-            return JSONResponse(status_code=200, content=api_payload)
+        entry, state = await swr_fetch(redis_key, _fetch, soft_ttl, hard_ttl)
+        logging.info(f"{state} cache for key: {redis_key}")
+        return cached_response(request, entry, state)
+    except UpstreamUnavailable as e:
+        return JSONResponse(status_code=503, content={'error': str(e)}, headers={"Retry-After": str(e.retry_after)})
     except httpx.RequestError as e:
-        logging.debug(f"snapshot: {api_payload}")
         return JSONResponse(status_code=500, content={'error': f"An error occurred: {e}"})
     except httpx.HTTPStatusError as e:
-        logging.debug(f"snapshot: {api_payload}")
         return JSONResponse(status_code=500, content={'error': f"An HTTP error occurred: {e}"})
     except Exception as e:
-        raw_text = resp.text if resp is not None else ""
-        logging.debug(f"snapshot: {api_payload}")
-        return JSONResponse(status_code=500, content={'error': f"An error occurred: {e}, response: {raw_text}"})
+        return JSONResponse(status_code=500, content={'error': f"An error occurred: {e}"})
 
 
 @trendingRoute.api_route('/v2/{typeID}', methods=['POST'], dependencies=[Depends(RateLimiter(times=2, seconds=1))])
@@ -98,19 +137,14 @@ async def fetch_trending_data_v2(request: Request, typeID: Optional[int] = None)
         logging.error(f"typeID: {typeID}, hint:typeID not in [1,2,3,4]")
         return JSONResponse(status_code=400, content={'error': 'Invalid typeID parameter, must be one of: 1 --> 电影, 2 --> 电视剧（连续剧）, 3 --> 综艺, 4 --> 动漫'})
 
-    redis_key = f"trending_v2_cache_{datetime.datetime.now().strftime('%Y-%m-%d')}_{typeID}_{amount}"
-    cached = await get_key(redis_key)
-    if cached:
-        logging.info(f"Hit cache for key: {redis_key}")
-        return JSONResponse(status_code=200, content=json.loads(cached))
-
-    url = await gen_url_v2(typeID, amount)
-    logging.info(f"Fetching trending data from: {url}")
+    redis_key, _fetch, soft_ttl, hard_ttl = trending_v2_spec(typeID, amount)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers={'User-Agent': _getRandomUserAgent()}, timeout=30)
-            payload = json.dumps(response.json())
-            await set_key(redis_key, payload, 60 * 60 * 24)
-            return JSONResponse(status_code=200, content=json.loads(payload))
+        entry, state = await swr_fetch(redis_key, _fetch, soft_ttl, hard_ttl)
+        logging.info(f"{state} cache for key: {redis_key}")
+        return cached_response(request, entry, state)
+    except UpstreamUnavailable as e:
+        return JSONResponse(status_code=503, content={'error': str(e)}, headers={"Retry-After": str(e.retry_after)})
     except httpx.RequestError as e:
         return JSONResponse(status_code=500, content={'error': f"An error occurred: {e}"})
+    except httpx.HTTPStatusError as e:
+        return JSONResponse(status_code=500, content={'error': f"An HTTP error occurred: {e}"})
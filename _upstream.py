@@ -0,0 +1,149 @@
+"""
+上游 HTTP 客户端模块 - 所有 olelive 请求共享同一个长连接客户端
+支持 keep-alive 连接池、可选 HTTP/2 多路复用、连接池/超时配置以及启动时 DNS 与连接预热；
+upstream_get 在熔断器与自适应并发限制（见 _guard.py）保护下发起请求，并支持对冲与重试（见 _hedge.py）
+"""
+import asyncio
+import logging
+import os
+from importlib.util import find_spec
+from typing import Optional
+from urllib.parse import urlsplit
+
+import dotenv
+import httpx
+
+from _guard import upstream_guard
+from _hedge import is_retryable_error, upstream_policy
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 上游基础地址，用于预热
+UPSTREAM_BASE_URL = os.getenv("UPSTREAM_BASE_URL", "https://api.olelive.com")
+# 是否启用 HTTP/2（默认关闭；需要额外安装 h2，未安装时自动降级为 HTTP/1.1）
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+# 连接池配置
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 60))
+# 超时配置（秒）
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", 15))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", 5))
+# 启动预热
+UPSTREAM_PREWARM = os.getenv("UPSTREAM_PREWARM", "true").lower() == "true"
+UPSTREAM_PREWARM_CONNECTIONS = int(os.getenv("UPSTREAM_PREWARM_CONNECTIONS", 2))
+
+_client: Optional[httpx.AsyncClient] = None
+_http2_active = False
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 依赖 h2 包，未安装时降级"""
+    if not UPSTREAM_HTTP2:
+        return False
+    if find_spec("h2") is None:
+        logger.warning("UPSTREAM_HTTP2 is enabled but h2 is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_client() -> httpx.AsyncClient:
+    global _http2_active
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=UPSTREAM_CONNECT_TIMEOUT,
+        read=UPSTREAM_READ_TIMEOUT,
+        write=UPSTREAM_READ_TIMEOUT,
+        pool=UPSTREAM_POOL_TIMEOUT,
+    )
+    _http2_active = _http2_enabled()
+    return httpx.AsyncClient(http2=_http2_active, limits=limits, timeout=timeout)
+
+
+async def prewarm_upstream():
+    """
+    预热上游：提前解析 DNS 并建立连接，避免第一个请求承担握手开销
+    :return: None
+    """
+    client = get_upstream_client()
+    host = urlsplit(UPSTREAM_BASE_URL).hostname
+    try:
+        await asyncio.get_running_loop().getaddrinfo(host, 443)
+    except Exception as e:
+        logger.warning(f"Upstream DNS prewarm failed for {host}: {e}")
+        return
+
+    # HTTP/2 下单个连接即可多路复用
+    count = 1 if _http2_active else max(UPSTREAM_PREWARM_CONNECTIONS, 1)
+
+    async def _touch():
+        try:
+            await client.head(UPSTREAM_BASE_URL)
+        except Exception as exc:
+            logger.warning(f"Upstream connection prewarm failed: {exc}")
+
+    await asyncio.gather(*[_touch() for _ in range(count)])
+
+
+async def init_upstream_client() -> httpx.AsyncClient:
+    """
+    初始化共享上游客户端，在 app.lifespan 启动阶段调用
+    :return: httpx.AsyncClient
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    if UPSTREAM_PREWARM:
+        await prewarm_upstream()
+    return _client
+
+
+async def close_upstream_client():
+    """
+    关闭共享上游客户端，在 app.lifespan 结束阶段调用
+    """
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def get_upstream_client() -> httpx.AsyncClient:
+    """
+    获取共享上游客户端
+    lifespan 之外（例如脚本）调用时会按需创建
+    :return: httpx.AsyncClient
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def _is_server_error(response: httpx.Response) -> bool:
+    return response.status_code >= 500
+
+
+async def upstream_get(endpoint: str, url: str, **kwargs) -> httpx.Response:
+    """
+    受保护的上游 GET 请求，5xx 和网络异常计为失败
+    每次尝试都经过熔断器与并发限制；可选对冲，失败时在重试预算内重试（见 _hedge.py）
+    :param endpoint: 上游接口名，用于区分熔断器、并发限制与对冲/重试统计
+    :param url: 请求地址
+    :param kwargs: 透传给 httpx.AsyncClient.get
+    :return: httpx.Response
+    :raises UpstreamUnavailable: 熔断打开或超过并发限制
+    """
+    def attempt():
+        return upstream_guard.call(endpoint, lambda: get_upstream_client().get(url, **kwargs),
+                                   is_failure=_is_server_error)
+
+    return await upstream_policy.run(endpoint, attempt, is_failure=_is_server_error,
+                                     retryable=is_retryable_error)
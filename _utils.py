@@ -8,9 +8,9 @@ import uuid
 from typing import Optional
 
 from fake_useragent import UserAgent
-from httpx import AsyncClient
 
 from _redis import get_key, set_key  # noqa
+from _upstream import get_upstream_client
 
 ua = UserAgent()
 
@@ -108,13 +108,12 @@ async def pushNotification(baseURL: str, msg: str, icon: str = '', click_url: st
     if is_passive:
         url += f'&passive=true'
     print(f"Pushing to {url}")
-    async with AsyncClient() as client:
-        response = await client.post(url, headers=headers)
-        print(response.status_code)
-        if response.status_code != 200:
-            return False
-        else:
-            return True
+    response = await get_upstream_client().post(url, headers=headers)
+    print(response.status_code)
+    if response.status_code != 200:
+        return False
+    else:
+        return True
 
 
 # url 编码关键词
@@ -1,4 +1,5 @@
 # 标准库
+import asyncio
 import binascii
 import logging
 import os
@@ -8,7 +9,6 @@ import time
 import uuid
 from contextlib import asynccontextmanager
 
-import httpx
 import redis.asyncio as redis
 from asgi_correlation_id import CorrelationIdMiddleware
 from dotenv import load_dotenv
@@ -21,12 +21,24 @@ from fastapi_utils.tasks import repeat_every
 from starlette.middleware.sessions import SessionMiddleware
 
 from _auth import authRoute
-from _cronjobs import keerRedisAlive, pushTaskExecQueue
+from _cronjobs import keerRedisAlive, maintainKeyRing, prewarmTrendingCache, pushTaskExecQueue
 from _crypto import cryptoRouter, init_crypto
+from _cryptopool import decrypt_pool
+from _envelope import session_keys
+from _failover import storage_failover
+from _guard import upstream_guard
+from _hedge import upstream_policy
+from _keyring import key_ring
+from _kv_server import KVServer
 from _memory_kv import get_memory_kv
-from _redis import get_keys_by_pattern, redis_client, set_key as redis_set_key, use_memory_kv
+from _ratelimit import rate_limit_engine
+from _redis import close_storage, get_cache_stats, get_redis_client, get_shared_kv_socket, get_storage_mode, \
+    init_storage, is_memory_kv, set_key as redis_set_key
+from _registry import INSTANCE_HEARTBEAT_INTERVAL, get_live_instances, register_instance, unregister_instance
 from _search import searchRouter
+from _singleflight import upstream_flight
 from _trend import trendingRoute
+from _upstream import close_upstream_client, get_upstream_client, init_upstream_client
 
 load_dotenv()
 loglevel = os.getenv("LOG_LEVEL", "ERROR")
@@ -34,16 +46,21 @@ logging.basicConfig(level=logging.getLevelName(loglevel))
 logger = logging.getLogger(__name__)
 
 instanceID = uuid.uuid4().hex
+startedAt = int(time.time())
 
 
-@repeat_every(seconds=60 * 3, wait_first=True)
+@repeat_every(seconds=INSTANCE_HEARTBEAT_INTERVAL, wait_first=True)
 async def registerInstance():
     """
-    注册实例
+    注册实例：写入心跳与元数据
     :return:
     """
     try:
-        await redis_set_key(f"node:{instanceID}", str(int(time.time())), 60 * 3)  # re-register every 3 minutes
+        await register_instance(instanceID, app.version, {
+            "commit": os.getenv("COMMIT_ID", "")[:8],
+            "started": startedAt,
+            "storage": get_storage_mode(),
+        })
     except Exception as e:
         logger.error(f"Failed to register instance: {e}", exc_info=True)
         exit(-1)
@@ -64,11 +81,10 @@ def is_valid_uuid4(uuid_string: str) -> bool:
 async def getLiveInstances():
     """
     获取活跃实例
-    :return:
+    :return: 实例元数据列表
     """
     try:
-        f = await get_keys_by_pattern("node:*")
-        return f
+        return await get_live_instances()
     except Exception as e:
         logger.error(f"Failed to get live instances: {e}", exc_info=True)
         return []
@@ -82,10 +98,9 @@ async def testPushServer():
     baseURL = os.getenv("PUSH_SERVER_URL", "").replace("https://", "").replace("http://", "")
     if not baseURL:
         return
-    async with httpx.AsyncClient() as client:
-        f = await client.get(f"https://{baseURL}/healthz")
-        if f.status_code == 200:
-            await redis_set_key("server_status", "running")
+    f = await get_upstream_client().get(f"https://{baseURL}/healthz")
+    if f.status_code == 200:
+        await redis_set_key("server_status", "running")
 
 
 @asynccontextmanager
@@ -95,46 +110,58 @@ async def lifespan(_: FastAPI):
     :param _: FastAPI 实例
     :return: None
     """
+    # 初始化共享上游客户端（连接池 + 预热）与存储后端（探测 Redis，失败时降级），两者并行
+    _, backend = await asyncio.gather(init_upstream_client(), init_storage())
+    print("✓ Upstream client initialized")
+    print(f"✓ Storage backend: {backend}")
+
     # 初始化内存 KV 存储
-    if use_memory_kv:
+    kv_server = None
+    if is_memory_kv():
         memory_kv = await get_memory_kv()
         await memory_kv.start()
         print("✓ Memory KV storage started")
-
-    # 初始化 Redis 或内存 KV 连接
-    if redis_client:
-        redis_connection = redis_client
-    else:
-        redis_connection = None
-
+        if get_shared_kv_socket() is not None:
+            # 加载快照后再对其它 worker 提供服务
+            kv_server = KVServer(memory_kv)
+            await kv_server.start(get_shared_kv_socket())
+            print("✓ Shared memory KV server started")
+
+    # 初始化限流：Redis（或共享内存 KV）连接，否则使用本进程的内存 KV
+    redis_connection = get_redis_client()
     if redis_connection:
         await FastAPILimiter.init(redis_connection)
-        if await redis_connection.ping():
-            logger.info("Redis connection established")
+        logger.info("Redis connection established")
     else:
-        # 内存 KV 模式下跳过 FastAPILimiter
-        try:
-            await FastAPILimiter.init(None)
-        except Exception:
-            logger.warning("FastAPILimiter not available in memory KV mode")
+        # 内存 KV 实现了限流脚本所需的命令，限流计数在进程内完成
+        await FastAPILimiter.init(await get_memory_kv())
 
     await testPushServer()
     await registerInstance()
     print("Instance registered", instanceID)
     await pushTaskExecQueue()
     await keerRedisAlive()
+    await prewarmTrendingCache()
     await init_crypto()
+    await maintainKeyRing()
     yield
 
     # 清理资源
-    if use_memory_kv:
-        memory_kv = await get_memory_kv()
+    await rate_limit_engine.close()
+    if kv_server is not None:
+        await kv_server.stop()
+    # 内存 KV 模式或故障切换时启动过的内存 KV
+    memory_kv = await get_memory_kv()
+    if memory_kv.ready:
         await memory_kv.stop()
         print("✓ Memory KV storage stopped")
 
-    if redis_connection:
-        await FastAPILimiter.close()
-        await redis_connection.connection_pool.disconnect()
+    await unregister_instance(instanceID)
+    await storage_failover.close()
+    await close_storage()
+
+    await close_upstream_client()
+    decrypt_pool.close()
 
     print("Instance unregistered", instanceID)
     print("graceful shutdown")
@@ -165,11 +192,29 @@ async def instance_id_header_middleware(request, call_next):
 @app.get('/test')
 async def test():
     """
-    测试接口
+    测试接口：返回存活实例的 id 与心跳时间，版本、负载等元数据只在 /stats 中返回
     :return:
     """
-    f = await get_keys_by_pattern("node:*")
-    return f
+    return [{'id': instance['id'], 'heartbeat': instance['heartbeat']} for instance in await getLiveInstances()]
+
+
+@app.get('/stats')
+async def stats():
+    """
+    运行时统计：各级缓存命中率、上游请求合并情况、上游熔断与并发限制状态、对冲与重试计数、限流、存活实例
+    :return:
+    """
+    return JSONResponse(content={
+        "instance-id": instanceID[:8],
+        "cache": get_cache_stats(),
+        "singleflight": upstream_flight.get_stats(),
+        "upstream": upstream_guard.get_stats(),
+        "hedge": upstream_policy.get_stats(),
+        "crypto": key_ring.get_stats(),
+        "sessions": session_keys.get_stats(),
+        "rate_limit": rate_limit_engine.get_stats(),
+        "instances": await getLiveInstances(),
+    })
 
 
 @app.get('/')
@@ -214,26 +259,40 @@ async def index(request: Request):
 @app.api_route('/healthz', methods=['GET'])
 async def healthz():
     """
-    健康检查
+    健康检查，mode 为当前实际使用的存储（Redis 故障降级期间为 memory-failover）
     :return:
     """
+    mode = get_storage_mode()
     try:
-        if use_memory_kv:
+        if is_memory_kv():
             memory_kv = await get_memory_kv()
+            if not memory_kv.ready:
+                # 快照尚未加载完成
+                return JSONResponse(content={"status": "starting", "mode": mode,
+                                             "message": "Memory KV storage is loading"}, status_code=503)
             if await memory_kv.ping():
-                return JSONResponse(content={"status": "ok", "message": "Memory KV storage is healthy"}, status_code=200)
+                return JSONResponse(content={"status": "ok", "mode": mode, "message": "Memory KV storage is healthy"},
+                                    status_code=200)
             else:
-                return JSONResponse(content={"status": "error", "error": "Memory KV storage failed code: 1000"},
-                                    status_code=500)
+                return JSONResponse(content={"status": "error", "mode": mode,
+                                             "error": "Memory KV storage failed code: 1000"}, status_code=500)
+        elif storage_failover.degraded:
+            # Redis 不可用，仍可用内存 KV 提供服务
+            return JSONResponse(content={"status": "degraded", "mode": mode,
+                                         "message": "Redis unavailable, serving from memory KV",
+                                         "queued_writes": storage_failover.get_stats()['queued_writes']},
+                                status_code=200)
         else:
-            f = await redis_client.ping()
+            f = await get_redis_client().ping()
             if f:
-                return JSONResponse(content={"status": "ok", "message": "Redis connection established"}, status_code=200)
+                return JSONResponse(content={"status": "ok", "mode": mode, "message": "Redis connection established"},
+                                    status_code=200)
             else:
-                return JSONResponse(content={"status": "error", "error": "redis conection failed code: 1000"},
-                                    status_code=500)
+                return JSONResponse(content={"status": "error", "mode": mode,
+                                             "error": "redis conection failed code: 1000"}, status_code=500)
     except Exception as e:
-        return JSONResponse(content={"status": "error", "error": f"Storage connection failed: {str(e)}"}, status_code=500)
+        return JSONResponse(content={"status": "error", "mode": mode, "error": f"Storage connection failed: {str(e)}"},
+                            status_code=500)
 
 
 @app.middleware("http")
@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+import json
+import sys
+
+import httpx
+
+import _redis
+import _search
+import _trend
+from _cache import FRESH, MISS, STALE, _refresh_tasks, cache_get, swr_fetch
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+class FakeUpstream:
+    """按顺序返回预设的 (状态码, JSON) 并记录调用次数"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def __call__(self, endpoint, url, **kwargs):
+        status, body = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return httpx.Response(status, json=body, request=httpx.Request("GET", url))
+
+
+async def drain_refreshes():
+    while _refresh_tasks:
+        await asyncio.gather(*list(_refresh_tasks))
+
+
+async def check_swr_states() -> bool:
+    """
+    未命中回源（MISS），软过期前直接返回（FRESH），软过期后返回旧数据并后台刷新（STALE）
+    """
+    versions = itertools.count(1)
+
+    async def fetch():
+        return {"v": next(versions)}
+
+    entry, state = await swr_fetch("swr_states", fetch, 3600, 60)
+    if state != MISS or json.loads(entry.decoded()) != {"v": 1}:
+        print(f"❌ 首次读取应为 MISS，实际 {state}")
+        return False
+    entry, state = await swr_fetch("swr_states", fetch, 3600, 60)
+    if state != FRESH:
+        print(f"❌ 软过期前应为 FRESH，实际 {state}")
+        return False
+
+    await swr_fetch("swr_stale", fetch, 0, 60)
+    # stored_at 保留到毫秒，等待后才一定软过期
+    await asyncio.sleep(0.01)
+    entry, state = await swr_fetch("swr_stale", fetch, 0, 60)
+    if state != STALE or json.loads(entry.decoded()) != {"v": 2}:
+        print(f"❌ 软过期后应返回旧数据并标记 STALE，实际 {state}")
+        return False
+
+    print("✅ MISS / FRESH / STALE 状态正确")
+    return True
+
+
+async def check_detail_error_not_cached() -> bool:
+    """
+    上游详情返回非 2xx 时不写缓存；后台刷新失败时保留旧条目
+    """
+    _search.upstream_get = FakeUpstream((500, {"code": 500, "msg": "error"}))
+    try:
+        await swr_fetch(*_search.detail_spec(1))
+        print("❌ 上游 500 没有抛出异常")
+        return False
+    except _search.UpstreamResponseError as e:
+        if e.response.status_code != 502:
+            print(f"❌ 上游 500 返回了 {e.response.status_code}")
+            return False
+    if await cache_get("detail_1") is not None:
+        print("❌ 上游 500 的响应被写入缓存")
+        return False
+
+    _search.DETAIL_CACHE_SOFT_TTL = 0
+    _search.upstream_get = FakeUpstream((200, {"code": 0, "data": "good"}), (503, {"code": 503}))
+    await swr_fetch(*_search.detail_spec(2))
+    await asyncio.sleep(0.01)
+    entry, state = await swr_fetch(*_search.detail_spec(2))
+    await drain_refreshes()
+    if state != STALE or _search.upstream_get.calls != 2:
+        print(f"❌ 软过期后没有后台刷新（{state}，上游调用 {_search.upstream_get.calls} 次）")
+        return False
+    entry = await cache_get("detail_2")
+    if entry is None or json.loads(entry.decoded())["data"] != "good":
+        print("❌ 后台刷新失败时旧条目被覆盖")
+        return False
+
+    print("✅ 上游错误不写缓存，后台刷新失败保留旧数据")
+    return True
+
+
+async def check_trending_error_not_cached() -> bool:
+    """
+    v2 热榜上游返回非 2xx 时不写缓存
+    """
+    _trend.upstream_get = FakeUpstream((502, {"code": 502}))
+    key, fetch, soft_ttl, hard_ttl = _trend.trending_v2_spec(1, 10)
+    try:
+        await swr_fetch(key, fetch, soft_ttl, hard_ttl)
+        print("❌ 上游 502 没有抛出异常")
+        return False
+    except httpx.HTTPStatusError:
+        pass
+    if await cache_get(key) is not None:
+        print("❌ 上游 502 的响应被写入缓存")
+        return False
+
+    print("✅ 热榜上游错误不写缓存")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    results = []
+    for check in (check_swr_states, check_detail_error_not_cached, check_trending_error_not_cached):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
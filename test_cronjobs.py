@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import sys
+
+import httpx
+
+import _redis
+import _trend
+from _cache import cache_set
+from _cronjobs import prewarmTrending
+from _redis import key_exists
+from _trend import ALLOWED_PERIODS, ALLOWED_TYPE_IDS
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+class FakeUpstream:
+    """返回固定的热榜数据并记录请求的地址"""
+
+    def __init__(self):
+        self.urls = []
+
+    async def __call__(self, endpoint, url, **kwargs):
+        self.urls.append(url)
+        return httpx.Response(200, json={"code": 0, "data": []}, request=httpx.Request("GET", url))
+
+
+async def check_prewarm_coverage() -> bool:
+    """
+    预热覆盖 全部类型 × 全部周期 的按周期热榜，以及 全部类型 × (配置的 + 今天请求过的) amount 的 v2 热榜；
+    不合法或过大的 amount 不预热，已存在的键不重复回源
+    """
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    for amount in ("20", "abc", "500"):
+        await cache_set(f"trending_v2_cache_{today}_1_{amount}", b"{}", None, 60)
+
+    upstream = FakeUpstream()
+    _trend.upstream_get = upstream
+    failed = await prewarmTrending(tomorrow, 0)
+    if failed:
+        print(f"❌ 预热失败 {failed} 个")
+        return False
+
+    expected = [f"trending_cache_{tomorrow}_{period}_{typeID}_10"
+                for typeID in ALLOWED_TYPE_IDS for period in ALLOWED_PERIODS]
+    expected += [f"trending_v2_cache_{tomorrow}_{typeID}_{amount}"
+                 for typeID in ALLOWED_TYPE_IDS for amount in ("10", "20")]
+    missing = [key for key in expected if not await key_exists(key)]
+    if missing:
+        print(f"❌ 没有预热: {missing}")
+        return False
+    if len(upstream.urls) != len(expected):
+        print(f"❌ 回源 {len(upstream.urls)} 次，应为 {len(expected)} 次")
+        return False
+    for amount in ("abc", "500"):
+        if await key_exists(f"trending_v2_cache_{tomorrow}_1_{amount}"):
+            print(f"❌ 预热了不合法的 amount: {amount}")
+            return False
+
+    await prewarmTrending(tomorrow, 0)
+    if len(upstream.urls) != len(expected):
+        print("❌ 已预热的键再次回源")
+        return False
+
+    print(f"✅ 预热 {len(expected)} 个热榜缓存键")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    results = []
+    for check in (check_prewarm_coverage,):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
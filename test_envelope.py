@@ -0,0 +1,151 @@
+import asyncio
+import base64
+import os
+import sys
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import _envelope
+import _redis
+from _cryptopool import OAEP
+from _envelope import EnvelopeError, SessionExpired, SessionKeyCache, is_hybrid, open_envelope, session_id
+from _keyring import key_ring
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+def seal(session_key: bytes, plaintext: str, handshake: bool = True) -> dict:
+    """按客户端的方式构造 v=2 信封"""
+    timestamp = int(time.time())
+    iv = os.urandom(12)
+    data = {
+        "v": 2,
+        "timestamp": timestamp,
+        "iv": base64.b64encode(iv).decode(),
+        "data": base64.b64encode(AESGCM(session_key).encrypt(iv, plaintext.encode(), str(timestamp).encode())).decode(),
+    }
+    if handshake:
+        wrapped = key_ring.current.private_key.public_key().encrypt(session_key, OAEP)
+        data["key"] = base64.b64encode(wrapped).decode()
+        data["kid"] = key_ring.current.kid
+    else:
+        data["sid"] = session_id(session_key)
+    return data
+
+
+async def check_handshake_and_reuse() -> bool:
+    """
+    握手信封解包会话密钥，之后只带 sid 的信封直接对称解密；其它实例通过存储层共享会话密钥
+    """
+    session_key = AESGCM.generate_key(bit_length=128)
+    handshake = seal(session_key, '{"id": 1}')
+    if not is_hybrid(handshake) or is_hybrid({"data": "rsa"}):
+        print("❌ is_hybrid 判断错误")
+        return False
+    if await open_envelope(handshake) != '{"id": 1}':
+        print("❌ 握手信封解密失败")
+        return False
+    if await open_envelope(seal(session_key, "中文", handshake=False)) != "中文":
+        print("❌ 复用会话的信封解密失败")
+        return False
+    if _envelope.session_keys.handshakes != 1 or _envelope.session_keys.hits != 1:
+        print(f"❌ 会话统计为 {_envelope.session_keys.get_stats()}")
+        return False
+
+    local = _envelope.session_keys
+    _envelope.session_keys = SessionKeyCache(10, 60)
+    try:
+        if await open_envelope(seal(session_key, "shared", handshake=False)) != "shared":
+            print("❌ 其它实例不能通过存储层复用会话")
+            return False
+        if _envelope.session_keys.shared_hits != 1:
+            print("❌ 没有从存储层读取会话密钥")
+            return False
+    finally:
+        _envelope.session_keys = local
+
+    print("✅ 握手与会话复用正确")
+    return True
+
+
+async def check_rejections() -> bool:
+    """
+    篡改 timestamp（AAD）或密文时认证失败；未知会话只带 sid 时要求重新握手；会话密钥长度不合法时拒绝
+    """
+    session_key = AESGCM.generate_key(bit_length=256)
+    await open_envelope(seal(session_key, "x"))
+
+    tampered = seal(session_key, "x", handshake=False)
+    tampered["timestamp"] += 1
+    bad_length = seal(AESGCM.generate_key(bit_length=128), "x")
+    bad_length["key"] = base64.b64encode(key_ring.current.private_key.public_key().encrypt(os.urandom(20), OAEP)).decode()
+    cases = [
+        ("篡改 timestamp", tampered, EnvelopeError),
+        ("未知会话", seal(os.urandom(16), "x", handshake=False), SessionExpired),
+        ("会话密钥长度", bad_length, EnvelopeError),
+        ("格式错误", {"v": 2, "sid": "x"}, EnvelopeError),
+    ]
+    for name, data, error in cases:
+        try:
+            await open_envelope(data)
+            print(f"❌ {name} 的信封被接受")
+            return False
+        except error:
+            pass
+
+    print("✅ 篡改、未知会话与非法密钥被拒绝")
+    return True
+
+
+async def check_session_cache_bounds() -> bool:
+    """
+    进程内会话缓存按 LRU 淘汰，超过 TTL 的会话失效
+    """
+    _envelope.SESSION_KEY_SHARED = False
+    try:
+        cache = SessionKeyCache(2, 60)
+        sids = [(await cache.add(os.urandom(16)))[0] for _ in range(2)]
+        await cache.get(sids[0])
+        await cache.add(os.urandom(16))
+        if await cache.get(sids[1]) is not None or await cache.get(sids[0]) is None or cache.evictions != 1:
+            print("❌ 会话缓存没有淘汰最久未使用的会话")
+            return False
+
+        cache = SessionKeyCache(2, 0)
+        sid, _ = await cache.add(os.urandom(16))
+        await asyncio.sleep(0.01)
+        if await cache.get(sid) is not None:
+            print("❌ 超过 TTL 的会话仍然有效")
+            return False
+    finally:
+        _envelope.SESSION_KEY_SHARED = True
+
+    print("✅ 会话缓存的容量与过期正确")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    await key_ring.load_or_create()
+    results = []
+    for check in (check_handshake_and_reuse, check_rejections, check_session_cache_bounds):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,127 @@
+import asyncio
+import sys
+import time
+
+import fakeredis
+
+import _failover
+import _memory_kv
+import _redis
+from _failover import StorageFailover, storage_failover
+from _memory_kv import get_memory_kv
+
+
+def use_fake_redis(server: fakeredis.FakeServer):
+    """让 _redis 以 Redis 模式连接到 fakeredis"""
+    _redis.redis_client = fakeredis.FakeAsyncRedis(server=server)
+    _redis.use_memory_kv = False
+    _redis._storage_initialized = True
+
+
+async def wait_for(predicate, timeout: float = 3) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def check_failover_and_replay(server: fakeredis.FakeServer) -> bool:
+    """
+    连续连接错误后切换到内存 KV 并启动其过期清理；恢复后回放写入与删除，再切回 Redis
+    """
+    client = _redis.redis_client
+    await client.set("kept", "old")
+    await client.set("removed", "1")
+    memory_kv = await get_memory_kv()
+
+    server.connected = False
+    while not storage_failover.degraded:
+        await _redis.get_key("probe")
+    if _redis.get_storage_mode() != "memory-failover":
+        print("❌ 降级后存储模式不是 memory-failover")
+        return False
+    if not await wait_for(lambda: memory_kv.ready):
+        print("❌ 降级后内存 KV 没有启动")
+        return False
+
+    await _redis.set_key("kept", "new")
+    await _redis.set_key("written", "1")
+    await _redis.delete_key("removed")
+    await memory_kv.set("short", "1", px=10)
+    if not await wait_for(lambda: "short" not in memory_kv._store):
+        print("❌ 降级期间内存 KV 的过期键没有被清理")
+        return False
+    if await _redis.get_key("kept") != "new":
+        print("❌ 降级期间读不到降级期间的写入")
+        return False
+
+    server.connected = True
+    if not await wait_for(lambda: not storage_failover.degraded):
+        print("❌ Redis 恢复后没有切回")
+        return False
+    if (await client.get("kept"), await client.get("written"), await client.exists("removed")) != (b"new", b"1", 0):
+        print("❌ 恢复后回放结果不正确")
+        return False
+    if memory_kv.get_stats()['total_keys'] != 0:
+        print("❌ 切回后内存 KV 没有清空")
+        return False
+
+    print("✅ 故障切换、过期清理与回放正常")
+    return True
+
+
+async def check_queue_drops_expired(_) -> bool:
+    """
+    回放跳过已过期的写入；队列满时先丢弃已过期的写入，再丢弃最早的写入
+    """
+    failover = StorageFailover(enabled=True, threshold=1, queue_max=3)
+    failover.queue_set("a", "1", px=1)
+    failover.queue_set("b", "1", px=1)
+    failover.queue_set("c", "1")
+    await asyncio.sleep(0.01)
+    failover.queue_set("d", "1")
+    failover.queue_set("e", "1")
+    if list(failover._queue) != ["c", "d", "e"] or failover.dropped:
+        print(f"❌ 队列满时保留了 {list(failover._queue)}，丢弃 {failover.dropped} 个未过期写入")
+        return False
+
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeAsyncRedis(server=server)
+    failover.queue_set("f", "1", px=1)
+    await asyncio.sleep(0.01)
+    replayed = await failover._replay(client)
+    if replayed != 2 or await client.exists("f") or not await client.exists("e"):
+        print(f"❌ 回放了 {replayed} 个写入，应跳过已过期的 f")
+        return False
+
+    print("✅ 已过期的写入不占用队列也不回放")
+    return True
+
+
+async def main() -> int:
+    _failover.FAILOVER_PROBE_INTERVAL = 0.05
+    _memory_kv._CLEANUP_INTERVAL = 0.01
+    server = fakeredis.FakeServer()
+    use_fake_redis(server)
+    results = []
+    try:
+        for check in (check_failover_and_replay, check_queue_drops_expired):
+            print(f"\n开始检查 {check.__name__}...")
+            results.append(await check(server))
+    finally:
+        await storage_failover.close()
+        await (await get_memory_kv()).stop()
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
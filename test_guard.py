@@ -0,0 +1,149 @@
+import asyncio
+import sys
+
+import _guard
+from _guard import AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+
+
+async def ok():
+    return 200
+
+
+async def fail():
+    raise ConnectionError("boom")
+
+
+async def check_circuit_breaker() -> bool:
+    """
+    连续失败达到阈值后打开并快速失败；reset 后半开只放行一个探测，探测成功关闭、失败重新打开，
+    探测被取消时下一个请求可以继续探测
+    """
+    _guard.UPSTREAM_BREAKER_FAILURES = 3
+    _guard.UPSTREAM_BREAKER_RESET = 0.05
+    guard = UpstreamGuard()
+    for _ in range(3):
+        try:
+            await guard.call("detail", fail)
+        except ConnectionError:
+            pass
+    if not guard.is_open("detail"):
+        print("❌ 连续失败 3 次后没有熔断")
+        return False
+    try:
+        await guard.call("detail", ok)
+        print("❌ 熔断期间请求被放行")
+        return False
+    except UpstreamUnavailable as e:
+        if e.reason != "circuit open" or e.retry_after != 1:
+            print(f"❌ 快速失败的原因为 {e.reason}，retry_after={e.retry_after}")
+            return False
+
+    await asyncio.sleep(0.06)
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return 200
+
+    probe = asyncio.create_task(guard.call("detail", slow))
+    await asyncio.sleep(0)
+    try:
+        await guard.call("detail", ok)
+        print("❌ 半开状态下放行了第二个请求")
+        return False
+    except UpstreamUnavailable:
+        pass
+    probe.cancel()
+    try:
+        await probe
+    except asyncio.CancelledError:
+        pass
+
+    try:
+        await guard.call("detail", fail)
+    except ConnectionError:
+        pass
+    if not guard.is_open("detail") or guard.get_stats()["detail"]["trips"] != 2:
+        print("❌ 探测失败后没有重新打开")
+        return False
+    await asyncio.sleep(0.06)
+    if await guard.call("detail", ok) != 200 or guard.get_stats()["detail"]["state"] != CircuitBreaker.CLOSED:
+        print("❌ 探测成功后没有关闭")
+        return False
+    if guard.get_stats()["detail"]["inflight"] != 0:
+        print("❌ 调用结束后并发计数没有归零")
+        return False
+
+    print("✅ 熔断器打开、半开与关闭正确")
+    return True
+
+
+async def check_adaptive_limiter() -> bool:
+    """
+    成功且延迟正常时加性增长，失败或延迟过高时乘性收缩，并限制在上下限之间；达到并发上限时快速失败
+    """
+    limiter = AdaptiveLimiter(4, 2, 5, latency_target=1.0, backoff=0.5)
+    limiter.acquire()
+    limiter.release(0.1, True)
+    if limiter.limit != 4.25:
+        print(f"❌ 成功后上限为 {limiter.limit}，应为 4.25")
+        return False
+    limiter.acquire()
+    limiter.release(2.0, True)
+    limiter.acquire()
+    limiter.release(0.1, False)
+    if limiter.limit != 2:
+        print(f"❌ 变慢和失败后上限为 {limiter.limit}，应收缩到下限 2")
+        return False
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(0.1, True)
+    if limiter.limit != 5:
+        print(f"❌ 持续成功后上限为 {limiter.limit}，应为上限 5")
+        return False
+
+    _guard.UPSTREAM_LIMIT_INITIAL = 2
+    guard = UpstreamGuard()
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return 200
+
+    calls = [asyncio.create_task(guard.call("search", slow)) for _ in range(2)]
+    await asyncio.sleep(0)
+    try:
+        await guard.call("search", ok)
+        print("❌ 超过并发上限的请求被放行")
+        return False
+    except UpstreamUnavailable as e:
+        if e.reason != "concurrency limit reached":
+            print(f"❌ 快速失败的原因为 {e.reason}")
+            return False
+    release.set()
+    await asyncio.gather(*calls)
+    if guard.get_stats()["search"]["rejected"] != 1 or await guard.call("search", ok) != 200:
+        print("❌ 并发释放后请求仍被拒绝")
+        return False
+
+    print("✅ 自适应并发限制增长、收缩与拒绝正确")
+    return True
+
+
+async def main() -> int:
+    results = []
+    for check in (check_circuit_breaker, check_adaptive_limiter):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,169 @@
+import asyncio
+import sys
+import time
+
+import httpx
+
+import _hedge
+from _guard import UpstreamUnavailable
+from _hedge import RequestPolicy, RetryBudget, is_retryable_error
+
+
+def is_failure(status: int) -> bool:
+    return status >= 500
+
+
+class Attempts:
+    """按顺序返回或抛出预设的结果，每项可带延迟"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        delay, outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+async def check_retry_budget() -> bool:
+    """
+    预算从上限开始，每次取出一个额度；原始请求按比例存入，另有按时间补充的保底额度，不超过上限
+    """
+    budget = RetryBudget(ratio=0.5, min_per_sec=0, max_tokens=2)
+    if not (budget.try_withdraw() and budget.try_withdraw()) or budget.try_withdraw():
+        print("❌ 预算上限为 2 时取出次数不正确")
+        return False
+    budget.deposit()
+    if budget.try_withdraw():
+        print("❌ 存入 0.5 个额度后就可以取出")
+        return False
+    budget.deposit()
+    if not budget.try_withdraw():
+        print("❌ 存入满 1 个额度后不能取出")
+        return False
+    for _ in range(10):
+        budget.deposit()
+    if budget.tokens != 2:
+        print(f"❌ 预算 {budget.tokens} 超过上限")
+        return False
+
+    budget = RetryBudget(ratio=0, min_per_sec=100, max_tokens=1)
+    budget.try_withdraw()
+    await asyncio.sleep(0.02)
+    if not budget.try_withdraw():
+        print("❌ 保底额度没有随时间补充")
+        return False
+
+    print("✅ 重试预算存取正确")
+    return True
+
+
+async def check_retries() -> bool:
+    """
+    网络异常与 5xx 在 UPSTREAM_RETRY_MAX 内重试；预算不足时停止重试；熔断等快速失败不重试
+    """
+    _hedge.UPSTREAM_RETRY_MAX = 2
+    _hedge.UPSTREAM_RETRY_BACKOFF_BASE = 0.001
+    policy = RequestPolicy(RetryBudget(ratio=0, min_per_sec=0, max_tokens=10))
+    attempt = Attempts((0, httpx.ConnectError("down")), (0, 503), (0, 200))
+    if await policy.run("detail", attempt, is_failure, is_retryable_error) != 200 or attempt.calls != 3:
+        print(f"❌ 重试 {attempt.calls - 1} 次后没有拿到成功结果")
+        return False
+    attempt = Attempts((0, 503))
+    if await policy.run("detail", attempt, is_failure, is_retryable_error) != 503 or attempt.calls != 3:
+        print(f"❌ 超过重试次数后应返回最后的 5xx，实际调用 {attempt.calls} 次")
+        return False
+
+    attempt = Attempts((0, UpstreamUnavailable("detail", "circuit open")))
+    try:
+        await policy.run("detail", attempt, is_failure, is_retryable_error)
+        print("❌ 快速失败没有抛出")
+        return False
+    except UpstreamUnavailable:
+        if attempt.calls != 1:
+            print("❌ 熔断导致的快速失败被重试")
+            return False
+
+    policy = RequestPolicy(RetryBudget(ratio=0, min_per_sec=0, max_tokens=1))
+    attempt = Attempts((0, httpx.ReadTimeout("slow")))
+    try:
+        await policy.run("search", attempt, is_failure, is_retryable_error)
+        print("❌ 重试用尽后没有抛出最后的异常")
+        return False
+    except httpx.ReadTimeout:
+        pass
+    stats = policy.get_stats()['routes']['search']
+    if attempt.calls != 2 or stats['retries'] != 1 or stats['retries_denied'] != 1:
+        print(f"❌ 预算只有 1 个额度时调用 {attempt.calls} 次，统计 {stats}")
+        return False
+
+    print("✅ 重试次数与预算限制正确")
+    return True
+
+
+async def check_hedging() -> bool:
+    """
+    首个请求超过近期延迟分位数仍未返回时发出对冲请求，取先成功的结果并取消另一个；
+    样本不足时不对冲，预算不足时等待首个请求
+    """
+    _hedge.UPSTREAM_HEDGE_ENABLED = True
+    _hedge.UPSTREAM_RETRY_MAX = 0
+    policy = RequestPolicy(RetryBudget(ratio=0, min_per_sec=0, max_tokens=1))
+    warmup = Attempts((0, 200))
+    for _ in range(_hedge._MIN_SAMPLES - 1):
+        await policy.run("detail", warmup, is_failure, is_retryable_error)
+    if policy.get_stats()['routes']['detail']['hedge_delay_ms'] is not None:
+        print("❌ 样本不足时给出了对冲延迟")
+        return False
+    await policy.run("detail", warmup, is_failure, is_retryable_error)
+
+    attempt = Attempts((1, 200), (0, 201))
+    start = time.monotonic()
+    result = await policy.run("detail", attempt, is_failure, is_retryable_error)
+    elapsed = time.monotonic() - start
+    stats = policy.get_stats()['routes']['detail']
+    if result != 201 or elapsed > 0.5 or stats['hedges'] != 1 or stats['hedge_wins'] != 1:
+        print(f"❌ 对冲结果 {result}，耗时 {elapsed:.2f}s，统计 {stats}")
+        return False
+    await asyncio.sleep(0)
+    if attempt.cancelled != 1:
+        print("❌ 对冲成功后慢请求没有被取消")
+        return False
+
+    attempt = Attempts((0.1, 200), (0, 201))
+    result = await policy.run("detail", attempt, is_failure, is_retryable_error)
+    stats = policy.get_stats()['routes']['detail']
+    if result != 200 or attempt.calls != 1 or stats['hedges_denied'] != 1:
+        print(f"❌ 预算不足时结果 {result}，调用 {attempt.calls} 次，统计 {stats}")
+        return False
+
+    print("✅ 对冲请求按延迟分位数与预算发出")
+    return True
+
+
+async def main() -> int:
+    results = []
+    for check in (check_retry_budget, check_retries, check_hedging):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
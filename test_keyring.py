@@ -0,0 +1,145 @@
+import asyncio
+import sys
+
+import fakeredis
+
+import _failover
+import _keyring
+import _redis
+from _cryptopool import OAEP
+from _failover import storage_failover
+from _keyring import KEYRING_KEY, KEYRING_LOCK, KEYRING_VERSION_KEY, KeyRing
+
+
+def use_fake_redis(server: fakeredis.FakeServer):
+    """让 _redis 以 Redis 模式连接到 fakeredis"""
+    _redis.redis_client = fakeredis.FakeAsyncRedis(server=server)
+    _redis.use_memory_kv = False
+    _redis._storage_initialized = True
+
+
+async def check_rotation_overlap(server: fakeredis.FakeServer) -> bool:
+    """
+    轮换后旧密钥在重叠窗口内仍可解密（带或不带 kid），过期后只剩新密钥并在 maintain 时从密钥环移除；
+    其它实例遇到未知 kid 时从存储层重新加载
+    """
+    ring, other = KeyRing(), KeyRing()
+    await ring.load_or_create()
+    await other.load_or_create()
+    old = ring.current
+    old_ciphertext = old.private_key.public_key().encrypt(b"old", OAEP)
+
+    _keyring.KEYRING_OVERLAP = 0.2
+    try:
+        new = await ring.rotate()
+    finally:
+        _keyring.KEYRING_OVERLAP = 24 * 60 * 60
+    new_ciphertext = new.private_key.public_key().encrypt(b"new", OAEP)
+    if await ring.decrypt(old_ciphertext) != b"old" or await ring.decrypt(old_ciphertext, old.kid) != b"old":
+        print("❌ 重叠窗口内旧密钥不能解密")
+        return False
+    if [key.kid for key in ring.candidates()] != [new.kid, old.kid]:
+        print("❌ 没有优先使用当前密钥")
+        return False
+
+    other._checked_at = 0
+    if await other.decrypt(new_ciphertext, new.kid) != b"new" or other.current.kid != new.kid:
+        print("❌ 其它实例遇到未知 kid 时没有重新加载密钥环")
+        return False
+
+    await asyncio.sleep(0.25)
+    try:
+        await ring.decrypt(old_ciphertext, old.kid)
+        print("❌ 重叠窗口结束后旧密钥仍可解密")
+        return False
+    except ValueError:
+        pass
+    await _redis.redis_client.delete(KEYRING_LOCK)
+    await ring.maintain()
+    if [key['kid'] for key in ring.get_stats()['keys']] != [new.kid]:
+        print("❌ maintain 没有移除过期密钥")
+        return False
+    await other.refresh(force=True)
+    if len(other.get_stats()['keys']) != 1:
+        print("❌ 其它实例没有同步移除过期密钥")
+        return False
+
+    print("✅ 密钥轮换的重叠窗口与过期清理正确")
+    return True
+
+
+async def check_no_overwrite_after_failover(server: fakeredis.FakeServer) -> bool:
+    """
+    故障切换期间 maintain 不把密钥环当作丢失写回，恢复后的回放不会覆盖其它实例轮换后的密钥环
+    """
+    ring, other = KeyRing(), KeyRing()
+    await ring.load_or_create()
+    await other.refresh(force=True)
+    rotated = await other.rotate()
+    version = int(await _redis.redis_client.get(KEYRING_VERSION_KEY))
+
+    server.connected = False
+    while not storage_failover.degraded:
+        await _redis.get_key("probe")
+    await ring.maintain()
+    server.connected = True
+    for _ in range(100):
+        if not storage_failover.degraded:
+            break
+        await asyncio.sleep(0.05)
+    if storage_failover.degraded:
+        print("❌ Redis 恢复后没有切回")
+        return False
+
+    if int(await _redis.redis_client.get(KEYRING_VERSION_KEY)) != version:
+        print("❌ 故障切换期间写入的密钥环覆盖了 Redis 中的版本")
+        return False
+    await ring.refresh(force=True)
+    if ring.current.kid != rotated.kid:
+        print("❌ 恢复后没有加载其它实例轮换后的密钥")
+        return False
+
+    print("✅ 故障切换期间跳过密钥环维护")
+    return True
+
+
+async def check_restore_missing_ring(server: fakeredis.FakeServer) -> bool:
+    """
+    Redis 正常但密钥环数据丢失时，maintain 写回进程内的密钥环
+    """
+    ring = KeyRing()
+    await ring.load_or_create()
+    # fakeredis 不支持 EVAL，release_lock 无法释放，锁只能手动删除
+    await _redis.redis_client.delete(KEYRING_KEY, KEYRING_VERSION_KEY, KEYRING_LOCK)
+    await ring.maintain()
+    if await _redis.redis_client.get(KEYRING_KEY) is None:
+        print("❌ 密钥环丢失后没有写回")
+        return False
+
+    print("✅ 密钥环丢失后写回")
+    return True
+
+
+async def main() -> int:
+    _failover.FAILOVER_PROBE_INTERVAL = 0.05
+    server = fakeredis.FakeServer()
+    use_fake_redis(server)
+    results = []
+    try:
+        for check in (check_rotation_overlap, check_no_overwrite_after_failover, check_restore_missing_ring):
+            print(f"\n开始检查 {check.__name__}...")
+            results.append(await check(server))
+    finally:
+        await storage_failover.close()
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
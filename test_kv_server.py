@@ -0,0 +1,171 @@
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+
+import redis.asyncio as redis
+from redis.asyncio.connection import UnixDomainSocketConnection
+from fastapi_limiter import FastAPILimiter
+from redis.exceptions import NoScriptError, ResponseError
+
+import _redis  # noqa  登记 Python 实现的 Lua 脚本
+from _kv_server import KVServer
+from _memory_kv import MemoryKV
+
+
+async def start_server(path: str) -> KVServer:
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(path)
+    sock.listen(64)
+    sock.setblocking(False)
+    server = KVServer(MemoryKV(maxmemory=0))
+    await server.start(sock)
+    return server
+
+
+async def check_scan_cursor(client: redis.Redis) -> bool:
+    """
+    SCAN 返回真实游标，redis-py 的 scan_iter 按游标分多次取完全部匹配键
+    """
+    async with client.pipeline(transaction=False) as pipe:
+        for i in range(3000):
+            pipe.set(f"pushTask:{i}", "1")
+        pipe.set("other", "1")
+        await pipe.execute()
+
+    cursor, keys = await client.scan(0, match="pushTask:*", count=100)
+    if cursor == 0:
+        print("❌ 第一批 SCAN 就返回了游标 0")
+        return False
+
+    scanned = [key async for key in client.scan_iter(match="pushTask:*", count=100)]
+    if len(scanned) != 3000 or len(set(scanned)) != 3000:
+        print(f"❌ scan_iter 返回 {len(scanned)} 个键，应为 3000")
+        return False
+
+    if len(await client.keys("pushTask:*")) != 3000:
+        print("❌ KEYS 没有返回全部匹配键")
+        return False
+
+    print("✅ SCAN 按游标分批返回")
+    return True
+
+
+async def check_multi_exec(client: redis.Redis) -> bool:
+    """
+    MULTI 之后的命令排队并返回 QUEUED，EXEC 按顺序执行并返回全部结果，DISCARD 丢弃排队的命令；
+    排队的单条命令出错不影响其它命令，没有 MULTI 的 EXEC 与嵌套 MULTI 返回错误
+    """
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.set("tx:counter", "1")
+        pipe.incrby("tx:counter", 5)
+        pipe.get("tx:counter")
+        results = await pipe.execute()
+    if results != [True, 6, b"6"]:
+        print(f"❌ 事务返回 {results}")
+        return False
+
+    conn = UnixDomainSocketConnection(path=client.connection_pool.connection_kwargs['path'], protocol=2)
+    await conn.connect()
+
+    async def call(*args):
+        await conn.send_command(*args)
+        try:
+            return await conn.read_response()
+        except ResponseError as e:
+            return e
+
+    try:
+        replies = [await call("MULTI"), await call("SET", "tx:a", "x"), await call("INCR", "tx:a"),
+                   await call("SET", "tx:b", "1"), await call("EXEC")]
+        if replies[:4] != [b"OK", b"QUEUED", b"QUEUED", b"QUEUED"]:
+            print(f"❌ MULTI 期间的回复为 {replies[:4]}")
+            return False
+        executed = replies[4]
+        if executed[0] != b"OK" or not isinstance(executed[1], ResponseError) or executed[2] != b"OK":
+            print(f"❌ EXEC 返回 {executed}")
+            return False
+
+        replies = [await call("MULTI"), await call("SET", "tx:c", "1"), await call("DISCARD")]
+        if replies[2] != b"OK" or await client.exists("tx:c"):
+            print("❌ DISCARD 之后排队的命令仍被执行")
+            return False
+
+        for args in (("EXEC",), ("DISCARD",)):
+            if not isinstance(await call(*args), ResponseError):
+                print(f"❌ 没有 MULTI 的 {args[0]} 没有返回错误")
+                return False
+        await call("MULTI")
+        nested = await call("MULTI")
+        await call("DISCARD")
+        if not isinstance(nested, ResponseError):
+            print("❌ 嵌套 MULTI 没有返回错误")
+            return False
+    finally:
+        await conn.disconnect()
+
+    print("✅ MULTI / EXEC / DISCARD 行为与 Redis 一致")
+    return True
+
+
+async def check_lua_scripts(client: redis.Redis) -> bool:
+    """
+    fastapi-limiter 的脚本经 SCRIPT LOAD + EVALSHA 在共享 KV 上执行，固定窗口内超过上限时返回剩余毫秒数；
+    未登记的 sha 返回 NOSCRIPT，没有 Python 实现的脚本返回错误
+    """
+    sha = await client.script_load(FastAPILimiter.lua_script)
+    if await client.script_exists(sha, "0" * 40) != [True, False]:
+        print("❌ SCRIPT EXISTS 结果不正确")
+        return False
+    replies = [await client.evalsha(sha, 1, "limiter:key", "2", "1000") for _ in range(3)]
+    if replies[:2] != [0, 0] or not 0 < replies[2] <= 1000:
+        print(f"❌ 限流脚本返回 {replies}")
+        return False
+    if await client.eval(FastAPILimiter.lua_script, 1, "limiter:other", "2", "1000") != 0:
+        print("❌ EVAL 没有执行限流脚本")
+        return False
+
+    try:
+        await client.evalsha("0" * 40, 0)
+        print("❌ 未登记的 sha 没有返回 NOSCRIPT")
+        return False
+    except NoScriptError:
+        pass
+    try:
+        await client.eval("return redis.call('time')", 0)
+        print("❌ 没有 Python 实现的脚本被执行")
+        return False
+    except ResponseError:
+        pass
+
+    print("✅ Lua 脚本在共享 KV 上按 Python 实现执行")
+    return True
+
+
+async def main() -> int:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "kv.sock")
+        server = await start_server(path)
+        # 与 _redis 中的共享 KV 连接池相同，只支持 RESP2
+        client = redis.Redis(unix_socket_path=path, protocol=2)
+        try:
+            for check in (check_scan_cursor, check_multi_exec, check_lua_scripts):
+                print(f"\n开始检查 {check.__name__}...")
+                results.append(await check(client))
+        finally:
+            await client.aclose()
+            await server.stop()
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
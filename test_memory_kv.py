@@ -0,0 +1,272 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from _memory_kv import MemoryKV
+
+
+async def check_heap_expiry() -> bool:
+    """
+    到期的键被清理；覆盖写入、延长或去掉过期时间后，堆中的旧记录不会误删新值
+    """
+    kv = MemoryKV(maxmemory=0)
+    for i in range(100):
+        await kv.set(f"short_{i}", "1", px=5)
+    await kv.set("rewritten", "old", px=5)
+    await kv.set("rewritten", "new")
+    await kv.set("extended", "1", px=5)
+    await kv.pexpire("extended", 60000)
+    await kv.set("lazy", "1", px=5)
+    await asyncio.sleep(0.02)
+
+    if await kv.get("lazy") is not None:
+        print("❌ 读取已到期的键返回了旧值")
+        return False
+    kv._reap(time.time())
+    if any(f"short_{i}" in kv._store for i in range(100)):
+        print("❌ 到期的键没有被清理")
+        return False
+    if await kv.get("rewritten") != "new" or await kv.get("extended") != "1":
+        print("❌ 堆中的旧记录删除了覆盖写入或延长过期的键")
+        return False
+    if kv.expired != 101 or await kv.pttl("rewritten") != -1 or not 0 < await kv.pttl("extended") <= 60000:
+        print(f"❌ 过期计数 {kv.expired} 或剩余时间不正确")
+        return False
+    if any(when <= time.time() for when, _ in kv._expiry):
+        print("❌ 清理后堆中仍有已到期的记录")
+        return False
+
+    print("✅ 过期堆只删除仍然匹配的到期键")
+    return True
+
+
+async def fill(kv: MemoryKV, keys, px=None):
+    """写入键后把内存上限收紧到当前占用，之后每次写入都需要淘汰"""
+    for key in keys:
+        await kv.set(key, "x" * 16, px=px)
+    kv.maxmemory = kv.used_memory
+
+
+async def check_eviction_policies() -> bool:
+    """
+    allkeys-lru 淘汰最久未访问的键，allkeys-lfu 保留高频键，volatile-ttl 淘汰最早过期的键，
+    volatile-* 只淘汰带过期时间的键、没有可淘汰的键时与 noeviction 一样拒绝写入
+    """
+    kv = MemoryKV(maxmemory=0, policy='allkeys-lru')
+    await fill(kv, [f"k{i}" for i in range(10)])
+    await kv.get("k0")
+    await kv.set("new", "x" * 16)
+    if "k0" not in kv._store or "k1" in kv._store:
+        print("❌ allkeys-lru 没有淘汰最久未访问的键")
+        return False
+
+    kv = MemoryKV(maxmemory=0, policy='allkeys-lfu')
+    await fill(kv, [f"k{i}" for i in range(10)])
+    for _ in range(50):
+        await kv.get("k0")
+    await kv.get("k1")
+    await kv.set("new", "x" * 16)
+    if "k0" not in kv._store or "k2" in kv._store:
+        print("❌ allkeys-lfu 淘汰了高频访问的键")
+        return False
+
+    kv = MemoryKV(maxmemory=0, policy='volatile-ttl')
+    await kv.set("later", "x" * 16, px=60000)
+    await kv.set("sooner", "x" * 16, px=30000)
+    await fill(kv, ["persistent"])
+    await kv.set("new", "x" * 16)
+    if "sooner" in kv._store or "later" not in kv._store or "persistent" not in kv._store:
+        print("❌ volatile-ttl 没有淘汰最早过期的键")
+        return False
+
+    for policy in ('volatile-lru', 'volatile-lfu'):
+        kv = MemoryKV(maxmemory=0, policy=policy)
+        await kv.set("p0", "x" * 16)
+        await kv.set("v0", "x" * 16, px=60000)
+        await fill(kv, ["p1", "v1"], px=None)
+        await kv.pexpire("v1", 60000)
+        if not await kv.set("n0", "x" * 16) or not await kv.set("n1", "x" * 16):
+            print(f"❌ {policy} 有带过期时间的键可淘汰时拒绝了写入")
+            return False
+        if any(key not in kv._store for key in ("p0", "p1")) or "v0" in kv._store or "v1" in kv._store:
+            print(f"❌ {policy} 淘汰了永久键或没有淘汰带过期时间的键")
+            return False
+        if await kv.set("n2", "x" * 16) or kv.rejected != 1:
+            print(f"❌ {policy} 没有可淘汰的键时没有拒绝写入")
+            return False
+
+    kv = MemoryKV(maxmemory=0, policy='noeviction')
+    await fill(kv, ["k0"])
+    if await kv.set("new", "x" * 16) or await kv.get("k0") is None:
+        print("❌ noeviction 没有拒绝写入")
+        return False
+
+    print("✅ 各淘汰策略选出的键正确")
+    return True
+
+
+async def check_volatile_eviction_skips_persistent() -> bool:
+    """
+    大量永久键排在前面时，volatile-lru 淘汰不逐个跳过永久键
+    """
+    kv = MemoryKV(maxmemory=0, policy='volatile-lru')
+    for i in range(50000):
+        await kv.set(f"p{i}", "x" * 16)
+    await fill(kv, [f"v{i}" for i in range(2000)], px=60000)
+    start = time.monotonic()
+    for i in range(1000):
+        await kv.set(f"w{i}", "x" * 16, px=60000)
+    elapsed = time.monotonic() - start
+    if kv.evicted < 1000 or kv.get_stats()['total_keys'] != 52000:
+        print(f"❌ 淘汰 {kv.evicted} 个键，剩余 {kv.get_stats()['total_keys']} 个")
+        return False
+    if elapsed > 1:
+        print(f"❌ 1000 次淘汰耗时 {elapsed:.2f}s")
+        return False
+
+    print(f"✅ 1000 次 volatile-lru 淘汰耗时 {elapsed * 1000:.0f}ms")
+    return True
+
+
+async def check_snapshot_roundtrip() -> bool:
+    """
+    stop 写入快照、start 加载快照：保留值类型与过期时间，跳过已过期的键与有序集合；
+    同一路径只有一个实例写入，格式不符的文件被忽略
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "kv.snapshot")
+        kv = MemoryKV(maxmemory=0, snapshot_path=path)
+        await kv.start()
+        await kv.set("text", "中文")
+        await kv.set("raw", b"\x00\xff")
+        await kv.incr("counter", 42)
+        await kv.set("ttl", "1", ex=60)
+        await kv.set("expired", "1", px=5)
+        await kv.zadd("zset", {"a": 1})
+        other = MemoryKV(maxmemory=0, snapshot_path=path)
+        other._changes = 1
+        if await kv.save_snapshot() != 5 or await other.save_snapshot() != 0:
+            print("❌ 同一快照路径有多个实例写入")
+            return False
+        if await kv.save_snapshot() != 0:
+            print("❌ 没有变化时仍然写入快照")
+            return False
+        await asyncio.sleep(0.01)
+        await kv.stop()
+
+        restored = MemoryKV(maxmemory=0, snapshot_path=path)
+        await restored.start()
+        try:
+            values = [await restored.get(key) for key in ("text", "raw", "counter", "expired", "zset")]
+            if values != ["中文", b"\x00\xff", "42", None, None]:
+                print(f"❌ 快照恢复的值为 {values}")
+                return False
+            if restored.snapshot_loaded != 4 or not 59000 < await restored.pttl("ttl") <= 60000:
+                print(f"❌ 恢复 {restored.snapshot_loaded} 个键，或过期时间没有保留")
+                return False
+        finally:
+            await restored.stop()
+
+        with open(path, "wb") as f:
+            f.write(b"NOTASNAP" + b"\x00" * 32)
+        broken = MemoryKV(maxmemory=0, snapshot_path=path)
+        if broken.load_snapshot() != 0 or broken.get_stats()['total_keys'] != 0:
+            print("❌ 加载了格式不符的快照")
+            return False
+
+    print("✅ 快照写入与加载正确")
+    return True
+
+
+async def check_iscan_chunks() -> bool:
+    """
+    键空间大于一批时 iscan 分多批产出，扫描期间一直存在的键恰好产出一次，
+    扫描中途增删键不影响其余键
+    """
+    kv = MemoryKV(maxmemory=0)
+    for i in range(5000):
+        await kv.set(f"pushTask:{i}", "1")
+    for i in range(3000):
+        await kv.set(f"detail_{i}", "1")
+    await kv.set("pushTask:expired", "1", px=1)
+    await asyncio.sleep(0.01)
+
+    chunks, seen = 0, []
+    async for chunk in kv.iscan("pushTask:*", count=500):
+        chunks += 1
+        seen.extend(chunk)
+        if chunks == 1:
+            # 扫描中途删除与新增键
+            for i in range(4000, 5000):
+                await kv.delete(f"pushTask:{i}")
+            for i in range(5000, 5500):
+                await kv.set(f"pushTask:{i}", "1")
+
+    if chunks < 2:
+        print(f"❌ 5000 个键只产出了 {chunks} 批")
+        return False
+    if len(seen) != len(set(seen)):
+        print("❌ 同一个键产出了多次")
+        return False
+    stable = {f"pushTask:{i}" for i in range(4000)}
+    if not stable <= set(seen):
+        print(f"❌ 扫描期间一直存在的键缺失 {len(stable - set(seen))} 个")
+        return False
+    if any(not key.startswith("pushTask:") for key in seen) or "pushTask:expired" in seen:
+        print("❌ 产出了不匹配或已过期的键")
+        return False
+
+    keys = await kv.scan_iter("*")
+    if len(keys) != 4500 + 3000 or len(set(keys)) != len(keys):
+        print(f"❌ scan_iter('*') 返回 {len(keys)} 个键，应为 7500")
+        return False
+
+    print(f"✅ iscan 分 {chunks} 批产出，结果不重复不遗漏")
+    return True
+
+
+async def check_scan_cursor() -> bool:
+    """
+    scan 按游标分批返回，游标为 0 表示结束；没有分隔符的模式同样适用
+    """
+    kv = MemoryKV(maxmemory=0)
+    for i in range(2000):
+        await kv.set(f"detail_{i}", "1")
+        await kv.set(f"vv:{i}", "1")
+
+    cursor, calls, keys = 0, 0, []
+    while True:
+        cursor, batch = await kv.scan(cursor, "detail_1*", count=100)
+        calls += 1
+        keys.extend(batch)
+        if cursor == 0:
+            break
+    expected = {f"detail_{i}" for i in range(2000) if str(i).startswith("1")}
+    if calls < 2 or set(keys) != expected or len(keys) != len(expected):
+        print(f"❌ 游标扫描 {calls} 次返回 {len(keys)} 个键，应为 {len(expected)}")
+        return False
+
+    print(f"✅ scan 游标分 {calls} 次完成")
+    return True
+
+
+async def main() -> int:
+    results = []
+    for check in (check_heap_expiry, check_eviction_policies, check_volatile_eviction_skips_persistent,
+                  check_snapshot_roundtrip, check_iscan_chunks, check_scan_cursor):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,140 @@
+import asyncio
+import sys
+
+import fakeredis
+
+import _ratelimit
+import _redis
+from _ratelimit import RateLimitEngine, TokenBucket
+
+
+def use_fake_redis(server: fakeredis.FakeServer):
+    """让 _redis 以 Redis 模式连接到 fakeredis"""
+    _redis.redis_client = fakeredis.FakeAsyncRedis(server=server)
+    _redis.use_memory_kv = False
+    _redis._storage_initialized = True
+
+
+async def check_token_bucket() -> bool:
+    """
+    令牌按窗口线性补充且不超过容量，wait_ms 为距离下一个令牌的时间，被存储层拒绝时为窗口剩余时间
+    """
+    bucket = TokenBucket(4, 1000, 0)
+    bucket.tokens = 0
+    if bucket.wait_ms(0) != 250:
+        print(f"❌ 空桶等待 {bucket.wait_ms(0)}ms，应为 250ms")
+        return False
+    bucket.refill(500)
+    if bucket.tokens != 2:
+        print(f"❌ 半个窗口补充了 {bucket.tokens} 个令牌，应为 2")
+        return False
+    bucket.refill(5000)
+    if bucket.tokens != 4:
+        print(f"❌ 令牌数 {bucket.tokens} 超过容量")
+        return False
+    bucket.blocked_until = 5800
+    if bucket.wait_ms(5000) != 800:
+        print("❌ 被拒绝时等待时间不是窗口剩余时间")
+        return False
+
+    print("✅ 令牌桶补充与等待时间正确")
+    return True
+
+
+async def check_local_limit() -> bool:
+    """
+    local 模式只做本地判定：用完令牌后拒绝，补充后放行；take 在额度不足时只放行一部分
+    """
+    engine = RateLimitEngine('local')
+    results = [await engine.check("local", 3, 100) for _ in range(4)]
+    if results[:3] != [0, 0, 0] or results[3] <= 0:
+        print(f"❌ 本地判定结果为 {results}")
+        return False
+    await asyncio.sleep(0.05)
+    if await engine.check("local", 3, 100) != 0:
+        print("❌ 令牌补充后仍然拒绝")
+        return False
+
+    if await engine.take("batch", 5, 60000, 3) != 3 or await engine.take("batch", 5, 60000, 3) != 2:
+        print("❌ take 没有按剩余额度部分放行")
+        return False
+    if await engine.take("batch", 5, 60000, 1) != 0 or await engine.take("batch", 5, 60000, 0) != 0:
+        print("❌ 额度用完后 take 仍然放行")
+        return False
+    if engine.allowed != 9 or engine.limited != 2 or engine._pending:
+        print(f"❌ 统计为 {engine.get_stats()}")
+        return False
+
+    print("✅ 本地令牌桶判定与部分放行正确")
+    return True
+
+
+async def check_hybrid_reconcile() -> bool:
+    """
+    两个实例各自本地放行，对账后得到全局用量，超过上限的键在窗口剩余时间内被两个实例拒绝
+    """
+    a, b = RateLimitEngine('hybrid'), RateLimitEngine('hybrid')
+    for engine in (a, b):
+        for _ in range(3):
+            if await engine.check("shared", 5, 60000) != 0:
+                print("❌ 对账前本地额度内的请求被拒绝")
+                return False
+    await a.flush()
+    await b.flush()
+    if await b.check("shared", 5, 60000) == 0 or b.remote_limited != 1:
+        print("❌ 全局用量超过上限后实例 b 仍然放行")
+        return False
+    await a.check("shared", 5, 60000)
+    await a.flush()
+    if await a.check("shared", 5, 60000) == 0:
+        print("❌ 全局用量超过上限后实例 a 仍然放行")
+        return False
+    counters = [key async for key in _redis.redis_client.scan_iter("ratelimit:shared:*")]
+    if len(counters) != 1 or int(await _redis.redis_client.get(counters[0])) != 7:
+        print("❌ 存储层的窗口计数不正确")
+        return False
+
+    print("✅ 多实例用量对账后统一拒绝")
+    return True
+
+
+async def check_inline_sync() -> bool:
+    """
+    未对账的放行数超过 RATE_LIMIT_MAX_DRIFT 时在请求内对账：恰好用满上限的请求放行，超过上限的请求拒绝
+    """
+    _ratelimit.RATE_LIMIT_MAX_DRIFT = 0
+    try:
+        a, b = RateLimitEngine('hybrid'), RateLimitEngine('hybrid')
+        results = [await a.check("inline", 3, 60000), await b.check("inline", 3, 60000),
+                   await a.check("inline", 3, 60000), await b.check("inline", 3, 60000)]
+    finally:
+        _ratelimit.RATE_LIMIT_MAX_DRIFT = 4
+    if results[:3] != [0, 0, 0] or results[3] <= 0:
+        print(f"❌ 请求内对账的结果为 {results}，应放行前 3 个")
+        return False
+    if a.inline_syncs != 2 or b.inline_syncs != 2:
+        print("❌ 没有在请求内对账")
+        return False
+
+    print("✅ 请求内对账精确到上限")
+    return True
+
+
+async def main() -> int:
+    use_fake_redis(fakeredis.FakeServer())
+    results = []
+    for check in (check_token_bucket, check_local_limit, check_hybrid_reconcile, check_inline_sync):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,84 @@
+import asyncio
+import sys
+import time
+
+import _redis
+import _registry
+from _memory_kv import get_memory_kv
+from _registry import INSTANCES_KEY, get_live_instances, register_instance, unregister_instance
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+async def check_register_metadata() -> bool:
+    """
+    注册的实例带有版本与负载，不包含主机名与进程号
+    """
+    await register_instance("a", "1.1.4", {"commit": "abcdef12"})
+    instances = await get_live_instances()
+    if [instance['id'] for instance in instances] != ["a"]:
+        print(f"❌ 存活实例为 {instances}")
+        return False
+    instance = instances[0]
+    if instance.get('version') != "1.1.4" or not isinstance(instance.get('load'), float):
+        print(f"❌ 实例元数据缺少版本或负载: {instance}")
+        return False
+    if 'host' in instance or 'pid' in instance:
+        print(f"❌ 实例元数据包含主机信息: {instance}")
+        return False
+    if instance.get('commit') != "abcdef12" or not isinstance(instance.get('heartbeat'), int):
+        print(f"❌ 实例元数据不完整: {instance}")
+        return False
+
+    print("✅ 实例元数据包含版本与负载")
+    return True
+
+
+async def check_stale_and_unregister() -> bool:
+    """
+    超过 INSTANCE_TTL 没有心跳的实例被移除，正常退出的实例立即移除
+    """
+    memory_kv = await get_memory_kv()
+    await register_instance("b", "1.1.4")
+    await memory_kv.zadd(INSTANCES_KEY, {"stale": time.time() - _registry.INSTANCE_TTL - 1})
+    ids = [instance['id'] for instance in await get_live_instances()]
+    if "stale" in ids or "b" not in ids:
+        print(f"❌ 存活实例为 {ids}")
+        return False
+    if await memory_kv.zscore(INSTANCES_KEY, "stale") is not None:
+        print("❌ 过期实例没有从有序集合中删除")
+        return False
+
+    await unregister_instance("b")
+    ids = [instance['id'] for instance in await get_live_instances()]
+    if "b" in ids:
+        print("❌ 注销后实例仍然存活")
+        return False
+
+    print("✅ 过期与注销的实例被移除")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    results = []
+    for check in (check_register_metadata, check_stale_and_unregister):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,97 @@
+import asyncio
+import sys
+
+import httpx
+from fastapi import FastAPI
+from fastapi_limiter import FastAPILimiter, default_identifier
+from fastapi_limiter.depends import RateLimiter
+from starlette.requests import Request
+from starlette.responses import Response
+
+import _redis
+import _search
+from _cache import swr_fetch
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+class FakeUpstream:
+    """返回固定的详情并记录调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, endpoint, url, **kwargs):
+        self.calls += 1
+        return httpx.Response(200, json={"code": 0, "data": "ok"}, request=httpx.Request("GET", url))
+
+
+async def check_batch_charges_misses() -> bool:
+    """
+    批量接口命中缓存的子操作不计回源额度；未命中的按不同缓存键计费，超出 BATCH_UPSTREAM_PER_SECOND 的逐项返回 429
+    """
+    upstream = FakeUpstream()
+    _search.upstream_get = upstream
+    for id in (1, 2):
+        await swr_fetch(*_search.detail_spec(id))
+    upstream.calls = 0
+
+    app = FastAPI()
+    app.include_router(_search.searchRouter)
+    ids = [1, 2, 10, 11, 10, 12, 13, 14]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/query/ole/batch", json={"detail": ids})
+        statuses = {item['id']: item['status'] for item in response.json()['results']}
+        expected = {1: 200, 2: 200, 10: 200, 11: 200, 12: 200, 13: 429, 14: 429}
+        if statuses != expected:
+            print(f"❌ 子操作状态为 {statuses}，应为 {expected}")
+            return False
+        if upstream.calls != _search.BATCH_UPSTREAM_PER_SECOND:
+            print(f"❌ 回源 {upstream.calls} 次，应为 {_search.BATCH_UPSTREAM_PER_SECOND} 次")
+            return False
+
+        response = await client.post("/api/query/ole/batch", json={"detail": [1, 2, 10, 15]})
+        statuses = {item['id']: item['status'] for item in response.json()['results']}
+        if statuses != {1: 200, 2: 200, 10: 200, 15: 429}:
+            print(f"❌ 额度用完后子操作状态为 {statuses}")
+            return False
+
+    print("✅ 批量接口按未命中的子操作计入回源额度")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    FastAPILimiter.prefix = "fastapi-limiter"
+    FastAPILimiter.identifier = default_identifier
+
+    async def _noop(self, request: Request, response: Response):
+        return None
+
+    async def _plain(data):
+        return data
+
+    # 路由级限流与解密不在本检查范围内
+    RateLimiter.__call__ = _noop
+    _search.checkSum = _plain
+    results = []
+    for check in (check_batch_charges_misses,):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
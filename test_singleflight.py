@@ -0,0 +1,129 @@
+import asyncio
+import sys
+
+import _redis
+import _singleflight
+from _redis import acquire_lock, get_key, release_lock, set_key
+from _singleflight import SingleFlight
+
+
+def use_memory_kv():
+    """让 _redis 直接使用本进程的内存 KV"""
+    _redis.redis_client = None
+    _redis.use_memory_kv = True
+    _redis._storage_initialized = True
+
+
+class Fetch:
+    """等待 release 后返回结果或抛出异常，并记录调用次数"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def check_coalesce() -> bool:
+    """
+    相同键的并发调用只执行一次并共享结果（包括异常）；某个等待者被取消不影响其它等待者；
+    调用结束后键被释放，再次调用重新执行
+    """
+    flight = SingleFlight()
+    fetch = Fetch(result="value")
+    waiters = [asyncio.create_task(flight.do("detail_1", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    if not flight.in_flight("detail_1"):
+        print("❌ 调用进行中时 in_flight 为 False")
+        return False
+    waiters[0].cancel()
+    fetch.release.set()
+    results = await asyncio.gather(*waiters[1:])
+    if results != ["value"] * 4 or fetch.calls != 1 or not waiters[0].cancelled():
+        print(f"❌ 5 个并发调用执行了 {fetch.calls} 次，结果 {results}")
+        return False
+    stats = flight.get_stats()
+    if stats['leaders'] != 1 or stats['shared'] != 4 or flight.in_flight("detail_1"):
+        print(f"❌ 合并统计为 {stats}")
+        return False
+
+    failing = Fetch(error=ValueError("upstream"))
+    waiters = [asyncio.create_task(flight.do("detail_1", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    failing.release.set()
+    errors = await asyncio.gather(*waiters, return_exceptions=True)
+    if failing.calls != 1 or not all(isinstance(e, ValueError) for e in errors):
+        print(f"❌ 异常没有传给所有等待者: {errors}")
+        return False
+
+    print("✅ 并发调用合并为一次")
+    return True
+
+
+async def check_redis_lock() -> bool:
+    """
+    Redis 锁模式下，其它实例持有锁时等待其写入缓存并直接返回；等待超时后自己回源
+    """
+    _singleflight.SINGLEFLIGHT_POLL_INTERVAL = 0.01
+    _singleflight.SINGLEFLIGHT_WAIT_TIMEOUT = 0.1
+    flight = SingleFlight(redis_lock=True)
+    token = await acquire_lock("singleflight:detail_2", 10000)
+
+    async def peek():
+        return await get_key("detail_2")
+
+    fetch = Fetch(result="local")
+    fetch.release.set()
+    waiter = asyncio.create_task(flight.do("detail_2", fetch, peek))
+    await asyncio.sleep(0.03)
+    await set_key("detail_2", "remote")
+    if await waiter != "remote" or fetch.calls != 0 or flight.get_stats()['remote_hits'] != 1:
+        print("❌ 没有等待其它实例写入的缓存")
+        return False
+
+    if await flight.do("detail_3", fetch, peek) != "local" or fetch.calls != 1:
+        print("❌ 拿到锁时没有自己回源")
+        return False
+    other = await acquire_lock("singleflight:detail_3", 10000)
+    if not other:
+        print("❌ 回源结束后锁没有释放")
+        return False
+
+    async def empty():
+        return None
+
+    if await flight.do("detail_3", fetch, empty) != "local" or fetch.calls != 2:
+        print("❌ 等待超时后没有自己回源")
+        return False
+    await release_lock("singleflight:detail_2", token)
+    await release_lock("singleflight:detail_3", other)
+
+    print("✅ Redis 锁模式跨实例合并")
+    return True
+
+
+async def main() -> int:
+    use_memory_kv()
+    results = []
+    for check in (check_coalesce, check_redis_lock):
+        print(f"\n开始检查 {check.__name__}...")
+        results.append(await check())
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
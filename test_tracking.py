@@ -0,0 +1,228 @@
+import asyncio
+import sys
+
+from redis.asyncio import ConnectionPool
+
+import _tracking
+from _l1cache import _MISSING, l1_cache
+from _redis import _l1_set
+from _tracking import client_tracking
+
+
+def _bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class StubRedis:
+    """
+    最小的 RESP3 服务端：只实现 HELLO 3、CLIENT TRACKING 与 PING，
+    可以主动推送失效通知、断开连接，或不再回复 PING 模拟静默断开的连接
+    """
+
+    def __init__(self):
+        self.writers = []
+        self.accepted = 0
+        self.tracking = asyncio.Event()
+        self.answer_ping = True
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.drop_clients()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def push_invalidate(self, keys):
+        """keys 为 None 时推送 FLUSHDB 对应的空键列表"""
+        if keys is None:
+            payload = b">2\r\n$10\r\ninvalidate\r\n_\r\n"
+        else:
+            payload = b">2\r\n$10\r\ninvalidate\r\n*%d\r\n" % len(keys) + b"".join(_bulk(k.encode()) for k in keys)
+        for writer in self.writers:
+            writer.write(payload)
+            await writer.drain()
+
+    def drop_clients(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            header = await reader.readline()
+            args.append((await reader.readexactly(int(header[1:]) + 2))[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        self.accepted += 1
+        self.writers.append(writer)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                command = args[0].upper()
+                if command == b"HELLO":
+                    writer.write(b"%2\r\n+server\r\n+stub\r\n+proto\r\n:3\r\n")
+                elif command == b"PING":
+                    if not self.answer_ping:
+                        continue
+                    writer.write(b"+PONG\r\n")
+                elif command == b"CLIENT" and args[1].upper() == b"TRACKING":
+                    writer.write(b"+OK\r\n")
+                    self.tracking.set()
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if writer in self.writers:
+                self.writers.remove(writer)
+            writer.close()
+
+
+async def _wait_for(predicate, timeout: float = 3) -> bool:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def check_invalidate(server: StubRedis) -> bool:
+    """
+    收到 invalidate 推送后对应键从 L1 删除，空键列表（FLUSHDB）清空所有被跟踪前缀
+    """
+    l1_cache.set("vv_a", "1", ttl=client_tracking.ttl_for("vv_a"))
+    l1_cache.set("vv_b", "2", ttl=client_tracking.ttl_for("vv_b"))
+    await server.push_invalidate(["vv_a"])
+    if not await _wait_for(lambda: "vv_a" not in l1_cache._store):
+        print("❌ 失效通知没有删除 vv_a")
+        return False
+    if l1_cache.get("vv_b") != "2":
+        print("❌ 未被通知的 vv_b 也被删除了")
+        return False
+
+    await server.push_invalidate(None)
+    if not await _wait_for(lambda: "vv_b" not in l1_cache._store):
+        print("❌ FLUSHDB 通知没有清空被跟踪的键")
+        return False
+
+    print("✅ 失效通知正确删除 L1 条目")
+    return True
+
+
+async def check_epoch_guard(server: StubRedis) -> bool:
+    """
+    读取期间收到失效通知时，读到的旧值不写入 L1
+    """
+    epoch = client_tracking.epoch
+    await server.push_invalidate(["vv_c"])
+    if not await _wait_for(lambda: client_tracking.epoch != epoch):
+        print("❌ 失效通知没有递增 epoch")
+        return False
+    _l1_set("vv_c", "stale", epoch=epoch)
+    if l1_cache.get("vv_c") is not _MISSING:
+        print("❌ epoch 变化后旧值仍写入了 L1")
+        return False
+
+    _l1_set("vv_c", "fresh", epoch=client_tracking.epoch)
+    if l1_cache.get("vv_c") != "fresh":
+        print("❌ epoch 未变化时没有写入 L1")
+        return False
+
+    print("✅ epoch 变化时丢弃读取结果")
+    return True
+
+
+async def check_disconnect_reset(server: StubRedis) -> bool:
+    """
+    连接断开时清空被跟踪的键、停止放宽缓存时间，随后自动重连
+    """
+    l1_cache.set("vv_d", "1", ttl=client_tracking.ttl_for("vv_d"))
+    connects = client_tracking.connects
+    server.tracking.clear()
+    server.drop_clients()
+    if not await _wait_for(lambda: not client_tracking.active):
+        print("❌ 连接断开后跟踪仍为 active")
+        return False
+    if "vv_d" in l1_cache._store:
+        print("❌ 连接断开后被跟踪的键没有清空")
+        return False
+    if client_tracking.ttl_for("vv_d") is not None:
+        print("❌ 连接断开后仍放宽缓存时间")
+        return False
+    if not await _wait_for(lambda: client_tracking.connects > connects and client_tracking.active):
+        print("❌ 连接断开后没有重连")
+        return False
+
+    print("✅ 连接断开时清空 L1 并重连")
+    return True
+
+
+async def check_ping_timeout(server: StubRedis) -> bool:
+    """
+    PING 没有回复时视为连接已断开，清空被跟踪的键并重连
+    """
+    l1_cache.set("vv_e", "1", ttl=client_tracking.ttl_for("vv_e"))
+    accepted = server.accepted
+    ping_timeouts = client_tracking.ping_timeouts
+    server.answer_ping = False
+    try:
+        if not await _wait_for(lambda: client_tracking.ping_timeouts > ping_timeouts):
+            print("❌ PING 没有回复时没有判定超时")
+            return False
+        if not await _wait_for(lambda: "vv_e" not in l1_cache._store):
+            print("❌ PING 超时后被跟踪的键没有清空")
+            return False
+    finally:
+        server.answer_ping = True
+    if not await _wait_for(lambda: server.accepted > accepted and client_tracking.active):
+        print("❌ PING 超时后没有重连")
+        return False
+
+    print("✅ PING 超时后清空 L1 并重连")
+    return True
+
+
+async def main() -> int:
+    _tracking.CLIENT_TRACKING_PING_INTERVAL = 0.2
+    _tracking.CLIENT_TRACKING_RETRY = 0.05
+
+    server = StubRedis()
+    port = await server.start()
+    pool = ConnectionPool(host="127.0.0.1", port=port)
+    client_tracking.start(pool)
+    results = []
+    try:
+        if not await _wait_for(lambda: client_tracking.active):
+            print("❌ 跟踪连接没有建立")
+            return 1
+        for check in (check_invalidate, check_epoch_guard, check_disconnect_reset, check_ping_timeout):
+            print(f"\n开始检查 {check.__name__}...")
+            results.append(await check(server))
+    finally:
+        await client_tracking.close()
+        await pool.disconnect()
+        await server.stop()
+
+    if all(results):
+        print("\n🎉 全部检查通过")
+        return 0
+
+    print("\n💥 检查未通过")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)